@@ -47,6 +47,41 @@ def warm_up_connection():
 warm_up_connection()
 
 
+# Keep the most-used dashboard views pre-computed in the background
+@st.cache_resource
+def start_cache_prewarm():
+    """Start the periodic dashboard cache pre-warm job (once per process)."""
+    from services.cache_warmer import start_prewarm_scheduler
+    start_prewarm_scheduler()
+    return True
+
+start_cache_prewarm()
+
+
+# Build derived tables once (kept current by uploads afterwards)
+@st.cache_resource
+def start_derived_table_backfill():
+    """Start the one-time appointment_journey / appointments_current / slot_availability / identity_index /
+    anomalies / canonical_cards backfills if not completed, and sync the analytics snapshot (if configured)."""
+    from services.journey_service import start_journey_backfill
+    from services.appointment_current_service import start_current_appointments_backfill
+    from services.slot_availability_service import start_slot_availability_backfill
+    from services.identity_index_service import start_identity_index_backfill
+    from services.anomaly_index_service import start_anomaly_index_backfill
+    from services.canonical_card_service import start_canonical_cards_backfill
+    from services.analytics_snapshot import sync_snapshot_in_background
+    start_journey_backfill()
+    start_current_appointments_backfill()
+    start_slot_availability_backfill()
+    start_identity_index_backfill()
+    start_anomaly_index_backfill()
+    start_canonical_cards_backfill()
+    sync_snapshot_in_background()
+    return True
+
+start_derived_table_backfill()
+
+
 # Cached functions for better performance
 @st.cache_data(ttl=60)  # Cache for 60 seconds
 def get_quick_stats():
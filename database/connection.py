@@ -6,6 +6,7 @@ import streamlit as st
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Track if migrations have been run this session
 _migrations_done = False
@@ -68,6 +69,19 @@ else:
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Identifier columns served by the substring search index (services/search_index.py):
+# pg_trgm GIN indexes on PostgreSQL, an FTS5 trigram table "<table>_search" on SQLite
+SEARCH_INDEX_COLUMNS = {
+    'cards': ('appointment_id', 'card_id', 'serial_number', 'work_permit_no'),
+    'complete_diffs': ('appointment_id', 'card_id', 'serial_number', 'work_permit_no'),
+}
+
+# Max concurrent queries a single dashboard function may fan out to
+# (see run_concurrent_queries). Keep it at or below pool_size so one page
+# load cannot exhaust the pool (pool_size=3 + max_overflow=5 on PostgreSQL).
+# SQLite runs the queries sequentially.
+QUERY_FANOUT_WORKERS = int(os.environ.get("QUERY_FANOUT_WORKERS", "1" if is_sqlite else "3"))
+
 
 def get_engine():
     """Get the database engine."""
@@ -112,6 +126,33 @@ def session_scope():
         session.close()
 
 
+def run_concurrent_queries(queries: dict, max_workers: int = None) -> dict:
+    """Run independent read queries concurrently, each on its own pooled session.
+
+    Args:
+        queries: {name: fn(session) -> result}. Each fn must only read and
+            must not share ORM objects with the others.
+        max_workers: Fan-out width (default QUERY_FANOUT_WORKERS).
+
+    Returns:
+        {name: result}. The first exception raised by any query is re-raised.
+    """
+    def _run(fn):
+        session = SessionLocal()
+        try:
+            return fn(session)
+        finally:
+            session.close()
+
+    workers = max(1, min(max_workers or QUERY_FANOUT_WORKERS, len(queries)))
+    if workers == 1:
+        return {name: _run(fn) for name, fn in queries.items()}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-fanout") as pool:
+        futures = {name: pool.submit(_run, fn) for name, fn in queries.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
 def init_db():
     """Initialize database tables and run migrations (runs only once per app session)."""
     global _migrations_done
@@ -169,7 +210,15 @@ def _run_migrations():
         if 'ix_cards_status_serial' not in existing_indexes:
             migrations.append("CREATE INDEX IF NOT EXISTS ix_cards_status_serial ON cards (print_status, serial_number)")
 
-    # ========== Cards table - partial index for slot cut query ==========
+        # Exact work permit lookup (Search page)
+        if 'ix_cards_work_permit' not in existing_indexes:
+            migrations.append("CREATE INDEX IF NOT EXISTS ix_cards_work_permit ON cards (work_permit_no)")
+
+        # Keyset pagination order (Raw Data page)
+        if 'ix_cards_date_id' not in existing_indexes:
+            migrations.append("CREATE INDEX IF NOT EXISTS ix_cards_date_id ON cards (print_date, id)")
+
+    # ========== Cards table - partial index for slot cut query, prefix search ==========
     if 'cards' in tables and not is_sqlite:
         existing_indexes = {idx['name'] for idx in inspector.get_indexes('cards')}
         if 'ix_cards_wrong_appt' not in existing_indexes:
@@ -179,6 +228,13 @@ def _run_migrations():
                 "WHERE (wrong_date = true OR wrong_branch = true) AND print_status = 'G'"
             )
             _log("Queued index: ix_cards_wrong_appt (partial)")
+        # Appointment ID prefix search (LIKE 'x%' cannot use the default-collation btree)
+        if 'ix_cards_appointment_prefix' not in existing_indexes:
+            migrations.append(
+                "CREATE INDEX IF NOT EXISTS ix_cards_appointment_prefix "
+                "ON cards (appointment_id varchar_pattern_ops)"
+            )
+            _log("Queued index: ix_cards_appointment_prefix (pattern_ops)")
 
     # ========== QLog table - partial indexes for check-in queries ==========
     if 'qlogs' in tables and not is_sqlite:
@@ -211,6 +267,27 @@ def _run_migrations():
             )
             _log("Queued index: ix_appointments_active_cover (partial)")
 
+    # ========== Trigram indexes for partial identifier search (ILIKE '%term%') ==========
+    if not is_sqlite and any(t in tables for t in SEARCH_INDEX_COLUMNS):
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.commit()
+            for table_name, columns in SEARCH_INDEX_COLUMNS.items():
+                if table_name not in tables:
+                    continue
+                existing_indexes = {idx['name'] for idx in inspector.get_indexes(table_name)}
+                for col_name in columns:
+                    index_name = f"ix_{table_name}_{col_name}_trgm"
+                    if index_name not in existing_indexes:
+                        migrations.append(
+                            f"CREATE INDEX IF NOT EXISTS {index_name} "
+                            f"ON {table_name} USING gin ({col_name} gin_trgm_ops)"
+                        )
+                        _log(f"Queued index: {index_name} (trigram)")
+        except Exception as e:
+            _log(f"pg_trgm not available, partial search stays unindexed: {e}")
+
     # ========== QLog table - add missing columns ==========
     if 'qlogs' in tables and not is_sqlite:
         existing_columns = {col['name'] for col in inspector.get_columns('qlogs')}
@@ -335,10 +412,56 @@ def _run_migrations():
             conn.commit()
         _log(f"Migrations applied: {len(migrations)} change(s)")
 
+    if is_sqlite:
+        _create_sqlite_search_tables(tables)
+
     # Load branch master data from Excel if table is empty
     _load_branch_master_if_needed()
 
 
+def _create_sqlite_search_tables(tables):
+    """FTS5 trigram tables mirroring SEARCH_INDEX_COLUMNS, kept current by triggers."""
+    from sqlalchemy import text
+
+    for table_name, columns in SEARCH_INDEX_COLUMNS.items():
+        if table_name not in tables:
+            continue
+        fts = f"{table_name}_search"
+        cols = ", ".join(columns)
+        new_values = ", ".join(f"new.{c}" for c in columns)
+        old_values = ", ".join(f"old.{c}" for c in columns)
+        try:
+            with engine.connect() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": fts}
+                ).first()
+                if exists:
+                    continue
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, "
+                    f"content='{table_name}', content_rowid='id', tokenize='trigram')"
+                ))
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table_name} BEGIN "
+                    f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END"
+                ))
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table_name} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); END"
+                ))
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table_name} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); "
+                    f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END"
+                ))
+                # Index the rows that already exist
+                conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+                conn.commit()
+            _log(f"Created search index: {fts} (FTS5 trigram)")
+        except Exception as e:
+            _log(f"FTS5 trigram not available, partial search on {table_name} stays unindexed: {e}")
+
+
 def _load_branch_master_if_needed():
     """Load branch master data from Excel file if table is empty."""
     from .models import BranchMaster
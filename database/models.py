@@ -115,6 +115,10 @@ class Card(Base):
         Index('ix_cards_date_status', 'print_date', 'print_status'),
         # Composite index for serial unique count with status
         Index('ix_cards_status_serial', 'print_status', 'serial_number'),
+        # Exact work permit lookup (Search page)
+        Index('ix_cards_work_permit', 'work_permit_no'),
+        # Keyset pagination order (Raw Data page)
+        Index('ix_cards_date_id', 'print_date', 'id'),
     )
 
 
@@ -365,6 +369,60 @@ class Appointment(Base):
     )
 
 
+class AppointmentCurrent(Base):
+    """Latest version of each appointment (exactly one row per appointment_id).
+
+    ``appointments`` keeps every imported version (new date/branch rows are
+    appended as history); this table is upserted from it after each
+    appointment upload/delete (services/appointment_current_service.py).
+    """
+    __tablename__ = 'appointments_current'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    appointment_id = Column(String(50), nullable=False)
+    appointment_row_id = Column(Integer)  # appointments.id of the current version
+    upload_id = Column(Integer)
+
+    appt_date = Column(Date)
+    appt_time = Column(String(20))
+    branch_code = Column(String(20))
+    appt_status = Column(String(50))
+
+    version_count = Column(Integer, default=1)  # rows for this appointment_id in appointments
+    updated_at = Column(DateTime, default=now_th, onupdate=now_th)
+
+    __table_args__ = (
+        Index('ix_appointments_current_appt_id', 'appointment_id', unique=True),
+        Index('ix_appointments_current_date_branch', 'appt_date', 'branch_code'),
+        Index('ix_appointments_current_branch_date', 'branch_code', 'appt_date'),
+    )
+
+
+class SlotAvailability(Base):
+    """Booked / cut / available slots per (branch_code, slot_date) for Queue Slots.
+
+    One row per branch and day that has bookings (SUCCESS/WAITING) or slot
+    cuts (good card printed on another day/branch). Refreshed for the
+    affected dates after appointment and report uploads/deletes
+    (services/slot_availability_service.py).
+    """
+    __tablename__ = 'slot_availability'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    branch_code = Column(String(20), nullable=False)
+    slot_date = Column(Date, nullable=False)
+
+    capacity = Column(Integer)  # BranchMaster.max_capacity (None = not set)
+    booked = Column(Integer, default=0)
+    cut = Column(Integer, default=0)
+    available = Column(Integer)  # capacity - booked + cut (None without capacity)
+    updated_at = Column(DateTime, default=now_th, onupdate=now_th)
+
+    __table_args__ = (
+        Index('ix_slot_availability_date_branch', 'slot_date', 'branch_code', unique=True),
+    )
+
+
 # ============== QLog Data Models ==============
 
 class QLogUpload(Base):
@@ -574,3 +632,152 @@ class CardDeliveryRecord(Base):
         Index('ix_card_delivery_date_status', 'create_date', 'print_status'),
         Index('ix_card_delivery_branch', 'branch_code'),
     )
+
+
+# ============== Appointment Journey (derived) ==============
+
+class AppointmentJourney(Base):
+    """One row per appointment_id linking booking, check-in, printing and delivery.
+
+    Derived from Appointment, QLog, BioRecord and CardDeliveryRecord and kept
+    up to date after every upload/delete (services/journey_service.py).
+    """
+    __tablename__ = 'appointment_journey'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    appointment_id = Column(String(50), nullable=False)
+
+    # Booking (latest Appointment version)
+    appt_date = Column(Date)
+    branch_code = Column(String(20))
+    appt_status = Column(String(50))
+
+    # Queue check-in (first QLog with qlog_num)
+    checkin_date = Column(Date)
+    checkin_time = Column(String(20))
+    checkin_branch_code = Column(String(20))
+
+    # Card printing (BioRecord)
+    print_date = Column(Date)                # first print date
+    print_branch_code = Column(String(20))
+    print_status = Column(String(10))        # G if any good card, else latest status
+    serial_number = Column(String(30))       # latest good card (or latest record)
+
+    # Card delivery (latest CardDeliveryRecord)
+    delivery_status = Column(String(10))     # G/B
+    delivery_serial_number = Column(String(30))
+    delivery_date = Column(Date)
+    delivery_sent = Column(Boolean)          # send_flag == 'Y'
+
+    # Derived funnel state: cancelled, no_show, checked_in, skip_queue, served
+    funnel_state = Column(String(20))
+    updated_at = Column(DateTime, default=now_th, onupdate=now_th)
+
+    __table_args__ = (
+        Index('ix_appointment_journey_appt_id', 'appointment_id', unique=True),
+        Index('ix_appointment_journey_branch_date', 'branch_code', 'appt_date'),
+        Index('ix_appointment_journey_checkin', 'checkin_date', 'checkin_branch_code'),
+        Index('ix_appointment_journey_print', 'print_date', 'print_branch_code'),
+    )
+
+
+class IdentityIndex(Base):
+    """Every identifier mentioned by a source row: identifier -> (source table, row).
+
+    One row per (source row, non-empty identifier column) across cards,
+    bad_cards, anomaly_sla, wrong_centers, bio_records, card_delivery_records,
+    appointments and qlogs, with the row's date / branch / status so one
+    lookup by identifier yields a cross-source timeline. Maintained per
+    upload (services/identity_index_service.py).
+    """
+    __tablename__ = 'identity_index'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    identifier = Column(String(50), nullable=False)
+    id_type = Column(String(20), nullable=False)   # appointment, card_id, serial, work_permit
+    source = Column(String(30), nullable=False)    # source table name
+    row_id = Column(Integer, nullable=False)
+    upload_id = Column(Integer, nullable=False)    # report_id for Bio Unified Report tables
+    event_date = Column(Date)
+    branch_code = Column(String(20))
+    status = Column(String(50))
+
+    __table_args__ = (
+        Index('ix_identity_index_identifier', 'identifier'),
+        Index('ix_identity_index_source_upload', 'source', 'upload_id'),
+    )
+
+
+class CardAnomaly(Base):
+    """Precomputed card anomalies per (anomaly type, key, print date, branch).
+
+    Keyed types (key = appointment_id / card_id / serial_number) hold the G
+    cards of keys that have more than one G card in total, so "G > 1 in a
+    date range" is a GROUP BY over these few rows. Flag types (wrong_date,
+    wrong_branch; key '') hold the flagged cards per day and branch.
+    ``member_ids`` lists the card ids of the row. Maintained per report
+    (services/anomaly_index_service.py).
+    """
+    __tablename__ = 'anomalies'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    anomaly_type = Column(String(20), nullable=False)  # multi_g_appt, multi_g_card_id, duplicate_serial, wrong_date, wrong_branch
+    anomaly_key = Column(String(50), nullable=False, default='')
+    event_date = Column(Date)  # cards.print_date
+    branch_code = Column(String(20))
+    card_count = Column(Integer, nullable=False)
+    member_ids = Column(Text)  # comma-separated cards.id, ascending
+
+    __table_args__ = (
+        Index('ix_anomalies_type_date_branch', 'anomaly_type', 'event_date', 'branch_code'),
+        Index('ix_anomalies_type_key', 'anomaly_type', 'anomaly_key'),
+    )
+
+
+class CanonicalCard(Base):
+    """One row per (serial_number, print_status) across the card sources.
+
+    The same card arrives in overlapping daily/monthly Bio Unified Reports
+    (cards, delivery_cards) and in card delivery uploads. This table keeps
+    the winning row only (cards > card_delivery_records > delivery_cards,
+    then the latest upload, then the lowest row id), so Overview headline
+    counts are plain counts. Maintained per upload
+    (services/canonical_card_service.py).
+    """
+    __tablename__ = 'canonical_cards'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    serial_number = Column(String(30), nullable=False)
+    print_status = Column(String(10), nullable=False)
+    source = Column(String(30), nullable=False)  # cards, card_delivery_records, delivery_cards
+    row_id = Column(Integer, nullable=False)
+    upload_id = Column(Integer, nullable=False)  # report_id for Bio Unified Report tables
+    event_date = Column(Date)  # print date (none for delivery_cards: see ReportCardDate)
+    branch_code = Column(String(20))
+
+    __table_args__ = (
+        Index('ix_canonical_cards_serial_status', 'serial_number', 'print_status', unique=True),
+        Index('ix_canonical_cards_source_date', 'source', 'print_status', 'event_date', 'branch_code'),
+        Index('ix_canonical_cards_source_upload', 'source', 'print_status', 'upload_id'),
+    )
+
+
+class ReportCardDate(Base):
+    """(print date, branch) pairs with cards in each Bio Unified Report.
+
+    A report's delivery sheet counts in the Overview ranges where the report
+    has cards; this keeps that membership so the lookup does not scan
+    ``cards``. Maintained per report upload/delete
+    (services/canonical_card_service.py).
+    """
+    __tablename__ = 'report_card_dates'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    report_id = Column(Integer, nullable=False)
+    print_date = Column(Date, nullable=False)
+    branch_code = Column(String(20))
+
+    __table_args__ = (
+        Index('ix_report_card_dates_date_branch', 'print_date', 'branch_code', 'report_id'),
+        Index('ix_report_card_dates_report', 'report_id'),
+    )
@@ -18,6 +18,18 @@ from database.models import (
 )
 from services.data_service import DataService
 from services.excel_parser import ExcelParser
+from services.cache_warmer import refresh_after_import
+from services.analytics_snapshot import sync_snapshot_in_background
+from services.anomaly_index_service import get_report_anomaly_scope, merge_anomaly_scopes, refresh_anomalies
+from services.canonical_card_service import (
+    CANONICAL_UPLOAD_SOURCES, get_upload_serials, refresh_canonical_cards, refresh_report_card_dates,
+)
+from services.identity_index_service import index_upload_identities, remove_upload_identities
+from services.journey_service import JOURNEY_SOURCES, get_upload_appointment_ids, refresh_appointment_journeys
+from services.appointment_current_service import refresh_current_appointments
+from services.slot_availability_service import (
+    get_appointment_slot_dates, get_report_slot_dates, refresh_slot_availability,
+)
 from utils.auth_check import require_login
 from utils.theme import apply_theme
 from auth import can_upload, can_delete
@@ -208,6 +220,86 @@ def find_column(df, possible_names):
     return None
 
 
+def refresh_dashboard_caches(source, upload_id=None, appointment_ids=None, slot_dates=None, deleted_upload_id=None,
+                             anomaly_scope=None, card_serials=None):
+    """Refresh derived tables, clear page caches and re-warm the standard dashboard views.
+
+    Args:
+        source: Upload type (unified, appointment, qlog, bio, card_delivery).
+        upload_id: Newly imported upload (report id for unified) - its rows are refreshed.
+        appointment_ids: Appointment ids of a deleted upload (collected before the delete).
+        slot_dates: Slot dates of a deleted or replaced report (collected before the delete).
+        deleted_upload_id: Deleted or replaced upload (report id for unified) - its identity index entries are removed.
+        anomaly_scope: Anomaly keys/dates of deleted or replaced cards (collected before the delete).
+        card_serials: Serials of deleted or replaced cards / delivery records (collected before the delete).
+    """
+    if source in JOURNEY_SOURCES and (upload_id is not None or appointment_ids):
+        try:
+            with st.spinner("กำลังอัปเดตตารางสรุปนัดหมาย..."):
+                session = get_session()
+                try:
+                    if upload_id is not None:
+                        appointment_ids = get_upload_appointment_ids(session, source, upload_id)
+                    if source == 'appointment':
+                        slot_dates = get_appointment_slot_dates(session, appointment_ids)
+                finally:
+                    session.close()
+                if source == 'appointment':
+                    refresh_current_appointments(appointment_ids)
+                refresh_appointment_journeys(appointment_ids)
+        except Exception as e:
+            st.warning(f"⚠️ อัปเดตตารางสรุปนัดหมายไม่สำเร็จ: {str(e)}")
+    elif source == 'unified' and upload_id is not None:
+        session = get_session()
+        try:
+            slot_dates = set(slot_dates or ()) | get_report_slot_dates(session, upload_id)
+        finally:
+            session.close()
+    if slot_dates:
+        try:
+            with st.spinner("กำลังอัปเดตตาราง Slot ว่าง..."):
+                refresh_slot_availability(slot_dates)
+        except Exception as e:
+            st.warning(f"⚠️ อัปเดตตาราง Slot ว่างไม่สำเร็จ: {str(e)}")
+    if source == 'unified' and (upload_id is not None or anomaly_scope):
+        try:
+            with st.spinner("กำลังอัปเดตตารางความผิดปกติ..."):
+                if upload_id is not None:
+                    session = get_session()
+                    try:
+                        anomaly_scope = merge_anomaly_scopes(anomaly_scope, get_report_anomaly_scope(session, upload_id))
+                    finally:
+                        session.close()
+                refresh_anomalies(anomaly_scope)
+        except Exception as e:
+            st.warning(f"⚠️ อัปเดตตารางความผิดปกติไม่สำเร็จ: {str(e)}")
+    if source in CANONICAL_UPLOAD_SOURCES and (upload_id is not None or deleted_upload_id is not None or card_serials):
+        try:
+            with st.spinner("กำลังอัปเดตตารางบัตรไม่ซ้ำ..."):
+                card_serials = set(card_serials or ())
+                if upload_id is not None:
+                    session = get_session()
+                    try:
+                        card_serials.update(get_upload_serials(session, source, upload_id))
+                    finally:
+                        session.close()
+                if source == 'unified':
+                    refresh_report_card_dates((upload_id, deleted_upload_id))
+                refresh_canonical_cards(card_serials)
+        except Exception as e:
+            st.warning(f"⚠️ อัปเดตตารางบัตรไม่ซ้ำไม่สำเร็จ: {str(e)}")
+    try:
+        if deleted_upload_id is not None:
+            remove_upload_identities(source, deleted_upload_id)
+        if upload_id is not None:
+            index_upload_identities(source, upload_id)
+    except Exception as e:
+        st.warning(f"⚠️ อัปเดตดัชนีค้นหาข้ามแหล่งข้อมูลไม่สำเร็จ: {str(e)}")
+    sync_snapshot_in_background(source, (upload_id, deleted_upload_id))
+    st.cache_data.clear()
+    refresh_after_import(source)
+
+
 # ==================== MAIN TABS ====================
 
 tab1, tab2, tab3, tab4, tab5 = st.tabs([
@@ -290,6 +382,13 @@ with tab1:
                             f"delivery: {result['delivery_imported']:,}"
                         )
                         st.balloons()
+                        refresh_dashboard_caches(
+                            "unified", upload_id=result['report_id'],
+                            deleted_upload_id=result.get('replaced_report_id'),
+                            slot_dates=result.get('replaced_slot_dates'),
+                            anomaly_scope=result.get('replaced_anomaly_scope'),
+                            card_serials=result.get('replaced_card_serials'),
+                        )
                     except Exception as e:
                         st.error(f"เกิดข้อผิดพลาด: {str(e)}")
 
@@ -323,6 +422,9 @@ with tab1:
                     st.write("")
                     if st.button("🗑️ ลบ", key="btn_del_unified"):
                         rid = report_del[0]
+                        deleted_dates = get_report_slot_dates(session, rid)
+                        deleted_anomalies = get_report_anomaly_scope(session, rid)
+                        deleted_serials = get_upload_serials(session, "unified", rid)
                         session.query(Card).filter(Card.report_id == rid).delete()
                         session.query(BadCard).filter(BadCard.report_id == rid).delete()
                         session.query(CenterStat).filter(CenterStat.report_id == rid).delete()
@@ -332,6 +434,10 @@ with tab1:
                         session.query(DeliveryCard).filter(DeliveryCard.report_id == rid).delete()
                         session.query(Report).filter(Report.id == rid).delete()
                         session.commit()
+                        refresh_dashboard_caches(
+                            "unified", slot_dates=deleted_dates, deleted_upload_id=rid,
+                            anomaly_scope=deleted_anomalies, card_serials=deleted_serials,
+                        )
                         st.success("ลบสำเร็จ!")
                         st.rerun()
         else:
@@ -658,6 +764,7 @@ with tab2:
                         detail = " | ".join(msg_parts) if msg_parts else ""
                         st.success(f"นำเข้าสำเร็จ! {actual_total:,} รายการ ({detail})")
                         st.balloons()
+                        refresh_dashboard_caches("appointment", upload_id=upload_id)
                     except Exception as e:
                         session.rollback()
                         st.error(f"เกิดข้อผิดพลาด: {str(e)}")
@@ -685,9 +792,11 @@ with tab2:
                     st.write("")
                     st.write("")
                     if st.button("🗑️ ลบ", key="btn_del_appt"):
+                        deleted_ids = get_upload_appointment_ids(session, "appointment", sel[0])
                         session.query(Appointment).filter(Appointment.upload_id == sel[0]).delete()
                         session.query(AppointmentUpload).filter(AppointmentUpload.id == sel[0]).delete()
                         session.commit()
+                        refresh_dashboard_caches("appointment", appointment_ids=deleted_ids, deleted_upload_id=sel[0])
                         st.success("ลบสำเร็จ!")
                         st.rerun()
         else:
@@ -890,6 +999,7 @@ with tab3:
                         status_text.empty()
                         st.success(f"นำเข้าสำเร็จ! {total:,} รายการ")
                         st.balloons()
+                        refresh_dashboard_caches("qlog", upload_id=upload_id)
                     except Exception as e:
                         session.rollback()
                         st.error(f"เกิดข้อผิดพลาด: {str(e)}")
@@ -917,9 +1027,11 @@ with tab3:
                     st.write("")
                     st.write("")
                     if st.button("🗑️ ลบ", key="btn_del_qlog"):
+                        deleted_ids = get_upload_appointment_ids(session, "qlog", sel[0])
                         session.query(QLog).filter(QLog.upload_id == sel[0]).delete()
                         session.query(QLogUpload).filter(QLogUpload.id == sel[0]).delete()
                         session.commit()
+                        refresh_dashboard_caches("qlog", appointment_ids=deleted_ids, deleted_upload_id=sel[0])
                         st.success("ลบสำเร็จ!")
                         st.rerun()
         else:
@@ -1159,6 +1271,7 @@ with tab4:
                         status_text.empty()
                         st.success(f"นำเข้าสำเร็จ! {total:,} รายการ (G: {good:,} | B: {bad:,})")
                         st.balloons()
+                        refresh_dashboard_caches("bio", upload_id=upload_id)
                     except Exception as e:
                         session.rollback()
                         st.error(f"เกิดข้อผิดพลาด: {str(e)}")
@@ -1186,9 +1299,11 @@ with tab4:
                     st.write("")
                     st.write("")
                     if st.button("🗑️ ลบ", key="btn_del_bio"):
+                        deleted_ids = get_upload_appointment_ids(session, "bio", sel[0])
                         session.query(BioRecord).filter(BioRecord.upload_id == sel[0]).delete()
                         session.query(BioUpload).filter(BioUpload.id == sel[0]).delete()
                         session.commit()
+                        refresh_dashboard_caches("bio", appointment_ids=deleted_ids, deleted_upload_id=sel[0])
                         st.success("ลบสำเร็จ!")
                         st.rerun()
         else:
@@ -1394,6 +1509,7 @@ with tab5:
                         status_text.empty()
                         st.success(f"นำเข้าสำเร็จ! {total:,} รายการ (G: {good:,} | B: {bad:,})")
                         st.balloons()
+                        refresh_dashboard_caches("card_delivery", upload_id=upload_id)
                     except Exception as e:
                         session.rollback()
                         st.error(f"เกิดข้อผิดพลาด: {str(e)}")
@@ -1421,9 +1537,15 @@ with tab5:
                     st.write("")
                     st.write("")
                     if st.button("🗑️ ลบ", key="btn_del_card_delivery"):
+                        deleted_ids = get_upload_appointment_ids(session, "card_delivery", sel[0])
+                        deleted_serials = get_upload_serials(session, "card_delivery", sel[0])
                         session.query(CardDeliveryRecord).filter(CardDeliveryRecord.upload_id == sel[0]).delete()
                         session.query(CardDeliveryUpload).filter(CardDeliveryUpload.id == sel[0]).delete()
                         session.commit()
+                        refresh_dashboard_caches(
+                            "card_delivery", appointment_ids=deleted_ids, deleted_upload_id=sel[0],
+                            card_serials=deleted_serials,
+                        )
                         st.success("ลบสำเร็จ!")
                         st.rerun()
         else:
@@ -10,11 +10,15 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.connection import init_db, get_session, get_branch_name_map_cached
-from database.models import Card, Report, DeliveryCard, Appointment, QLog, CardDeliveryRecord, CardDeliveryUpload, BranchMaster, BioRecord
-from sqlalchemy import func, and_, or_, case, literal
+from database.models import Card, Report, CardDeliveryUpload
+from sqlalchemy import func, literal
 from utils.theme import apply_theme
 from utils.auth_check import require_login
 from utils.logger import log_perf, log_info
+from utils.query_cache import invalidate_query_cache, format_data_as_of
+from services.dashboard_queries import (
+    get_overview_stats, get_daily_stats, get_upcoming_appointments, get_appointment_service_stats,
+)
 from utils.metric_cards import (
     render_metric_card, inject_metric_cards_css, calculate_trend,
     render_operation_summary, render_action_card, render_kpi_gauge, render_mini_metric,
@@ -54,346 +58,6 @@ def get_branch_list():
         session.close()
 
 
-# Cached function for overview stats - OPTIMIZED version
-@st.cache_data(ttl=3600)
-def get_overview_stats(start_date, end_date, selected_branches=None):
-    """Get cached overview statistics - optimized with combined queries."""
-    start_time = time.perf_counter()
-    session = get_session()
-    try:
-        from sqlalchemy import union_all
-
-        # Base date filter
-        filters = [Card.print_date >= start_date, Card.print_date <= end_date]
-
-        # Add branch filter if specified
-        if selected_branches and len(selected_branches) > 0:
-            filters.append(Card.branch_code.in_(selected_branches))
-
-        date_filter = and_(*filters)
-
-        # ==================== OPTIMIZED: Single query for Card table counts ====================
-        # Combine multiple count queries into one query using CASE statements
-        card_stats = session.query(
-            # Basic counts
-            func.count(func.distinct(case((Card.print_status == 'G', Card.serial_number)))).label('unique_at_center'),
-            func.sum(case((Card.print_status == 'B', 1), else_=0)).label('bad_at_center'),
-            # Anomaly counts
-            func.sum(case((Card.wrong_branch == True, 1), else_=0)).label('wrong_branch'),
-            func.sum(case((Card.wrong_date == True, 1), else_=0)).label('wrong_date'),
-            func.sum(case((Card.sla_over_12min == True, 1), else_=0)).label('sla_over_12'),
-            func.sum(case((Card.wait_over_1hour == True, 1), else_=0)).label('wait_over_1hr'),
-            # SLA stats
-            func.sum(case((and_(Card.print_status == 'G', Card.sla_minutes.isnot(None)), 1), else_=0)).label('sla_total'),
-            func.sum(case((and_(Card.print_status == 'G', Card.sla_minutes.isnot(None), Card.sla_minutes <= 12), 1), else_=0)).label('sla_pass'),
-            func.avg(case((and_(Card.print_status == 'G', Card.sla_minutes.isnot(None)), Card.sla_minutes))).label('avg_sla'),
-            # Wait time stats
-            func.sum(case((and_(Card.print_status == 'G', Card.wait_time_minutes.isnot(None)), 1), else_=0)).label('wait_total'),
-            func.sum(case((and_(Card.print_status == 'G', Card.wait_time_minutes.isnot(None), Card.wait_time_minutes <= 60), 1), else_=0)).label('wait_pass'),
-            func.avg(case((and_(Card.print_status == 'G', Card.wait_time_minutes.isnot(None)), Card.wait_time_minutes))).label('avg_wait'),
-            # Incomplete count (Good cards with missing fields)
-            func.sum(case((and_(
-                Card.print_status == 'G',
-                or_(
-                    Card.appointment_id.is_(None), Card.appointment_id == '',
-                    Card.card_id.is_(None), Card.card_id == '',
-                    Card.serial_number.is_(None), Card.serial_number == '',
-                    Card.work_permit_no.is_(None), Card.work_permit_no == ''
-                )
-            ), 1), else_=0)).label('incomplete'),
-        ).filter(date_filter).first()
-
-        unique_at_center = card_stats.unique_at_center or 0
-        bad_at_center = card_stats.bad_at_center or 0
-        wrong_branch = card_stats.wrong_branch or 0
-        wrong_date = card_stats.wrong_date or 0
-        sla_over_12 = card_stats.sla_over_12 or 0
-        wait_over_1hr = card_stats.wait_over_1hr or 0
-        wait_total = card_stats.wait_total or 0
-        wait_pass = card_stats.wait_pass or 0
-        avg_wait = card_stats.avg_wait or 0
-        incomplete = card_stats.incomplete or 0
-
-        # ==================== SLA ออกบัตร from BioRecord (more complete data) ====================
-        from database.models import BioRecord as BioRec
-        bio_filters = [BioRec.print_date >= start_date, BioRec.print_date <= end_date]
-        if selected_branches and len(selected_branches) > 0:
-            bio_filters.append(BioRec.branch_code.in_(selected_branches))
-
-        bio_sla_stats = session.query(
-            func.sum(case((and_(BioRec.print_status == 'G', BioRec.sla_minutes.isnot(None)), 1), else_=0)).label('sla_total'),
-            func.sum(case((and_(BioRec.print_status == 'G', BioRec.sla_minutes.isnot(None), BioRec.sla_minutes <= 12), 1), else_=0)).label('sla_pass'),
-            func.avg(case((and_(BioRec.print_status == 'G', BioRec.sla_minutes.isnot(None)), BioRec.sla_minutes))).label('avg_sla'),
-        ).filter(and_(*bio_filters)).first()
-
-        sla_total = bio_sla_stats.sla_total or 0
-        sla_pass = bio_sla_stats.sla_pass or 0
-        avg_sla = bio_sla_stats.avg_sla or 0
-
-        # ==================== Delivery queries (still separate due to different tables) ====================
-        report_ids_with_data = session.query(Card.report_id).filter(date_filter).distinct().subquery()
-
-        # CardDeliveryRecord filters
-        cdr_filters = [CardDeliveryRecord.print_status == 'G']
-        if start_date and end_date:
-            cdr_filters.append(func.date(CardDeliveryRecord.create_date) >= start_date)
-            cdr_filters.append(func.date(CardDeliveryRecord.create_date) <= end_date)
-
-        # Combined delivery serials (union)
-        delivery_bio_serials = session.query(DeliveryCard.serial_number.label('sn')).filter(
-            DeliveryCard.print_status == 'G',
-            DeliveryCard.report_id.in_(session.query(report_ids_with_data)),
-            DeliveryCard.serial_number.isnot(None), DeliveryCard.serial_number != ''
-        )
-        delivery_cdr_serials = session.query(CardDeliveryRecord.serial_number.label('sn')).filter(
-            and_(*cdr_filters),
-            CardDeliveryRecord.serial_number.isnot(None), CardDeliveryRecord.serial_number != ''
-        )
-        combined_delivery = union_all(delivery_bio_serials, delivery_cdr_serials).subquery()
-        unique_delivery = session.query(func.count(func.distinct(combined_delivery.c.sn))).scalar() or 0
-
-        # Combined total serials (Card + Delivery)
-        card_serials = session.query(Card.serial_number.label('sn')).filter(
-            date_filter, Card.print_status == 'G',
-            Card.serial_number.isnot(None), Card.serial_number != ''
-        )
-        combined_serials = union_all(card_serials, delivery_bio_serials, delivery_cdr_serials).subquery()
-        unique_total = session.query(func.count(func.distinct(combined_serials.c.sn))).scalar() or 0
-
-        # Bad delivery cards (combined into union for single count - saves 1 query)
-        bad_bio_q = session.query(DeliveryCard.id.label('bid')).filter(
-            DeliveryCard.print_status == 'B',
-            DeliveryCard.report_id.in_(session.query(report_ids_with_data))
-        )
-        cdr_bad_filters = [CardDeliveryRecord.print_status == 'B']
-        if start_date and end_date:
-            cdr_bad_filters.append(func.date(CardDeliveryRecord.create_date) >= start_date)
-            cdr_bad_filters.append(func.date(CardDeliveryRecord.create_date) <= end_date)
-        bad_cdr_q = session.query(CardDeliveryRecord.id.label('bid')).filter(and_(*cdr_bad_filters))
-        bad_delivery_union = union_all(bad_bio_q, bad_cdr_q).subquery()
-        bad_delivery_total = session.query(func.count()).select_from(bad_delivery_union).scalar() or 0
-        bad_cards = bad_at_center + bad_delivery_total
-
-        # ==================== Appointment-related queries (optimized) ====================
-        appt_one_g = session.query(Card.appointment_id).filter(
-            date_filter, Card.print_status == 'G',
-            Card.appointment_id.isnot(None), Card.appointment_id != ''
-        ).group_by(Card.appointment_id).having(func.count(Card.id) == 1).subquery()
-
-        # Combined: complete_cards + unique_work_permit in one query (saves 1 query)
-        complete_stats = session.query(
-            func.count(func.distinct(Card.serial_number)).label('complete_sn'),
-            func.count(func.distinct(Card.work_permit_no)).label('complete_wp'),
-        ).filter(
-            date_filter, Card.print_status == 'G',
-            Card.appointment_id.in_(session.query(appt_one_g)),
-            Card.card_id.isnot(None), Card.card_id != '',
-            Card.serial_number.isnot(None), Card.serial_number != '',
-            Card.work_permit_no.isnot(None), Card.work_permit_no != ''
-        ).first()
-        complete_cards = complete_stats.complete_sn or 0
-        unique_work_permit = complete_stats.complete_wp or 0
-
-        # Single subquery for appointments with multiple G cards (avoids duplicate GROUP BY)
-        multi_g_appts = session.query(
-            Card.appointment_id,
-            func.count(Card.id).label('cnt')
-        ).filter(
-            date_filter, Card.print_status == 'G',
-            Card.appointment_id.isnot(None), Card.appointment_id != ''
-        ).group_by(Card.appointment_id).having(func.count(Card.id) > 1).subquery()
-
-        appt_multiple_g = session.query(func.count()).select_from(multi_g_appts).scalar() or 0
-        appt_multiple_records = session.query(func.coalesce(func.sum(multi_g_appts.c.cnt), 0)).scalar() or 0
-
-        duplicate_serial = session.query(Card.serial_number).filter(
-            date_filter, Card.print_status == 'G'
-        ).group_by(Card.serial_number).having(func.count(Card.id) > 1).count()
-
-        # ==================== QLog Wait Time Stats (separate query) ====================
-        # Logic SLA รอคิว (ตาม Logic documentation):
-        # - Type A (OB centers): นำมาคิดทุกรายการ, ตก SLA ถ้า TimeCall - Train_Time > 60 นาที
-        # - Type B (SC centers): นำมาคิดเฉพาะ EI และ T, ตก SLA ถ้า TimeCall > SLA_TimeEnd
-        # - เฉพาะนัดหมายที่มีการออกบัตร (G) แล้วเท่านั้น
-        # Note: ถ้าไม่มี sla_time_end/qlog_train_time จะ fallback ใช้ wait_time_seconds > 3600
-
-        # Get appointment_codes that have printed cards (G) - from BioRecord
-        from database.models import BioRecord
-        printed_appt_codes = session.query(BioRecord.appointment_id).filter(
-            BioRecord.print_date >= start_date,
-            BioRecord.print_date <= end_date,
-            BioRecord.print_status == 'G',
-            BioRecord.appointment_id.isnot(None),
-            BioRecord.appointment_id != ''
-        )
-        if selected_branches and len(selected_branches) > 0:
-            printed_appt_codes = printed_appt_codes.filter(BioRecord.branch_code.in_(selected_branches))
-        printed_appt_codes = printed_appt_codes.distinct().subquery()
-
-        qlog_filters = [
-            QLog.qlog_date >= start_date,
-            QLog.qlog_date <= end_date,
-            QLog.appointment_code.in_(session.query(printed_appt_codes.c.appointment_id))  # Only appointments with printed cards
-        ]
-        if selected_branches and len(selected_branches) > 0:
-            qlog_filters.append(QLog.branch_code.in_(selected_branches))
-
-        # Combined Type A + Type B in a single query using CASE (saves 1 query)
-        # Type A (OB centers): ALL records with printed cards, fail if wait > 3600s
-        # Type B (SC centers): Only EI and T with printed cards, fail if wait > 3600s
-        qlog_combined = session.query(
-            # Type A counts
-            func.sum(case((and_(QLog.qlog_type == 'A', QLog.wait_time_seconds.isnot(None)), 1), else_=0)).label('a_total'),
-            func.sum(case((and_(QLog.qlog_type == 'A', QLog.wait_time_seconds.isnot(None), QLog.wait_time_seconds <= 3600), 1), else_=0)).label('a_pass'),
-            func.avg(case((and_(QLog.qlog_type == 'A', QLog.wait_time_seconds.isnot(None)), QLog.wait_time_seconds))).label('a_avg'),
-            # Type B counts (only EI and T)
-            func.sum(case((and_(QLog.qlog_type == 'B', QLog.sla_status.in_(['EI', 'T']), QLog.wait_time_seconds.isnot(None)), 1), else_=0)).label('b_total'),
-            func.sum(case((and_(QLog.qlog_type == 'B', QLog.sla_status.in_(['EI', 'T']), QLog.wait_time_seconds.isnot(None), QLog.wait_time_seconds <= 3600), 1), else_=0)).label('b_pass'),
-            func.avg(case((and_(QLog.qlog_type == 'B', QLog.sla_status.in_(['EI', 'T']), QLog.wait_time_seconds.isnot(None)), QLog.wait_time_seconds))).label('b_avg'),
-        ).filter(and_(*qlog_filters)).first()
-
-        type_a_total = qlog_combined.a_total or 0
-        type_a_pass = qlog_combined.a_pass or 0
-        type_b_total = qlog_combined.b_total or 0
-        type_b_pass = qlog_combined.b_pass or 0
-
-        qlog_wait_total = type_a_total + type_b_total
-        qlog_wait_pass = type_a_pass + type_b_pass
-        qlog_wait_over_1hr = qlog_wait_total - qlog_wait_pass
-
-        # Weighted average (combine Type A and Type B averages)
-        type_a_avg = qlog_combined.a_avg or 0
-        type_b_avg = qlog_combined.b_avg or 0
-        if qlog_wait_total > 0:
-            qlog_avg_wait_sec = (type_a_avg * type_a_total + type_b_avg * type_b_total) / qlog_wait_total
-        else:
-            qlog_avg_wait_sec = 0
-        qlog_avg_wait_min = qlog_avg_wait_sec / 60 if qlog_avg_wait_sec else 0
-
-        # Use QLog data if Card wait_time is empty
-        final_wait_total = wait_total if wait_total > 0 else qlog_wait_total
-        final_wait_pass = wait_pass if wait_total > 0 else qlog_wait_pass
-        final_avg_wait = avg_wait if wait_total > 0 else qlog_avg_wait_min
-        final_wait_over_1hr = wait_over_1hr if wait_total > 0 else qlog_wait_over_1hr
-
-        return {
-            'unique_at_center': unique_at_center,
-            'unique_delivery': unique_delivery,
-            'unique_total': unique_total,
-            'bad_cards': bad_cards,
-            'complete_cards': complete_cards,
-            'unique_work_permit': unique_work_permit,
-            'appt_multiple_g': appt_multiple_g,
-            'appt_multiple_records': appt_multiple_records,
-            'incomplete': incomplete,
-            'wrong_branch': wrong_branch,
-            'wrong_date': wrong_date,
-            'sla_over_12': sla_over_12,
-            'duplicate_serial': duplicate_serial,
-            'sla_total': sla_total,
-            'sla_pass': sla_pass,
-            'avg_sla': avg_sla,
-            'wait_total': final_wait_total,
-            'wait_pass': final_wait_pass,
-            'avg_wait': final_avg_wait,
-            'wait_over_1hr': final_wait_over_1hr,
-        }
-    finally:
-        session.close()
-        duration = (time.perf_counter() - start_time) * 1000
-        log_perf(f"get_overview_stats({start_date} to {end_date})", duration)
-
-
-@st.cache_data(ttl=3600)
-def get_daily_stats(start_date, end_date, selected_branches=None):
-    """Get cached daily statistics for chart - separated by center type (SC/OB)."""
-    start_time = time.perf_counter()
-    session = get_session()
-    try:
-        from database.models import BioRecord
-
-        # Base date filter for BioRecord
-        filters = [BioRecord.print_date >= start_date, BioRecord.print_date <= end_date]
-
-        # Add branch filter if specified
-        if selected_branches and len(selected_branches) > 0:
-            filters.append(BioRecord.branch_code.in_(selected_branches))
-
-        date_filter = and_(*filters)
-
-        # Query BioRecord data - separated by center type (SC vs OB)
-        # SC = ศูนย์บริการ (branch_code contains '-SC-')
-        # OB = ศูนย์แรกรับ (branch_code contains '-OB-')
-        daily_stats = session.query(
-            BioRecord.print_date,
-            # SC ศูนย์บริการ
-            func.count(func.distinct(BioRecord.serial_number)).filter(
-                BioRecord.print_status == 'G',
-                BioRecord.branch_code.like('%-SC-%')
-            ).label('sc_good'),
-            func.sum(case((and_(BioRecord.print_status == 'B', BioRecord.branch_code.like('%-SC-%')), 1), else_=0)).label('sc_bad'),
-            # OB ศูนย์แรกรับ
-            func.count(func.distinct(BioRecord.serial_number)).filter(
-                BioRecord.print_status == 'G',
-                BioRecord.branch_code.like('%-OB-%')
-            ).label('ob_good'),
-            func.sum(case((and_(BioRecord.print_status == 'B', BioRecord.branch_code.like('%-OB-%')), 1), else_=0)).label('ob_bad'),
-        ).filter(
-            date_filter, BioRecord.print_date.isnot(None)
-        ).group_by(BioRecord.print_date).order_by(BioRecord.print_date).all()
-
-        # Convert to dict for easy lookup
-        bio_data = {d.print_date: {
-            'sc_good': d.sc_good or 0, 'sc_bad': d.sc_bad or 0,
-            'ob_good': d.ob_good or 0, 'ob_bad': d.ob_bad or 0
-        } for d in daily_stats}
-
-        # Query CardDeliveryRecord data (บัตรจัดส่ง 68/69)
-        cdr_filters = [
-            func.date(CardDeliveryRecord.create_date) >= start_date,
-            func.date(CardDeliveryRecord.create_date) <= end_date
-        ]
-        if selected_branches and len(selected_branches) > 0:
-            cdr_filters.append(CardDeliveryRecord.branch_code.in_(selected_branches))
-
-        cdr_stats = session.query(
-            func.date(CardDeliveryRecord.create_date).label('print_date'),
-            func.count(func.distinct(CardDeliveryRecord.serial_number)).filter(
-                CardDeliveryRecord.print_status == 'G'
-            ).label('delivery_g'),
-            func.sum(case((CardDeliveryRecord.print_status == 'B', 1), else_=0)).label('delivery_bad'),
-        ).filter(
-            and_(*cdr_filters),
-            CardDeliveryRecord.create_date.isnot(None)
-        ).group_by(func.date(CardDeliveryRecord.create_date)).all()
-
-        # Convert to dict
-        cdr_data = {d.print_date: {'delivery_g': d.delivery_g or 0, 'delivery_bad': d.delivery_bad or 0} for d in cdr_stats}
-
-        # Merge all dates
-        all_dates = sorted(set(bio_data.keys()) | set(cdr_data.keys()))
-
-        result = []
-        for dt in all_dates:
-            bio = bio_data.get(dt, {'sc_good': 0, 'sc_bad': 0, 'ob_good': 0, 'ob_bad': 0})
-            cdr = cdr_data.get(dt, {'delivery_g': 0, 'delivery_bad': 0})
-            result.append((
-                dt,
-                bio['sc_good'],        # ศูนย์บริการ SC (G)
-                bio['ob_good'],        # ศูนย์แรกรับ OB (G)
-                cdr['delivery_g'],     # บัตรจัดส่ง (G)
-                bio['sc_bad'],         # บัตรเสีย SC
-                bio['ob_bad'],         # บัตรเสีย OB
-                cdr['delivery_bad'],   # บัตรเสีย จัดส่ง
-            ))
-
-        return result
-    finally:
-        session.close()
-        duration = (time.perf_counter() - start_time) * 1000
-        log_perf(f"get_daily_stats({start_date} to {end_date})", duration)
-
-
 @st.cache_data(ttl=3600)
 def get_date_range():
     """Get cached min/max dates."""
@@ -415,454 +79,6 @@ def get_date_range():
         log_perf("get_date_range", duration)
 
 
-@st.cache_data(ttl=3600)
-def get_upcoming_appointments(selected_branches=None):
-    """
-    Get upcoming appointments for workload forecasting.
-    Shows appointments from today onwards (future dates).
-    Includes capacity comparison from BranchMaster.max_capacity.
-    """
-    start_time = time.perf_counter()
-    session = get_session()
-    try:
-        from datetime import date as dt_date
-        today = dt_date.today()
-
-        # Check if we have Appointment data (exists() is faster than first())
-        from sqlalchemy import exists as sa_exists
-        has_appt_data = session.query(sa_exists().where(Appointment.id.isnot(None))).scalar()
-
-        if not has_appt_data:
-            return {
-                'has_data': False,
-                'today': 0,
-                'tomorrow': 0,
-                'next_7_days': 0,
-                'next_30_days': 0,
-                'daily_data': [],
-                'by_center': [],
-                'by_center_daily': [],
-                'over_capacity_count': 0,
-                'max_date': None
-            }
-
-        # Build base filter - confirmed or waiting appointments (exclude CANCEL, EXPIRED)
-        base_filters = [
-            Appointment.appt_date >= today,
-            Appointment.appt_status.in_(['SUCCESS', 'WAITING'])  # Include both confirmed and pending
-        ]
-
-        # Add branch filter if specified
-        if selected_branches and len(selected_branches) > 0:
-            base_filters.append(Appointment.branch_code.in_(selected_branches))
-
-        # Get max appointment date in future
-        max_future_date = session.query(func.max(Appointment.appt_date)).filter(
-            and_(*base_filters)
-        ).scalar()
-
-        if not max_future_date:
-            return {
-                'has_data': False,
-                'today': 0,
-                'tomorrow': 0,
-                'next_7_days': 0,
-                'next_30_days': 0,
-                'daily_data': [],
-                'by_center': [],
-                'by_center_daily': [],
-                'over_capacity_count': 0,
-                'max_date': None
-            }
-
-        # Combined: today, tomorrow, 7-day, 30-day counts in one query (saves 3 queries)
-        tomorrow = today + timedelta(days=1)
-        next_7_days = today + timedelta(days=6)
-        next_30_days = today + timedelta(days=29)
-
-        period_counts = session.query(
-            func.count(func.distinct(case((Appointment.appt_date == today, Appointment.appointment_id)))).label('today'),
-            func.count(func.distinct(case((Appointment.appt_date == tomorrow, Appointment.appointment_id)))).label('tomorrow'),
-            func.count(func.distinct(case((Appointment.appt_date <= next_7_days, Appointment.appointment_id)))).label('next_7'),
-            func.count(func.distinct(case((Appointment.appt_date <= next_30_days, Appointment.appointment_id)))).label('next_30'),
-        ).filter(and_(*base_filters)).first()
-
-        today_count = period_counts.today or 0
-        tomorrow_count = period_counts.tomorrow or 0
-        next_7_count = period_counts.next_7 or 0
-        next_30_count = period_counts.next_30 or 0
-
-        # Daily breakdown for chart — show ALL available future appointment data
-        chart_end_date = max_future_date
-        daily_appts = session.query(
-            Appointment.appt_date,
-            func.count(func.distinct(Appointment.appointment_id)).label('total')
-        ).filter(
-            and_(*base_filters),
-            Appointment.appt_date <= chart_end_date
-        ).group_by(Appointment.appt_date).order_by(Appointment.appt_date).all()
-
-        daily_data = [{'date': d.appt_date, 'count': d.total} for d in daily_appts]
-
-        # Daily breakdown by center type (SC vs OB) - JOIN with BranchMaster
-        daily_by_type = session.query(
-            Appointment.appt_date,
-            BranchMaster.branch_code,
-            func.count(func.distinct(Appointment.appointment_id)).label('total')
-        ).join(
-            BranchMaster, Appointment.branch_code == BranchMaster.branch_code
-        ).filter(
-            and_(*base_filters),
-            Appointment.appt_date <= chart_end_date
-        ).group_by(Appointment.appt_date, BranchMaster.branch_code).all()
-
-        # Aggregate by type (SC vs OB) per day
-        from collections import defaultdict
-        sc_daily_map = defaultdict(int)
-        ob_daily_map = defaultdict(int)
-        for row in daily_by_type:
-            bcode = str(row.branch_code or '')
-            parts = bcode.split('-')
-            btype = parts[1] if len(parts) >= 2 else ''
-            if btype == 'SC':
-                sc_daily_map[row.appt_date] += row.total
-            elif btype == 'OB':
-                ob_daily_map[row.appt_date] += row.total
-
-        # Build sorted daily lists for SC and OB
-        all_dates = sorted(set(list(sc_daily_map.keys()) + list(ob_daily_map.keys())))
-        daily_sc = [{'date': d, 'count': sc_daily_map.get(d, 0)} for d in all_dates]
-        daily_ob = [{'date': d, 'count': ob_daily_map.get(d, 0)} for d in all_dates]
-
-        # Get capacity map from BranchMaster
-        # Exclude mobile units (-MB-) from total_capacity as they operate on-demand (max 160/day)
-        # Mobile units have branch_code like ACR-MB-S-001, BKK-MB-S-001 (contains -MB-)
-        capacity_map = {}
-        total_capacity = 0
-        capacity_sc = 0
-        capacity_ob = 0
-        branch_capacities = session.query(
-            BranchMaster.branch_code,
-            BranchMaster.max_capacity
-        ).filter(BranchMaster.max_capacity.isnot(None)).all()
-        for bc in branch_capacities:
-            capacity_map[bc.branch_code] = bc.max_capacity
-            bcode = str(bc.branch_code or '')
-            parts = bcode.split('-')
-            btype = parts[1] if len(parts) >= 2 else ''
-            # Only add to total_capacity if NOT a mobile unit (contains -MB-)
-            if '-MB-' not in bcode.upper():
-                total_capacity += bc.max_capacity
-            if btype == 'SC':
-                capacity_sc += bc.max_capacity
-            elif btype == 'OB':
-                capacity_ob += bc.max_capacity
-
-        # By center breakdown with capacity (top 15 centers with most appointments in next 7 days)
-        branch_map = get_branch_name_map_cached()
-        by_center_query = session.query(
-            Appointment.branch_code,
-            func.count(func.distinct(Appointment.appointment_id)).label('total')
-        ).filter(
-            and_(*base_filters),
-            Appointment.appt_date <= next_7_days
-        ).group_by(Appointment.branch_code).order_by(
-            func.count(func.distinct(Appointment.appointment_id)).desc()
-        ).limit(15).all()
-
-        by_center = []
-        for c in by_center_query:
-            capacity = capacity_map.get(c.branch_code)
-            # Calculate average daily appointments for 7 days
-            avg_daily = c.total / 7
-            status = 'normal'
-            if capacity:
-                usage_pct = (avg_daily / capacity) * 100
-                if usage_pct >= 100:
-                    status = 'over'
-                elif usage_pct >= 80:
-                    status = 'warning'
-            else:
-                usage_pct = None
-
-            by_center.append({
-                'branch_code': c.branch_code,
-                'branch_name': branch_map.get(c.branch_code, c.branch_code),
-                'count': c.total,
-                'avg_daily': round(avg_daily, 1),
-                'capacity': capacity,
-                'usage_pct': round(usage_pct, 1) if usage_pct else None,
-                'status': status
-            })
-
-        # By center daily breakdown (for heatmap) - next 7 days
-        by_center_daily_query = session.query(
-            Appointment.branch_code,
-            Appointment.appt_date,
-            func.count(func.distinct(Appointment.appointment_id)).label('total')
-        ).filter(
-            and_(*base_filters),
-            Appointment.appt_date <= next_7_days
-        ).group_by(Appointment.branch_code, Appointment.appt_date).all()
-
-        by_center_daily = []
-        over_capacity_count = 0
-        for c in by_center_daily_query:
-            capacity = capacity_map.get(c.branch_code)
-            status = 'normal'
-            usage_pct = None
-            if capacity:
-                usage_pct = (c.total / capacity) * 100
-                if usage_pct >= 100:
-                    status = 'over'
-                    over_capacity_count += 1
-                elif usage_pct >= 80:
-                    status = 'warning'
-
-            by_center_daily.append({
-                'branch_code': c.branch_code,
-                'branch_name': branch_map.get(c.branch_code, c.branch_code),
-                'date': c.appt_date,
-                'count': c.total,
-                'capacity': capacity,
-                'usage_pct': round(usage_pct, 1) if usage_pct else None,
-                'status': status
-            })
-
-        return {
-            'has_data': True,
-            'today': today_count,
-            'tomorrow': tomorrow_count,
-            'next_7_days': next_7_count,
-            'next_30_days': next_30_count,
-            'daily_data': daily_data,
-            'daily_sc': daily_sc,
-            'daily_ob': daily_ob,
-            'by_center': by_center,
-            'by_center_daily': by_center_daily,
-            'over_capacity_count': over_capacity_count,
-            'max_date': max_future_date,
-            'total_capacity': total_capacity,
-            'capacity_sc': capacity_sc,
-            'capacity_ob': capacity_ob,
-        }
-    finally:
-        session.close()
-        duration = (time.perf_counter() - start_time) * 1000
-        log_perf("get_upcoming_appointments", duration)
-
-
-@st.cache_data(ttl=3600)
-def get_appointment_service_stats(start_date, end_date, selected_branches=None):
-    """
-    Get appointment → check-in → card issuance funnel statistics.
-    นัดหมาย = Appointment (ทุก status ยกเว้น CANCEL, EXPIRED)
-    มา Check-in = QLog ที่มี qlog_num (มาถึงศูนย์ รับบัตรคิวแล้ว)
-    ออกบัตร = BioRecord unique appointment_id (มีการพิมพ์บัตรจริง)
-    ไม่ผ่านตู้คิว = มี BioRecord แต่ไม่มี QLog (ข้ามตู้คิว/ระบบขัดข้อง)
-    No-Show = ไม่มีทั้ง QLog และ BioRecord
-    """
-    start_time = time.perf_counter()
-    session = get_session()
-    try:
-        # Check if we have data
-        from sqlalchemy import exists as sa_exists
-        has_appt_data = session.query(sa_exists().where(Appointment.id.isnot(None))).scalar()
-        has_qlog_data = session.query(sa_exists().where(QLog.id.isnot(None))).scalar()
-        has_bio_data = session.query(sa_exists().where(BioRecord.id.isnot(None))).scalar()
-
-        if not has_appt_data:
-            return {
-                'has_data': False,
-                'total_appointments': 0,
-                'checked_in': 0,
-                'card_issued': 0,
-                'skip_queue': 0,
-                'no_show': 0,
-                'daily_data': []
-            }
-
-        # Build date filter for Appointment - include all except CANCEL/EXPIRED
-        appt_filters = [
-            Appointment.appt_date >= start_date,
-            Appointment.appt_date <= end_date,
-            ~Appointment.appt_status.in_(['CANCEL', 'EXPIRED'])
-        ]
-
-        # Add branch filter if specified
-        if selected_branches and len(selected_branches) > 0:
-            appt_filters.append(Appointment.branch_code.in_(selected_branches))
-
-        # 1. Total appointments (all active statuses)
-        total_appts = session.query(func.count(func.distinct(Appointment.appointment_id))).filter(
-            and_(*appt_filters)
-        ).scalar() or 0
-
-        # 2. Check-in count from QLog (has qlog_num = came to center and got queue ticket)
-        checked_in = 0
-        if has_qlog_data:
-            qlog_filters = [
-                QLog.qlog_date >= start_date,
-                QLog.qlog_date <= end_date,
-                QLog.qlog_num.isnot(None),
-            ]
-            if selected_branches and len(selected_branches) > 0:
-                qlog_filters.append(QLog.branch_code.in_(selected_branches))
-
-            checked_in = session.query(func.count(func.distinct(QLog.appointment_code))).filter(
-                and_(*qlog_filters)
-            ).scalar() or 0
-
-        # 3. Card issued count from BioRecord (actual card printing)
-        card_issued = 0
-        bio_served = 0
-        if has_bio_data:
-            bio_filters = [
-                BioRecord.print_date >= start_date,
-                BioRecord.print_date <= end_date,
-            ]
-            if selected_branches and len(selected_branches) > 0:
-                bio_filters.append(BioRecord.branch_code.in_(selected_branches))
-
-            card_issued = session.query(func.count(func.distinct(BioRecord.appointment_id))).filter(
-                and_(*bio_filters)
-            ).scalar() or 0
-            bio_served = card_issued  # same count — unique appt_ids that got cards
-
-        # 4. Skip queue = served by Bio but no QLog check-in
-        # Use EXISTS to compute overlap (bio appts that also have qlog) — ~6s for 30 days
-        if not has_qlog_data:
-            skip_queue = bio_served
-        elif has_bio_data and bio_served > 0:
-            from sqlalchemy import exists as sa_exists_fn
-            qlog_exists_filters = [
-                QLog.appointment_code == BioRecord.appointment_id,
-                QLog.qlog_date >= start_date,
-                QLog.qlog_date <= end_date,
-                QLog.qlog_num.isnot(None),
-            ]
-            if selected_branches and len(selected_branches) > 0:
-                qlog_exists_filters.append(QLog.branch_code.in_(selected_branches))
-            qlog_exists = sa_exists_fn().where(and_(*qlog_exists_filters))
-
-            overlap_q = session.query(func.count(func.distinct(BioRecord.appointment_id))).filter(
-                BioRecord.print_date >= start_date,
-                BioRecord.print_date <= end_date,
-                qlog_exists,
-            )
-            if selected_branches and len(selected_branches) > 0:
-                overlap_q = overlap_q.filter(BioRecord.branch_code.in_(selected_branches))
-            overlap = overlap_q.scalar() or 0
-            skip_queue = max(0, bio_served - overlap)
-        else:
-            skip_queue = 0
-
-        no_show = max(0, total_appts - checked_in - skip_queue)
-
-        # Daily breakdown for chart
-        daily_data = []
-
-        # Get daily appointment counts
-        daily_appts = session.query(
-            Appointment.appt_date,
-            func.count(func.distinct(Appointment.appointment_id)).label('total')
-        ).filter(
-            and_(*appt_filters)
-        ).group_by(Appointment.appt_date).all()
-
-        # Get daily check-in counts from QLog
-        checkin_map = {}
-        if has_qlog_data:
-            daily_checkins = session.query(
-                QLog.qlog_date,
-                func.count(func.distinct(QLog.appointment_code)).label('checkin')
-            ).filter(
-                QLog.qlog_date >= start_date,
-                QLog.qlog_date <= end_date,
-                QLog.qlog_num.isnot(None),
-            )
-            if selected_branches and len(selected_branches) > 0:
-                daily_checkins = daily_checkins.filter(QLog.branch_code.in_(selected_branches))
-            daily_checkins = daily_checkins.group_by(QLog.qlog_date).all()
-            checkin_map = {d.qlog_date: d.checkin for d in daily_checkins}
-
-        # Get daily card issuance counts from BioRecord
-        bio_map = {}
-        if has_bio_data:
-            daily_bio = session.query(
-                BioRecord.print_date,
-                func.count(func.distinct(BioRecord.appointment_id)).label('issued')
-            ).filter(
-                BioRecord.print_date >= start_date,
-                BioRecord.print_date <= end_date,
-            )
-            if selected_branches and len(selected_branches) > 0:
-                daily_bio = daily_bio.filter(BioRecord.branch_code.in_(selected_branches))
-            daily_bio = daily_bio.group_by(BioRecord.print_date).all()
-            bio_map = {d.print_date: d.issued for d in daily_bio}
-
-        # Get daily skip-queue via EXISTS overlap (accurate — ~3s for 30 days)
-        skip_queue_map = {}
-        if has_bio_data and bio_map:
-            daily_qlog_exists_filters = [
-                QLog.appointment_code == BioRecord.appointment_id,
-                QLog.qlog_date == BioRecord.print_date,
-                QLog.qlog_num.isnot(None),
-            ]
-            if selected_branches and len(selected_branches) > 0:
-                daily_qlog_exists_filters.append(QLog.branch_code.in_(selected_branches))
-            from sqlalchemy import exists as sa_exists_fn2
-            daily_qlog_exists = sa_exists_fn2().where(and_(*daily_qlog_exists_filters))
-
-            daily_overlap_q = session.query(
-                BioRecord.print_date,
-                func.count(func.distinct(BioRecord.appointment_id)).label('overlap')
-            ).filter(
-                BioRecord.print_date >= start_date,
-                BioRecord.print_date <= end_date,
-                daily_qlog_exists,
-            )
-            if selected_branches and len(selected_branches) > 0:
-                daily_overlap_q = daily_overlap_q.filter(BioRecord.branch_code.in_(selected_branches))
-            daily_overlap = daily_overlap_q.group_by(BioRecord.print_date).all()
-            overlap_map = {d.print_date: d.overlap for d in daily_overlap}
-
-            for dt, bio_count in bio_map.items():
-                overlap_count = overlap_map.get(dt, 0)
-                skip_queue_map[dt] = max(0, bio_count - overlap_count)
-
-        # Combine into daily_data
-        for d in daily_appts:
-            checkin = checkin_map.get(d.appt_date, 0)
-            issued = bio_map.get(d.appt_date, 0)
-            sq = skip_queue_map.get(d.appt_date, 0)
-            daily_data.append({
-                'date': d.appt_date,
-                'total_appt': d.total,
-                'checked_in': checkin,
-                'card_issued': issued,
-                'skip_queue': sq,
-                'no_show': max(0, d.total - checkin - sq)
-            })
-
-        # Sort by date
-        daily_data = sorted(daily_data, key=lambda x: x['date'])
-
-        return {
-            'has_data': True,
-            'total_appointments': total_appts,
-            'checked_in': checked_in,
-            'card_issued': card_issued,
-            'skip_queue': skip_queue,
-            'no_show': no_show,
-            'daily_data': daily_data
-        }
-    finally:
-        session.close()
-        duration = (time.perf_counter() - start_time) * 1000
-        log_perf(f"get_appointment_service_stats({start_date} to {end_date})", duration)
-
-
 st.set_page_config(page_title="Overview - Bio Dashboard", page_icon="📈", layout="wide")
 
 require_login()
@@ -886,6 +102,7 @@ col_title, col_refresh = st.columns([6, 1])
 with col_refresh:
     if st.button("🔄 รีเฟรช", use_container_width=True, help="รีเฟรชข้อมูลใหม่"):
         st.cache_data.clear()
+        invalidate_query_cache()
         st.rerun()
 
 min_date, max_date = get_date_range()
@@ -970,6 +187,7 @@ else:
 
     # Get Stats
     stats = get_overview_stats(start_date, end_date, selected_branches)
+    st.caption(format_data_as_of(get_overview_stats, start_date, end_date, selected_branches))
 
     unique_at_center = stats['unique_at_center']
     unique_delivery = stats['unique_delivery']
@@ -4,7 +4,6 @@ import streamlit.components.v1 as components
 import pandas as pd
 from streamlit_echarts import st_echarts
 from datetime import date, timedelta
-import time
 import sys
 import os
 import json
@@ -12,83 +11,18 @@ import json
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.connection import init_db, get_session, get_branch_name_map_cached
-from database.models import Appointment, BranchMaster, QLog
-from sqlalchemy import func, and_, or_
+from database.models import Appointment
+from sqlalchemy import or_
 from utils.theme import apply_theme
 from utils.auth_check import require_login
-from utils.logger import log_perf
+from utils.query_cache import invalidate_query_cache, format_data_as_of
+from services.dashboard_queries import get_checkin_data, get_upcoming_appointments_full
+from services.workload_forecast import get_workload_forecast
 from utils.branch_display import get_branch_short_name_map
 
 init_db()
 
 
-@st.cache_data(ttl=3600)
-def get_checkin_data(selected_branches=None, start_date=None, end_date=None):
-    """
-    Get check-in data from QLog for comparison with appointments.
-    Returns aggregated check-in counts by branch and date.
-    """
-    session = get_session()
-    try:
-        if start_date is None:
-            start_date = date.today()
-        if end_date is None:
-            end_date = start_date + timedelta(days=29)
-
-        # Check if we have QLog data
-        has_qlog = session.query(QLog).first() is not None
-        if not has_qlog:
-            return {'has_data': False, 'by_branch': [], 'by_branch_date': []}
-
-        # Build filters
-        filters = [
-            QLog.qlog_date >= start_date,
-            QLog.qlog_date <= end_date,
-        ]
-        if selected_branches and len(selected_branches) > 0:
-            filters.append(QLog.branch_code.in_(selected_branches))
-
-        branch_map = get_branch_name_map_cached()
-
-        # Aggregate by branch (total in range)
-        by_branch_query = session.query(
-            QLog.branch_code,
-            func.count(QLog.id).label('checkin_count')
-        ).filter(and_(*filters)).group_by(QLog.branch_code).all()
-
-        by_branch = []
-        for r in by_branch_query:
-            by_branch.append({
-                'branch_code': r.branch_code,
-                'branch_name': branch_map.get(r.branch_code, r.branch_code),
-                'checkin_count': r.checkin_count
-            })
-
-        # Aggregate by branch and date
-        by_branch_date_query = session.query(
-            QLog.branch_code,
-            QLog.qlog_date,
-            func.count(QLog.id).label('checkin_count')
-        ).filter(and_(*filters)).group_by(QLog.branch_code, QLog.qlog_date).all()
-
-        by_branch_date = []
-        for r in by_branch_date_query:
-            by_branch_date.append({
-                'branch_code': r.branch_code,
-                'branch_name': branch_map.get(r.branch_code, r.branch_code),
-                'date': r.qlog_date,
-                'checkin_count': r.checkin_count
-            })
-
-        return {
-            'has_data': True,
-            'by_branch': by_branch,
-            'by_branch_date': by_branch_date
-        }
-    finally:
-        session.close()
-
-
 @st.cache_data(ttl=3600)
 def get_branch_list_forecast():
     """Get list of all branches that have appointments."""
@@ -114,260 +48,6 @@ def get_branch_list_forecast():
         session.close()
 
 
-@st.cache_data(ttl=3600)
-def get_upcoming_appointments_full(selected_branches=None, start_date=None, end_date=None, include_all_status=False):
-    """
-    Get detailed appointments for workload forecasting.
-    Includes capacity comparison from BranchMaster.max_capacity.
-
-    Args:
-        selected_branches: tuple of branch codes to filter (None = all)
-        start_date: start date for range (default: today)
-        end_date: end date for range (default: 30 days from start)
-        include_all_status: if True, include all appointment statuses (for historical data)
-                           if False, only include SUCCESS and WAITING (for future forecast)
-    """
-    start_time = time.perf_counter()
-    session = get_session()
-    try:
-        today = date.today()
-        # Default to today if no start_date provided
-        if start_date is None:
-            start_date = today
-        # Default to 30 days from start if no end_date provided
-        if end_date is None:
-            end_date = start_date + timedelta(days=29)
-
-        # Check if we have Appointment data
-        has_appt_data = session.query(Appointment).first() is not None
-
-        if not has_appt_data:
-            return {
-                'has_data': False,
-                'today': 0,
-                'tomorrow': 0,
-                'next_7_days': 0,
-                'next_30_days': 0,
-                'daily_data': [],
-                'by_center': [],
-                'by_center_daily': [],
-                'over_capacity_count': 0,
-                'warning_count': 0,
-                'max_date': None
-            }
-
-        # Build base filter
-        base_filters = [
-            Appointment.appt_date >= start_date,
-            Appointment.appt_date <= end_date,
-            Appointment.branch_code.isnot(None),
-            Appointment.branch_code != '',
-        ]
-
-        # Filter by status based on mode
-        if not include_all_status:
-            # Future forecast: only confirmed or waiting appointments
-            base_filters.append(Appointment.appt_status.in_(['SUCCESS', 'WAITING']))
-
-        if selected_branches and len(selected_branches) > 0:
-            base_filters.append(Appointment.branch_code.in_(selected_branches))
-
-        # Get max appointment date in future
-        max_future_date = session.query(func.max(Appointment.appt_date)).filter(
-            and_(*base_filters)
-        ).scalar()
-
-        if not max_future_date:
-            return {
-                'has_data': False,
-                'today': 0,
-                'tomorrow': 0,
-                'next_7_days': 0,
-                'next_30_days': 0,
-                'daily_data': [],
-                'by_center': [],
-                'by_center_daily': [],
-                'over_capacity_count': 0,
-                'warning_count': 0,
-                'max_date': None
-            }
-
-        # Counts - use start_date as base (not today)
-        # For "day 1" and "day 2" labels based on selected range
-        day1_count = session.query(func.count(func.distinct(Appointment.appointment_id))).filter(
-            and_(*base_filters), Appointment.appt_date == start_date
-        ).scalar() or 0
-
-        day2 = start_date + timedelta(days=1)
-        day2_count = session.query(func.count(func.distinct(Appointment.appointment_id))).filter(
-            and_(*base_filters), Appointment.appt_date == day2
-        ).scalar() or 0
-
-        # Calculate 7 days and 30 days from start_date
-        day7_end = start_date + timedelta(days=6)
-        day7_count = session.query(func.count(func.distinct(Appointment.appointment_id))).filter(
-            and_(*base_filters),
-            Appointment.appt_date >= start_date,
-            Appointment.appt_date <= day7_end
-        ).scalar() or 0
-
-        day30_end = start_date + timedelta(days=29)
-        day30_count = session.query(func.count(func.distinct(Appointment.appointment_id))).filter(
-            and_(*base_filters),
-            Appointment.appt_date >= start_date,
-            Appointment.appt_date <= day30_end
-        ).scalar() or 0
-
-        # Get capacity map from BranchMaster
-        # Exclude mobile units (-MB-) from total_capacity as they operate on-demand (max 160/day)
-        # Mobile units have branch_code like ACR-MB-S-001, BKK-MB-S-001 (contains -MB-)
-        capacity_map = {}
-        total_capacity = 0
-        branch_capacities = session.query(
-            BranchMaster.branch_code,
-            BranchMaster.max_capacity
-        ).filter(BranchMaster.max_capacity.isnot(None)).all()
-        for bc in branch_capacities:
-            capacity_map[bc.branch_code] = bc.max_capacity
-            # Only add to total_capacity if NOT a mobile unit (contains -MB-)
-            if '-MB-' not in str(bc.branch_code).upper():
-                total_capacity += bc.max_capacity
-
-        # Daily breakdown
-        chart_end_date = min(end_date, max_future_date)
-        daily_appts = session.query(
-            Appointment.appt_date,
-            func.count(func.distinct(Appointment.appointment_id)).label('total')
-        ).filter(
-            and_(*base_filters),
-            Appointment.appt_date <= chart_end_date
-        ).group_by(Appointment.appt_date).order_by(Appointment.appt_date).all()
-
-        daily_data = [{'date': d.appt_date, 'count': d.total} for d in daily_appts]
-
-        # By center (all centers, not just top 15)
-        branch_map = get_branch_name_map_cached()
-        short_name_map = get_branch_short_name_map()
-        by_center_query = session.query(
-            Appointment.branch_code,
-            func.count(func.distinct(Appointment.appointment_id)).label('total')
-        ).filter(
-            and_(*base_filters),
-            Appointment.appt_date <= chart_end_date
-        ).group_by(Appointment.branch_code).order_by(
-            func.count(func.distinct(Appointment.appointment_id)).desc()
-        ).all()
-
-        # First get daily counts per branch, then find max
-        # Step 1: Get count per branch per day
-        daily_counts_subq = session.query(
-            Appointment.branch_code,
-            Appointment.appt_date,
-            func.count(func.distinct(Appointment.appointment_id)).label('daily_count')
-        ).filter(
-            and_(*base_filters),
-            Appointment.appt_date <= chart_end_date
-        ).group_by(Appointment.branch_code, Appointment.appt_date).subquery()
-
-        # Step 2: Get max daily count per branch
-        max_daily_per_branch = session.query(
-            daily_counts_subq.c.branch_code,
-            func.max(daily_counts_subq.c.daily_count).label('max_daily')
-        ).group_by(daily_counts_subq.c.branch_code).all()
-
-        max_daily_map = {r.branch_code: r.max_daily for r in max_daily_per_branch}
-
-        by_center = []
-        for c in by_center_query:
-            capacity = capacity_map.get(c.branch_code)
-            max_daily = max_daily_map.get(c.branch_code, 0)
-            # Calculate average daily based on days_ahead
-            days_in_range = (chart_end_date - today).days + 1
-            avg_daily = c.total / days_in_range if days_in_range > 0 else c.total
-
-            # Use max_daily for status calculation (more accurate for detecting over-capacity days)
-            status = 'normal'
-            max_usage_pct = None
-            if capacity and max_daily:
-                max_usage_pct = (max_daily / capacity) * 100
-                if max_usage_pct >= 100:
-                    status = 'over'
-                elif max_usage_pct >= 80:
-                    status = 'warning'
-
-            # Also calculate avg usage for reference
-            avg_usage_pct = (avg_daily / capacity) * 100 if capacity else None
-
-            by_center.append({
-                'branch_code': c.branch_code,
-                'branch_name': short_name_map.get(c.branch_code, branch_map.get(c.branch_code, c.branch_code)),
-                'count': c.total,
-                'avg_daily': round(avg_daily, 1),
-                'max_daily': max_daily,
-                'capacity': capacity,
-                'usage_pct': round(avg_usage_pct, 1) if avg_usage_pct else None,
-                'max_usage_pct': round(max_usage_pct, 1) if max_usage_pct else None,
-                'status': status
-            })
-
-        # By center daily breakdown (for detailed view)
-        by_center_daily_query = session.query(
-            Appointment.branch_code,
-            Appointment.appt_date,
-            func.count(func.distinct(Appointment.appointment_id)).label('total')
-        ).filter(
-            and_(*base_filters),
-            Appointment.appt_date <= chart_end_date
-        ).group_by(Appointment.branch_code, Appointment.appt_date).all()
-
-        by_center_daily = []
-        over_capacity_count = 0
-        warning_count = 0
-        for c in by_center_daily_query:
-            capacity = capacity_map.get(c.branch_code)
-            status = 'normal'
-            usage_pct = None
-            if capacity:
-                usage_pct = (c.total / capacity) * 100
-                if usage_pct >= 100:
-                    status = 'over'
-                    over_capacity_count += 1
-                elif usage_pct >= 80:
-                    status = 'warning'
-                    warning_count += 1
-
-            by_center_daily.append({
-                'branch_code': c.branch_code,
-                'branch_name': short_name_map.get(c.branch_code, branch_map.get(c.branch_code, c.branch_code)),
-                'date': c.appt_date,
-                'count': c.total,
-                'capacity': capacity,
-                'usage_pct': round(usage_pct, 1) if usage_pct else None,
-                'status': status
-            })
-
-        return {
-            'has_data': True,
-            'day1': day1_count,
-            'day2': day2_count,
-            'day7': day7_count,
-            'day30': day30_count,
-            'daily_data': daily_data,
-            'by_center': by_center,
-            'by_center_daily': by_center_daily,
-            'over_capacity_count': over_capacity_count,
-            'warning_count': warning_count,
-            'max_date': max_future_date,
-            'total_capacity': total_capacity,
-            'start_date': start_date,
-            'end_date': end_date
-        }
-    finally:
-        session.close()
-        duration = (time.perf_counter() - start_time) * 1000
-        log_perf("get_upcoming_appointments_full", duration)
-
-
 st.set_page_config(page_title="ปริมาณการนัดหมาย - Bio Dashboard", page_icon="📆", layout="wide")
 
 require_login()
@@ -391,6 +71,7 @@ col_title, col_refresh = st.columns([6, 1])
 with col_refresh:
     if st.button("🔄 รีเฟรช", use_container_width=True, help="รีเฟรชข้อมูลใหม่"):
         st.cache_data.clear()
+        invalidate_query_cache()
         st.rerun()
 
 # Filter Section
@@ -535,6 +216,7 @@ selected_branches = tuple(selected_branch_codes) if selected_branch_codes else N
 
 # Get Data
 stats = get_upcoming_appointments_full(selected_branches, start_date, end_date, include_all_status)
+st.caption(format_data_as_of(get_upcoming_appointments_full, selected_branches, start_date, end_date, include_all_status))
 
 # Branch short name map for display (used in treemap, bar chart, table)
 short_name_map = get_branch_short_name_map()
@@ -1547,3 +1229,107 @@ else:
     - ไฟล์ Appointment (appointment-*.csv) ที่มี APPOINTMENT_DATE ในอนาคต
     - ไฟล์ Branch Master (ถ้าต้องการเทียบ Capacity)
     """)
+
+
+# ==================== Workload Forecast (model-based) ====================
+st.markdown("---")
+st.markdown("### 🔮 พยากรณ์ภาระงาน (Workload Forecast)")
+st.caption(
+    "คาดการณ์จากข้อมูลย้อนหลัง 365 วัน (QLog / Bio) รายศูนย์ — ปัจจัยวันในสัปดาห์, สิ้นเดือน และวันหยุดนักขัตฤกษ์ "
+    "| ช่วงแรเงา = ช่วงความเชื่อมั่น 95%"
+)
+
+workload = get_workload_forecast()
+if not workload.branch_codes:
+    st.info("📭 ข้อมูล Check-in / การพิมพ์บัตรย้อนหลังยังไม่พอสำหรับการพยากรณ์ (ต้องมีอย่างน้อย 28 วันต่อศูนย์)")
+else:
+    col_h, col_m = st.columns([1, 2])
+    with col_h:
+        horizon = st.radio("ระยะพยากรณ์", [30, 60, 90], index=0, horizontal=True,
+                           format_func=lambda x: f"{x} วัน", key="workload_horizon")
+    with col_m:
+        metric_labels = {'checkins': "Check-in", 'walk_ins': "Walk-in (ไม่มีนัด)", 'prints': "พิมพ์บัตร"}
+        metric = st.radio("ประเภทงาน", list(metric_labels), horizontal=True,
+                          format_func=lambda x: metric_labels[x], key="workload_metric")
+
+    forecast_total = workload.total(metric, horizon, selected_branches)
+    forecast_dates = [d.strftime('%d/%m') for d in forecast_total['dates']]
+    forecast_branches = selected_branches or workload.branch_codes
+    forecast_capacity = sum(
+        workload.capacity_map.get(b) or 0 for b in forecast_branches if '-MB-' not in str(b).upper()
+    )
+    mean_values = [round(float(v)) for v in forecast_total['mean']]
+    lower_values = [round(float(v)) for v in forecast_total['lower']]
+    band_values = [round(float(u - l)) for u, l in zip(forecast_total['upper'], forecast_total['lower'])]
+
+    fm1, fm2, fm3 = st.columns(3)
+    with fm1:
+        st.metric(f"เฉลี่ย/วัน ({horizon} วัน)", f"{sum(mean_values) / len(mean_values):,.0f}")
+    with fm2:
+        st.metric("วันสูงสุด", f"{max(mean_values):,}",
+                  help=f"{forecast_dates[mean_values.index(max(mean_values))]}")
+    with fm3:
+        st.metric("Capacity รวม/วัน", f"{forecast_capacity:,}", help="ไม่รวมหน่วยเคลื่อนที่ (-MB-)")
+
+    workload_chart_options = {
+        "backgroundColor": "transparent",
+        "tooltip": {"trigger": "axis"},
+        "legend": {"data": ["พยากรณ์", "Capacity"], "bottom": 0, "textStyle": {"color": "#6b7280"}},
+        "grid": {"left": "3%", "right": "4%", "bottom": "15%", "top": "10%", "containLabel": True},
+        "xAxis": {
+            "type": "category",
+            "data": forecast_dates,
+            "axisLabel": {"color": "#6b7280", "rotate": 45 if len(forecast_dates) > 15 else 0},
+        },
+        "yAxis": {"type": "value", "splitLine": {"lineStyle": {"color": "#e5e7eb"}}},
+        "series": [
+            {
+                "name": "ต่ำสุด",
+                "type": "line",
+                "data": lower_values,
+                "stack": "interval",
+                "lineStyle": {"opacity": 0},
+                "symbol": "none",
+                "tooltip": {"show": False},
+            },
+            {
+                "name": "ช่วง 95%",
+                "type": "line",
+                "data": band_values,
+                "stack": "interval",
+                "lineStyle": {"opacity": 0},
+                "areaStyle": {"color": "rgba(99, 102, 241, 0.2)"},
+                "symbol": "none",
+                "tooltip": {"show": False},
+            },
+            {
+                "name": "พยากรณ์",
+                "type": "line",
+                "data": mean_values,
+                "itemStyle": {"color": "#6366F1"},
+                "lineStyle": {"width": 2},
+                "symbol": "none",
+            },
+            {
+                "name": "Capacity",
+                "type": "line",
+                "data": [forecast_capacity] * len(forecast_dates),
+                "itemStyle": {"color": "#10B981"},
+                "lineStyle": {"width": 2, "type": "dashed"},
+                "symbol": "none",
+            },
+        ],
+    }
+    st_echarts(options=workload_chart_options, height="350px", key="workload_forecast_chart")
+
+    # Per-branch forecast vs capacity
+    summary = workload.branch_summary(metric, horizon, selected_branches)
+    if summary:
+        summary_df = pd.DataFrame(summary)
+        summary_df['branch_code'] = summary_df['branch_code'].apply(lambda b: short_name_map.get(b, b))
+        summary_df['peak_date'] = summary_df['peak_date'].apply(lambda d: d.strftime('%d/%m/%Y') if d else '-')
+        summary_df = summary_df[['branch_code', 'avg_daily', 'peak_daily', 'peak_upper', 'peak_date',
+                                 'capacity', 'peak_usage_pct', 'days_over_capacity']]
+        summary_df.columns = ['ศูนย์', 'เฉลี่ย/วัน', 'วันสูงสุด', 'วันสูงสุด (บน 95%)', 'วันที่สูงสุด',
+                              'Capacity', 'ใช้งานสูงสุด %', 'วันที่เกิน Capacity']
+        st.dataframe(summary_df, hide_index=True, use_container_width=True)
@@ -15,6 +15,8 @@ from streamlit_echarts import st_echarts
 from utils.theme import apply_theme, render_theme_toggle
 from utils.auth_check import require_login
 from utils.branch_display import get_branch_short_name
+from utils.query_cache import format_data_as_of
+from services.dashboard_queries import get_slot_availability, get_slot_cut_details
 
 init_db()
 
@@ -48,115 +50,6 @@ def get_capacity_map():
         _session.close()
 
 
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_booked_slots(start_date, end_date, selected_branches=None):
-    """ดึงจำนวน appointment ที่จองแล้ว GROUP BY branch_code, appt_date."""
-    from database.connection import get_session as _get_session
-    from database.models import Appointment as _Appt
-    from sqlalchemy import func as _func, and_ as _and
-
-    _session = _get_session()
-    try:
-        filters = [
-            _Appt.appt_date >= start_date,
-            _Appt.appt_date <= end_date,
-            _Appt.appt_status.in_(['SUCCESS', 'WAITING']),
-            _Appt.branch_code.isnot(None),
-        ]
-        if selected_branches:
-            filters.append(_Appt.branch_code.in_(selected_branches))
-
-        rows = _session.query(
-            _Appt.branch_code,
-            _Appt.appt_date,
-            _func.count(_func.distinct(_Appt.appointment_id)).label('booked')
-        ).filter(_and(*filters)).group_by(
-            _Appt.branch_code, _Appt.appt_date
-        ).all()
-
-        result = {}
-        for r in rows:
-            key = (r.branch_code, r.appt_date.isoformat() if r.appt_date else None)
-            result[key] = r.booked
-        return result
-    finally:
-        _session.close()
-
-
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_slot_cut_data(start_date, end_date, selected_branches=None):
-    """ดึงข้อมูล slot ที่ถูกตัด — ผู้รับบริการไปออกบัตรผิดวัน/ผิดศูนย์แล้ว."""
-    from database.connection import get_session as _get_session
-    from database.models import Card as _Card
-    from sqlalchemy import func as _func, and_ as _and, or_ as _or
-
-    _session = _get_session()
-    try:
-        base_filters = [
-            _or(_Card.wrong_date == True, _Card.wrong_branch == True),
-            _Card.print_status == 'G',
-            _Card.appt_branch.isnot(None),
-            _Card.appt_date.isnot(None),
-            _Card.appt_date >= start_date,
-            _Card.appt_date <= end_date,
-        ]
-        if selected_branches:
-            base_filters.append(_Card.appt_branch.in_(selected_branches))
-
-        # นับ slot ที่ตัดรวม GROUP BY ศูนย์+วัน
-        agg_rows = _session.query(
-            _Card.appt_branch,
-            _Card.appt_date,
-            _func.count(_func.distinct(_Card.appointment_id)).label('cut_count')
-        ).filter(_and(*base_filters)).group_by(
-            _Card.appt_branch, _Card.appt_date
-        ).all()
-
-        by_branch_date = {}
-        by_branch = {}
-        total_cuts = 0
-        for r in agg_rows:
-            key = (r.appt_branch, r.appt_date.isoformat() if r.appt_date else None)
-            by_branch_date[key] = r.cut_count
-            by_branch[r.appt_branch] = by_branch.get(r.appt_branch, 0) + r.cut_count
-            total_cuts += r.cut_count
-
-        # ดึงรายละเอียดสำหรับตาราง expander
-        detail_rows = _session.query(
-            _Card.appointment_id,
-            _Card.appt_branch,
-            _Card.appt_date,
-            _Card.branch_code,
-            _Card.branch_name,
-            _Card.print_date,
-            _Card.serial_number,
-            _Card.wrong_date,
-            _Card.wrong_branch,
-        ).filter(_and(*base_filters)).distinct().all()
-
-        details = []
-        for r in detail_rows:
-            details.append({
-                'Appointment ID': r.appointment_id,
-                'ศูนย์นัดเดิม': r.appt_branch,
-                'วันนัดเดิม': r.appt_date.strftime('%d/%m/%Y') if r.appt_date else '-',
-                'ศูนย์ที่ไปจริง': get_branch_short_name(r.branch_code, r.branch_name),
-                'วันที่ไปจริง': r.print_date.strftime('%d/%m/%Y') if r.print_date else '-',
-                'Serial Number': r.serial_number or '-',
-                'ผิดวัน': '✓' if r.wrong_date else '',
-                'ผิดศูนย์': '✓' if r.wrong_branch else '',
-            })
-
-        return {
-            'by_branch_date': by_branch_date,
-            'by_branch': by_branch,
-            'total_cuts': total_cuts,
-            'details': details,
-        }
-    finally:
-        _session.close()
-
-
 # ============================================================
 # หน้าหลัก
 # ============================================================
@@ -242,8 +135,10 @@ if view_mode == "select":
 
 # ---------- โหลดข้อมูล ----------
 with st.spinner("กำลังโหลดข้อมูล..."):
-    booked_data = get_booked_slots(first_day, last_day, selected_branches)
-    cut_data = get_slot_cut_data(first_day, last_day, selected_branches)
+    slot_data = get_slot_availability(first_day, last_day, selected_branches)
+    booked_data = slot_data['booked']
+    cut_data = slot_data['cuts']
+st.caption(format_data_as_of(get_slot_availability, first_day, last_day, selected_branches))
 
 # ---------- คำนวณสรุป ----------
 total_capacity = 0
@@ -509,8 +404,9 @@ while len(upcoming_dates) < 7:
 table_branches = selected_branches if selected_branches else list(all_branches_set)
 
 # โหลดข้อมูล 7 วัน (อาจต่างเดือนกับ calendar)
-booked_7d = get_booked_slots(upcoming_dates[0], upcoming_dates[-1], table_branches if selected_branches else None)
-cut_7d = get_slot_cut_data(upcoming_dates[0], upcoming_dates[-1], table_branches if selected_branches else None)
+slot_7d = get_slot_availability(upcoming_dates[0], upcoming_dates[-1], table_branches if selected_branches else None)
+booked_7d = slot_7d['booked']
+cut_7d = slot_7d['cuts']
 
 # สร้างข้อมูลตาราง
 table_rows = []
@@ -657,8 +553,10 @@ st.markdown("""
 
 st.markdown("---")
 
-details = cut_data['details']
-with st.expander(f"✂️ รายละเอียดการตัด Slot ({len(details):,} รายการ)", expanded=False):
+with st.expander(f"✂️ รายละเอียดการตัด Slot ({total_cuts:,} รายการ)", expanded=False):
+    # โหลดรายละเอียดเมื่อผู้ใช้ขอดูเท่านั้น (ไม่ต้อง query ทุกครั้งที่เปลี่ยนเดือน)
+    show_details = total_cuts > 0 and st.toggle("แสดงรายละเอียด", key="show_cut_details")
+    details = get_slot_cut_details(first_day, last_day, selected_branches) if show_details else []
     if details:
         df_details = pd.DataFrame(details)
         st.dataframe(df_details, hide_index=True, use_container_width=True, height=400)
@@ -676,7 +574,7 @@ with st.expander(f"✂️ รายละเอียดการตัด Slot
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             key="download_cuts",
         )
-    else:
+    elif total_cuts == 0:
         st.info("ไม่มีข้อมูลการตัด Slot ในเดือนที่เลือก")
 
 # คำอธิบายสูตรคำนวณ
@@ -1,16 +1,18 @@
 """Search page - Find specific cards with detailed view and anomaly detection."""
 import streamlit as st
 import pandas as pd
-from io import BytesIO
 import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.connection import init_db, get_session, get_branch_name_map_cached
-from database.models import Card, BadCard, AnomalySLA, WrongCenter
+from database.models import Card
 from services.data_service import DataService
-from sqlalchemy import func, or_, and_
+from services.anomaly_enrichment import enrich_anomalies
+from services.export_service import xlsx_export, csv_export, read_export, XLSX_MIME
+from services.identity_index_service import get_identity_timeline
+from sqlalchemy import func, and_
 from utils.theme import apply_theme
 from utils.auth_check import require_login
 from utils.branch_display import get_branch_short_name
@@ -18,112 +20,6 @@ from utils.branch_display import get_branch_short_name
 init_db()
 
 
-def batch_load_anomaly_data(session, card):
-    """
-    OPTIMIZED: Load all anomaly data for a card in batched queries instead of N+1 queries.
-    This reduces 6+ separate queries to 4 optimized queries.
-    """
-    anomalies = []
-    appt_id = card.appointment_id
-    serial = card.serial_number
-
-    # ==================== BATCH QUERY 1: G count and related cards for this appointment ====================
-    # Instead of separate count + details queries, get all in one
-    if appt_id:
-        related_g_cards = session.query(Card).filter(
-            Card.appointment_id == appt_id,
-            Card.print_status == 'G'
-        ).all()
-
-        if len(related_g_cards) > 1:
-            anomalies.append({
-                'type': 'multiple_g',
-                'title': f'นัดหมายนี้มีบัตรดี (G) มากกว่า 1 ใบ ({len(related_g_cards)} ใบ)',
-                'description': 'ต้องตรวจสอบว่าเป็นการออกบัตรซ้ำหรือไม่',
-                'details': related_g_cards
-            })
-
-    # ==================== BATCH QUERY 2: Duplicate serial check ====================
-    if serial:
-        dup_serial_cards = session.query(Card).filter(
-            Card.serial_number == serial
-        ).all()
-
-        if len(dup_serial_cards) > 1:
-            anomalies.append({
-                'type': 'duplicate_serial',
-                'title': f'Serial Number ซ้ำ ({len(dup_serial_cards)} รายการ)',
-                'description': f'Serial {serial} ถูกใช้งานหลายครั้ง',
-                'details': dup_serial_cards
-            })
-
-    # ==================== BATCH QUERY 3: SLA anomaly + Wrong center in one query pattern ====================
-    # Check SLA anomaly
-    if appt_id or serial:
-        sla_filter = []
-        if appt_id:
-            sla_filter.append(AnomalySLA.appointment_id == appt_id)
-        if serial:
-            sla_filter.append(AnomalySLA.serial_number == serial)
-
-        sla_anomaly = session.query(AnomalySLA).filter(or_(*sla_filter)).first()
-        if sla_anomaly:
-            anomalies.append({
-                'type': 'sla_over',
-                'title': f'SLA เกิน 12 นาที ({round(sla_anomaly.sla_minutes, 2) if sla_anomaly.sla_minutes else "-"} นาที)',
-                'description': f'ศูนย์: {sla_anomaly.branch_name or sla_anomaly.branch_code}',
-                'details': None
-            })
-
-        # Check wrong center
-        wc_filter = []
-        if appt_id:
-            wc_filter.append(WrongCenter.appointment_id == appt_id)
-        if serial:
-            wc_filter.append(WrongCenter.serial_number == serial)
-
-        wrong_center = session.query(WrongCenter).filter(or_(*wc_filter)).first()
-        if wrong_center:
-            anomalies.append({
-                'type': 'wrong_center',
-                'title': 'ออกบัตรผิดศูนย์',
-                'description': f'ศูนย์ที่นัด: {wrong_center.expected_branch} | ศูนย์ที่ออก: {wrong_center.actual_branch}',
-                'details': None
-            })
-
-    # ==================== Check flags on the card itself (no DB query needed) ====================
-    if card.wrong_date:
-        anomalies.append({
-            'type': 'wrong_date',
-            'title': 'นัดหมายผิดวัน',
-            'description': f'วันที่นัด: {card.appt_date} | วันที่ออกบัตร: {card.print_date}',
-            'details': None
-        })
-
-    if card.wait_over_1hour:
-        anomalies.append({
-            'type': 'wait_over',
-            'title': 'รอคิวเกิน 1 ชั่วโมง',
-            'description': f'เวลารอคิว: {card.wait_time_hms or "-"}',
-            'details': None
-        })
-
-    # ==================== BATCH QUERY 4: Bad cards for this appointment ====================
-    if appt_id:
-        bad_cards = session.query(BadCard).filter(
-            BadCard.appointment_id == appt_id
-        ).all()
-
-        if bad_cards:
-            anomalies.append({
-                'type': 'has_bad_cards',
-                'title': f'นัดหมายนี้มีบัตรเสีย ({len(bad_cards)} ใบ)',
-                'description': 'มีประวัติการออกบัตรเสียก่อนหน้า',
-                'details': bad_cards
-            })
-
-    return anomalies
-
 st.set_page_config(page_title="Search - Bio Dashboard", page_icon="🔍", layout="wide")
 
 # Check authentication
@@ -264,6 +160,18 @@ if 'search_term' not in st.session_state:
 if 'do_search' not in st.session_state:
     st.session_state.do_search = False
 
+# Display names of the source tables (cross-source timeline / bulk lookup)
+SOURCE_LABELS = {
+    'appointments': 'Appointment',
+    'qlogs': 'QLog',
+    'bio_records': 'Bio Raw',
+    'cards': 'Bio Unified',
+    'bad_cards': 'บัตรเสีย',
+    'anomaly_sla': 'SLA เกิน',
+    'wrong_centers': 'ออกบัตรผิดศูนย์',
+    'card_delivery_records': 'Card Delivery',
+}
+
 def clear_search():
     """Clear search term and reset filters."""
     st.session_state.search_term = ''
@@ -331,6 +239,88 @@ try:
             start_date = None
             end_date = None
 
+    # Bulk lookup (pasted list / CSV)
+    with st.expander("ค้นหาหลายรายการ (Bulk)", expanded=False):
+        col1, col2 = st.columns(2)
+        with col1:
+            bulk_text = st.text_area(
+                "วางรายการ ID (บรรทัดละ 1 รายการ หรือคั่นด้วยจุลภาค)",
+                height=150,
+                key="bulk_text"
+            )
+        with col2:
+            bulk_file = st.file_uploader(
+                "หรืออัปโหลดไฟล์ CSV (ใช้คอลัมน์แรก)",
+                type=['csv', 'txt'],
+                key="bulk_file"
+            )
+        bulk_button = st.button("ค้นหาทั้งหมด", key="bulk_search")
+
+        if bulk_button:
+            raw_ids = bulk_text.replace(',', '\n').splitlines()
+            if bulk_file is not None:
+                raw_ids += pd.read_csv(bulk_file, header=None, dtype=str, usecols=[0])[0].tolist()
+            identifiers = DataService.normalize_identifiers(raw_ids)
+
+            if not identifiers:
+                st.warning("กรุณาใส่รายการ ID อย่างน้อย 1 รายการ")
+            else:
+                # Results arrive in chunks (input order) - show progress as they stream in
+                progress = st.progress(0.0, text=f"กำลังค้นหา 0 / {len(identifiers):,} รายการ...")
+                chunks = []
+                for chunk in DataService.bulk_lookup_identifiers(session, identifiers):
+                    chunks.append(chunk)
+                    done = int(chunk['seq'].iloc[-1]) + 1
+                    progress.progress(done / len(identifiers), text=f"กำลังค้นหา {done:,} / {len(identifiers):,} รายการ...")
+                progress.empty()
+                bulk_df = pd.concat(chunks, ignore_index=True)
+
+                matched = bulk_df[bulk_df['found']]
+                summary = pd.DataFrame({'ID': identifiers})
+                sources = matched.groupby('identifier')['source'].agg(
+                    lambda x: ', '.join(SOURCE_LABELS.get(v, v) for v in dict.fromkeys(x))
+                )
+                counts = matched.groupby('identifier').size()
+                summary['สถานะ'] = summary['ID'].map(lambda v: 'พบ' if v in counts.index else 'ไม่พบ')
+                summary['แหล่งข้อมูลที่พบ'] = summary['ID'].map(sources).fillna('-')
+                summary['จำนวนรายการ'] = summary['ID'].map(counts).fillna(0).astype(int)
+
+                found_count = int((summary['สถานะ'] == 'พบ').sum())
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("ID ทั้งหมด", f"{len(summary):,}")
+                with col2:
+                    st.metric("พบ", f"{found_count:,}")
+                with col3:
+                    st.metric("ไม่พบ", f"{len(summary) - found_count:,}")
+
+                st.dataframe(summary, use_container_width=True, hide_index=True, height=300)
+
+                details = matched.assign(
+                    source=matched['source'].map(lambda v: SOURCE_LABELS.get(v, v))
+                )[['identifier', 'source', 'id_type', 'event_date', 'branch_code', 'status']].rename(columns={
+                    'identifier': 'ID', 'source': 'แหล่งข้อมูล', 'id_type': 'ประเภท ID',
+                    'event_date': 'วันที่', 'branch_code': 'ศูนย์บริการ', 'status': 'สถานะ',
+                })
+
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.download_button(
+                        label="ดาวน์โหลดสรุป (CSV)",
+                        data=read_export(csv_export(summary)),
+                        file_name=f"bulk_lookup_summary_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                        mime="text/csv",
+                        use_container_width=True
+                    )
+                with col2:
+                    st.download_button(
+                        label="ดาวน์โหลดรายละเอียด (CSV)",
+                        data=read_export(csv_export(details)),
+                        file_name=f"bulk_lookup_details_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                        mime="text/csv",
+                        use_container_width=True
+                    )
+
     # Update session state
     if search_button:
         st.session_state.search_term = search_term
@@ -367,6 +357,9 @@ try:
             # Get branch name mapping from BranchMaster
             branch_name_map = get_branch_name_map_cached()
 
+            # Anomaly checks for the whole result set (4 queries, not 4 per card)
+            anomalies_by_card = enrich_anomalies(session, results)
+
             # Convert to DataFrame
             data = []
             for card in results:
@@ -393,6 +386,7 @@ try:
                     'สถานะ': status_icon,
                     'SLA (นาที)': round(card.sla_minutes, 2) if card.sla_minutes else 0,
                     'Flags': ', '.join(flags) if flags else '-',
+                    'Anomaly': len(anomalies_by_card[card.id]),
                     'ผู้ให้บริการ': card.operator or '-',
                     'วันที่': card.print_date,
                 })
@@ -413,23 +407,18 @@ try:
             # Export buttons
             col1, col2, col3 = st.columns([1, 1, 2])
             with col1:
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Search Results')
-
                 st.download_button(
                     label="ดาวน์โหลด Excel",
-                    data=buffer.getvalue(),
+                    data=read_export(xlsx_export({'Search Results': df})),
                     file_name=f"search_results_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    mime=XLSX_MIME,
                     use_container_width=True
                 )
 
             with col2:
-                csv = df.to_csv(index=False).encode('utf-8-sig')
                 st.download_button(
                     label="ดาวน์โหลด CSV",
-                    data=csv,
+                    data=read_export(csv_export(df)),
                     file_name=f"search_results_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
                     mime="text/csv",
                     use_container_width=True
@@ -450,9 +439,7 @@ try:
             # ===== ANOMALY DETECTION SECTION =====
             st.markdown("#### ผลการตรวจสอบ Anomaly")
 
-            # OPTIMIZED: Use batch loading instead of N+1 queries
-            # This reduces 6+ separate database queries to 4 optimized queries
-            anomalies_found = batch_load_anomaly_data(session, selected)
+            anomalies_found = anomalies_by_card[selected.id]
 
             # Display anomalies
             if anomalies_found:
@@ -632,6 +619,24 @@ try:
             - ตรวจสอบช่วงวันที่ที่เลือก
             """)
 
+        # Cross-source timeline (exact identifier, all tables)
+        timeline = get_identity_timeline(search_term) if search_term else []
+        if timeline:
+            st.markdown("---")
+            st.markdown('<div class="section-header">ไทม์ไลน์ข้ามแหล่งข้อมูล</div>', unsafe_allow_html=True)
+            st.dataframe(
+                pd.DataFrame([{
+                    'วันที่': e['event_date'],
+                    'แหล่งข้อมูล': SOURCE_LABELS.get(e['source'], e['source']),
+                    'ประเภท ID': e['id_type'],
+                    'ID': e['identifier'],
+                    'ศูนย์บริการ': e['branch_code'] or '-',
+                    'สถานะ': e['status'] or '-',
+                } for e in timeline]),
+                use_container_width=True,
+                hide_index=True,
+            )
+
     else:
         # Show quick search tips
         st.markdown("---")
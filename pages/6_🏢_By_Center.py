@@ -4,7 +4,6 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from streamlit_echarts import st_echarts
-from io import BytesIO
 import sys
 import os
 import re
@@ -15,203 +14,22 @@ from database.connection import init_db, get_session, get_branch_name_map_cached
 from utils.branch_display import get_branch_short_name_map
 from database.models import Card, BranchMaster
 from services.data_service import DataService
-from sqlalchemy import func, and_, case, or_
+from services.export_service import xlsx_export
+from sqlalchemy import func, or_
 from utils.theme import apply_theme, render_theme_toggle
 from utils.auth_check import require_login
+from utils.query_cache import format_data_as_of
+from utils.export_download import export_download_button
+from services.dashboard_queries import (
+    get_card_breakdowns_cached, get_center_stats_cached, get_region_stats_cached,
+    get_service_funnel_by_branch_cached,
+)
 
 init_db()
 
 st.set_page_config(page_title="Center & Region - Bio Dashboard", page_icon="🏢", layout="wide")
 
 
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_center_stats_cached(start_date, end_date):
-    """Cached center statistics query."""
-    from types import SimpleNamespace
-    from database.connection import get_session as _get_session
-    from database.models import Card as _Card
-    from sqlalchemy import func as _func, and_ as _and, case as _case
-
-    _session = _get_session()
-    try:
-        result = _session.query(
-            _Card.branch_code,
-            _Card.branch_name,
-            _func.count(_Card.id).label('total'),
-            _func.sum(_case((_Card.print_status == 'G', 1), else_=0)).label('good_count'),
-            _func.sum(_case((_Card.print_status == 'B', 1), else_=0)).label('bad_count'),
-            _func.avg(_Card.sla_minutes).label('avg_sla'),
-            _func.max(_Card.sla_minutes).label('max_sla'),
-            _func.sum(_case((_Card.sla_over_12min == True, 1), else_=0)).label('sla_over_count'),
-            _func.sum(_case((_Card.wrong_branch == True, 1), else_=0)).label('wrong_branch_count'),
-            _func.sum(_case((_Card.wrong_date == True, 1), else_=0)).label('wrong_date_count')
-        ).filter(
-            _and(_Card.print_date >= start_date, _Card.print_date <= end_date),
-            _Card.branch_code.isnot(None)
-        ).group_by(_Card.branch_code, _Card.branch_name).order_by(
-            _func.count(_Card.id).desc()
-        ).all()
-
-        return [SimpleNamespace(
-            branch_code=r.branch_code,
-            branch_name=r.branch_name,
-            total=r.total,
-            good_count=r.good_count or 0,
-            bad_count=r.bad_count or 0,
-            avg_sla=float(r.avg_sla) if r.avg_sla else 0.0,
-            max_sla=float(r.max_sla) if r.max_sla else 0.0,
-            sla_over_count=r.sla_over_count or 0,
-            wrong_branch_count=r.wrong_branch_count or 0,
-            wrong_date_count=r.wrong_date_count or 0,
-        ) for r in result]
-    finally:
-        _session.close()
-
-
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_region_stats_cached(start_date, end_date):
-    """Cached region statistics query."""
-    from types import SimpleNamespace
-    from database.connection import get_session as _get_session
-    from database.models import Card as _Card
-    from sqlalchemy import func as _func, and_ as _and, case as _case
-
-    _session = _get_session()
-    try:
-        result = _session.query(
-            _Card.region,
-            _func.count(_Card.id).label('total'),
-            _func.sum(_case((_Card.print_status == 'G', 1), else_=0)).label('good_count'),
-            _func.sum(_case((_Card.print_status == 'B', 1), else_=0)).label('bad_count'),
-            _func.avg(_Card.sla_minutes).label('avg_sla'),
-            _func.max(_Card.sla_minutes).label('max_sla'),
-            _func.sum(_case((_Card.sla_over_12min == True, 1), else_=0)).label('sla_over_count'),
-            _func.sum(_case((_Card.wrong_branch == True, 1), else_=0)).label('wrong_branch_count'),
-            _func.sum(_case((_Card.wrong_date == True, 1), else_=0)).label('wrong_date_count'),
-            _func.count(_func.distinct(_Card.branch_code)).label('center_count')
-        ).filter(
-            _and(_Card.print_date >= start_date, _Card.print_date <= end_date),
-            _Card.region.isnot(None),
-            _Card.region != ''
-        ).group_by(_Card.region).order_by(
-            _func.count(_Card.id).desc()
-        ).all()
-
-        return [SimpleNamespace(
-            region=r.region,
-            total=r.total,
-            good_count=r.good_count or 0,
-            bad_count=r.bad_count or 0,
-            avg_sla=float(r.avg_sla) if r.avg_sla else 0.0,
-            max_sla=float(r.max_sla) if r.max_sla else 0.0,
-            sla_over_count=r.sla_over_count or 0,
-            wrong_branch_count=r.wrong_branch_count or 0,
-            wrong_date_count=r.wrong_date_count or 0,
-            center_count=r.center_count or 0,
-        ) for r in result]
-    finally:
-        _session.close()
-
-
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_service_funnel_by_branch_cached(start_date, end_date):
-    """Get appointment service funnel (appointments, check-in, skip_queue, no_show) per branch."""
-    from database.connection import get_session as _get_session
-    from database.models import Appointment as _Appt, QLog as _QLog, BioRecord as _Bio
-    from sqlalchemy import func as _func, and_ as _and
-
-    _session = _get_session()
-    try:
-        # 1. Appointments per branch (exclude CANCEL/EXPIRED)
-        appt_rows = _session.query(
-            _Appt.branch_code,
-            _func.count(_func.distinct(_Appt.appointment_id)).label('total')
-        ).filter(
-            _and(
-                _Appt.appt_date >= start_date,
-                _Appt.appt_date <= end_date,
-                ~_Appt.appt_status.in_(['CANCEL', 'EXPIRED'])
-            )
-        ).group_by(_Appt.branch_code).all()
-        appt_map = {r.branch_code: r.total for r in appt_rows}
-
-        if not appt_map:
-            return {}
-
-        # 2. QLog check-in per branch
-        qlog_rows = _session.query(
-            _QLog.branch_code,
-            _func.count(_func.distinct(_QLog.appointment_code)).label('checkin')
-        ).filter(
-            _and(
-                _QLog.qlog_date >= start_date,
-                _QLog.qlog_date <= end_date,
-                _QLog.qlog_num.isnot(None),
-            )
-        ).group_by(_QLog.branch_code).all()
-        qlog_map = {r.branch_code: r.checkin for r in qlog_rows}
-
-        # 3. Bio served per branch (unique appointment_ids that got cards)
-        bio_rows = _session.query(
-            _Bio.branch_code,
-            _func.count(_func.distinct(_Bio.appointment_id)).label('served')
-        ).filter(
-            _and(
-                _Bio.print_date >= start_date,
-                _Bio.print_date <= end_date,
-            )
-        ).group_by(_Bio.branch_code).all()
-        bio_map = {r.branch_code: r.served for r in bio_rows}
-
-        # 4. Skip queue per branch: Bio appointment_ids NOT in QLog
-        # Get all QLog appointment_codes as a set per branch
-        qlog_detail = _session.query(
-            _QLog.branch_code, _QLog.appointment_code
-        ).filter(
-            _and(
-                _QLog.qlog_date >= start_date,
-                _QLog.qlog_date <= end_date,
-                _QLog.qlog_num.isnot(None),
-            )
-        ).all()
-        qlog_sets = {}
-        for row in qlog_detail:
-            qlog_sets.setdefault(row.branch_code, set()).add(row.appointment_code)
-
-        bio_detail = _session.query(
-            _Bio.branch_code, _Bio.appointment_id
-        ).filter(
-            _and(
-                _Bio.print_date >= start_date,
-                _Bio.print_date <= end_date,
-            )
-        ).all()
-        bio_sets = {}
-        for row in bio_detail:
-            bio_sets.setdefault(row.branch_code, set()).add(row.appointment_id)
-
-        # Compute skip_queue per branch
-        all_branches = set(appt_map.keys()) | set(bio_map.keys())
-        result = {}
-        for bc in all_branches:
-            total = appt_map.get(bc, 0)
-            checkin = qlog_map.get(bc, 0)
-            bio_appts = bio_sets.get(bc, set())
-            qlog_appts = qlog_sets.get(bc, set())
-            skip_queue = len(bio_appts - qlog_appts)
-            no_show = max(0, total - checkin - skip_queue)
-            result[bc] = {
-                'total_appts': total,
-                'checked_in': checkin,
-                'skip_queue': skip_queue,
-                'no_show': no_show,
-                'bio_served': bio_map.get(bc, 0),
-            }
-        return result
-    finally:
-        _session.close()
-
-
 # Check authentication
 require_login()
 
@@ -411,8 +229,8 @@ try:
         with col2:
             end_date = st.date_input("วันที่สิ้นสุด", value=max_date, min_value=min_date, max_value=max_date)
 
-        # Date filter condition
-        date_filter = and_(Card.print_date >= start_date, Card.print_date <= end_date)
+        # Center/region stats, daily trends and operators all come from one scan (cached)
+        breakdowns = get_card_breakdowns_cached(start_date, end_date)
 
         # Main tabs: Center vs Region
         main_tab1, main_tab2 = st.tabs([
@@ -430,6 +248,7 @@ try:
             center_stats = get_center_stats_cached(start_date, end_date)
             # Get appointment service funnel per branch (skip_queue, no_show)
             service_funnel = get_service_funnel_by_branch_cached(start_date, end_date)
+            st.caption(format_data_as_of(get_card_breakdowns_cached, start_date, end_date))
 
             if center_stats:
                 # Get branch name mapping from BranchMaster
@@ -619,15 +438,11 @@ try:
                     st.dataframe(df_sorted, use_container_width=True, hide_index=True, height=500)
 
                     # Export
-                    buffer = BytesIO()
-                    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                        df_sorted.to_excel(writer, index=False, sheet_name='Center Stats')
-
-                    st.download_button(
-                        label="📥 ดาวน์โหลด Excel",
-                        data=buffer.getvalue(),
+                    export_download_button(
+                        "📥 ดาวน์โหลด Excel", "center_stats",
+                        (start_date, end_date, search_type, selected_filter, sort_by, sort_order),
+                        lambda df_sorted=df_sorted: xlsx_export({'Center Stats': df_sorted}),
                         file_name=f"center_stats_{start_date}_{end_date}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         key="center_download"
                     )
 
@@ -953,23 +768,18 @@ try:
                             st.markdown("---")
                             st.markdown("##### 📈 แนวโน้มรายวัน")
 
-                            daily_center = session.query(
-                                Card.print_date,
-                                func.count(Card.id).label('total'),
-                                func.sum(case((Card.print_status == 'G', 1), else_=0)).label('good'),
-                                func.avg(Card.sla_minutes).label('avg_sla')
-                            ).filter(
-                                date_filter,
-                                Card.branch_code == selected_center_code
-                            ).group_by(Card.print_date).order_by(Card.print_date).all()
-
-                            if daily_center:
+                            daily_center = breakdowns['center_daily']
+                            daily_center = daily_center[
+                                daily_center['branch_code'] == selected_center_code
+                            ].sort_values('print_date')
+
+                            if not daily_center.empty:
                                 daily_data = pd.DataFrame([{
                                     'วันที่': str(d.print_date),
                                     'ทั้งหมด': d.total,
-                                    'บัตรดี': d.good or 0,
-                                    'SLA เฉลี่ย': round(d.avg_sla, 2) if d.avg_sla else 0
-                                } for d in daily_center])
+                                    'บัตรดี': d.good_count or 0,
+                                    'SLA เฉลี่ย': round(d.avg_sla, 2) if pd.notna(d.avg_sla) else 0
+                                } for d in daily_center.itertuples(index=False)])
 
                                 fig = go.Figure()
                                 fig.add_trace(go.Bar(x=daily_data['วันที่'], y=daily_data['บัตรดี'], name='บัตรดี', marker_color='#2ecc71'))
@@ -985,25 +795,19 @@ try:
                             # Top operators at this center
                             st.markdown("##### 👤 ผู้ให้บริการที่ศูนย์นี้")
 
-                            operators = session.query(
-                                Card.operator,
-                                func.count(Card.id).label('total'),
-                                func.sum(case((Card.print_status == 'G', 1), else_=0)).label('good'),
-                                func.avg(Card.sla_minutes).label('avg_sla')
-                            ).filter(
-                                date_filter,
-                                Card.branch_code == selected_center_code,
-                                Card.operator.isnot(None)
-                            ).group_by(Card.operator).order_by(func.count(Card.id).desc()).limit(10).all()
-
-                            if operators:
+                            operators = breakdowns['center_operator']
+                            operators = operators[
+                                (operators['branch_code'] == selected_center_code) & operators['operator'].notna()
+                            ].sort_values('total', ascending=False, kind='stable').head(10)
+
+                            if not operators.empty:
                                 op_data = pd.DataFrame([{
                                     'ผู้ให้บริการ': op.operator,
                                     'จำนวน': op.total,
-                                    'บัตรดี': op.good or 0,
-                                    'อัตราบัตรดี (%)': round((op.good or 0) / op.total * 100, 1) if op.total > 0 else 0,
-                                    'SLA เฉลี่ย': round(op.avg_sla, 2) if op.avg_sla else 0
-                                } for op in operators])
+                                    'บัตรดี': op.good_count or 0,
+                                    'อัตราบัตรดี (%)': round((op.good_count or 0) / op.total * 100, 1) if op.total > 0 else 0,
+                                    'SLA เฉลี่ย': round(op.avg_sla, 2) if pd.notna(op.avg_sla) else 0
+                                } for op in operators.itertuples(index=False)])
                                 st.dataframe(op_data, use_container_width=True, hide_index=True)
 
             else:
@@ -1017,6 +821,7 @@ try:
 
             # Get region statistics (cached)
             region_stats = get_region_stats_cached(start_date, end_date)
+            st.caption(format_data_as_of(get_card_breakdowns_cached, start_date, end_date))
 
             if region_stats:
                 # Summary metrics
@@ -1094,15 +899,11 @@ try:
                     st.dataframe(df_region_sorted, use_container_width=True, hide_index=True, height=400)
 
                     # Export
-                    buffer_r = BytesIO()
-                    with pd.ExcelWriter(buffer_r, engine='xlsxwriter') as writer:
-                        df_region_sorted.to_excel(writer, index=False, sheet_name='Region Stats')
-
-                    st.download_button(
-                        label="📥 ดาวน์โหลด Excel",
-                        data=buffer_r.getvalue(),
+                    export_download_button(
+                        "📥 ดาวน์โหลด Excel", "region_stats",
+                        (start_date, end_date, sort_by_r, sort_order_r),
+                        lambda df_region_sorted=df_region_sorted: xlsx_export({'Region Stats': df_region_sorted}),
                         file_name=f"region_stats_{start_date}_{end_date}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         key="region_download"
                     )
 
@@ -1280,27 +1081,19 @@ try:
                             # Centers in this region
                             st.markdown("##### 🏢 ศูนย์ในภูมิภาคนี้")
 
-                            centers_in_region = session.query(
-                                Card.branch_code,
-                                Card.branch_name,
-                                func.count(Card.id).label('total'),
-                                func.sum(case((Card.print_status == 'G', 1), else_=0)).label('good'),
-                                func.avg(Card.sla_minutes).label('avg_sla')
-                            ).filter(
-                                date_filter,
-                                Card.region == region_name
-                            ).group_by(Card.branch_code, Card.branch_name).order_by(
-                                func.count(Card.id).desc()
-                            ).all()
-
-                            if centers_in_region:
+                            centers_in_region = breakdowns['region_center']
+                            centers_in_region = centers_in_region[
+                                centers_in_region['region'] == region_name
+                            ].sort_values('total', ascending=False, kind='stable')
+
+                            if not centers_in_region.empty:
                                 centers_data = pd.DataFrame([{
-                                    'ศูนย์บริการ': short_name_map.get(c.branch_code, c.branch_name or '-'),
+                                    'ศูนย์บริการ': short_name_map.get(c.branch_code, c.branch_name if pd.notna(c.branch_name) else '-'),
                                     'จำนวน': c.total,
-                                    'บัตรดี': c.good or 0,
-                                    'อัตราบัตรดี (%)': round((c.good or 0) / c.total * 100, 1) if c.total > 0 else 0,
-                                    'SLA เฉลี่ย': round(c.avg_sla, 2) if c.avg_sla else 0
-                                } for c in centers_in_region])
+                                    'บัตรดี': c.good_count or 0,
+                                    'อัตราบัตรดี (%)': round((c.good_count or 0) / c.total * 100, 1) if c.total > 0 else 0,
+                                    'SLA เฉลี่ย': round(c.avg_sla, 2) if pd.notna(c.avg_sla) else 0
+                                } for c in centers_in_region.itertuples(index=False)])
 
                                 st.dataframe(centers_data, use_container_width=True, hide_index=True, height=400)
 
@@ -1323,23 +1116,18 @@ try:
                             # Daily trend for this region
                             st.markdown("##### 📈 แนวโน้มรายวัน")
 
-                            daily_region = session.query(
-                                Card.print_date,
-                                func.count(Card.id).label('total'),
-                                func.sum(case((Card.print_status == 'G', 1), else_=0)).label('good'),
-                                func.avg(Card.sla_minutes).label('avg_sla')
-                            ).filter(
-                                date_filter,
-                                Card.region == region_name
-                            ).group_by(Card.print_date).order_by(Card.print_date).all()
-
-                            if daily_region:
+                            daily_region = breakdowns['region_daily']
+                            daily_region = daily_region[
+                                daily_region['region'] == region_name
+                            ].sort_values('print_date')
+
+                            if not daily_region.empty:
                                 daily_r_data = pd.DataFrame([{
                                     'วันที่': str(d.print_date),
                                     'ทั้งหมด': d.total,
-                                    'บัตรดี': d.good or 0,
-                                    'SLA เฉลี่ย': round(d.avg_sla, 2) if d.avg_sla else 0
-                                } for d in daily_region])
+                                    'บัตรดี': d.good_count or 0,
+                                    'SLA เฉลี่ย': round(d.avg_sla, 2) if pd.notna(d.avg_sla) else 0
+                                } for d in daily_region.itertuples(index=False)])
 
                                 fig_daily = go.Figure()
                                 fig_daily.add_trace(go.Bar(x=daily_r_data['วันที่'], y=daily_r_data['บัตรดี'], name='บัตรดี', marker_color='#9b59b6'))
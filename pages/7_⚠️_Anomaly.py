@@ -3,7 +3,6 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from io import BytesIO
 import sys
 import os
 
@@ -11,10 +10,14 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.connection import init_db, get_session
 from database.models import Card, BadCard, AnomalySLA, WrongCenter
-from sqlalchemy import func, and_, case, or_
+from sqlalchemy import func, and_, case
 from utils.theme import apply_theme, render_theme_toggle
 from utils.auth_check import require_login
 from utils.branch_display import get_branch_short_name
+from utils.query_cache import single_flight
+from utils.export_download import export_download_button
+from services.export_service import xlsx_export, query_chunks
+from services.search_index import identifier_search_filter
 
 init_db()
 
@@ -22,27 +25,49 @@ st.set_page_config(page_title="Anomaly - Bio Dashboard", page_icon="⚠️", lay
 
 
 @st.cache_data(ttl=3600, show_spinner=False)
+@single_flight("get_anomaly_summary_cached")
 def get_anomaly_summary_cached(start_date, end_date):
-    """Cached anomaly summary counts."""
+    """Cached anomaly summary counts.
+
+    Blank appointment / card IDs are never counted as multi G keys. The
+    anomalies index is read first once built (uploads refresh it before the
+    page cache is cleared); the analytics snapshot, synced in the background
+    after an upload, only stands in for the ``cards`` queries until then.
+    """
     from database.connection import get_session as _get_session
     from database.models import Card as _Card
     from sqlalchemy import func as _func, and_ as _and
+    from services.anomaly_index_service import is_anomaly_index_ready, get_anomaly_counts
+
+    if not is_anomaly_index_ready():
+        from services.dashboard_queries import get_anomaly_summary_from_snapshot
+        summary = get_anomaly_summary_from_snapshot(start_date, end_date)
+        if summary is not None:
+            return summary
 
     _session = _get_session()
     try:
         _date_filter = _and(_Card.print_date >= start_date, _Card.print_date <= end_date)
 
-        appt_g_more_than_1 = _session.query(_Card.appointment_id).filter(
-            _date_filter, _Card.print_status == 'G'
-        ).group_by(_Card.appointment_id).having(_func.count(_Card.id) > 1).count()
-
-        card_id_g_more_than_1 = _session.query(_Card.card_id).filter(
-            _date_filter, _Card.print_status == 'G',
-            _Card.card_id.isnot(None), _Card.card_id != ''
-        ).group_by(_Card.card_id).having(_func.count(_Card.id) > 1).count()
-
-        wrong_date_count = _session.query(_Card).filter(_date_filter, _Card.wrong_date == True).count()
-        wrong_branch_count = _session.query(_Card).filter(_date_filter, _Card.wrong_branch == True).count()
+        if is_anomaly_index_ready():
+            counts = get_anomaly_counts(_session, start_date, end_date)
+            appt_g_more_than_1 = counts['multi_g_appt']['keys']
+            card_id_g_more_than_1 = counts['multi_g_card_id']['keys']
+            wrong_date_count = counts['wrong_date']['cards']
+            wrong_branch_count = counts['wrong_branch']['cards']
+        else:
+            appt_g_more_than_1 = _session.query(_Card.appointment_id).filter(
+                _date_filter, _Card.print_status == 'G',
+                _Card.appointment_id.isnot(None), _Card.appointment_id != ''
+            ).group_by(_Card.appointment_id).having(_func.count(_Card.id) > 1).count()
+
+            card_id_g_more_than_1 = _session.query(_Card.card_id).filter(
+                _date_filter, _Card.print_status == 'G',
+                _Card.card_id.isnot(None), _Card.card_id != ''
+            ).group_by(_Card.card_id).having(_func.count(_Card.id) > 1).count()
+
+            wrong_date_count = _session.query(_Card).filter(_date_filter, _Card.wrong_date == True).count()
+            wrong_branch_count = _session.query(_Card).filter(_date_filter, _Card.wrong_branch == True).count()
 
         branches = _session.query(_Card.branch_code).filter(
             _date_filter, _Card.branch_code.isnot(None)
@@ -60,152 +85,109 @@ def get_anomaly_summary_cached(start_date, end_date):
         _session.close()
 
 
+def _flagged_list_select(anomaly_type, stmt, session, start_date, end_date, branch_code, limit):
+    """Limit a wrong date / wrong branch list, by the card ids in ``anomalies`` once it is built."""
+    from database.models import Card as _Card
+    from services.anomaly_index_service import is_anomaly_index_ready, get_flagged_card_ids
+
+    if not is_anomaly_index_ready():
+        return stmt.limit(limit)
+    card_ids = get_flagged_card_ids(
+        session, anomaly_type, start_date, end_date, [branch_code] if branch_code else None, limit
+    )
+    return stmt.where(_Card.id.in_(card_ids))
+
+
 @st.cache_data(ttl=3600, show_spinner="กำลังโหลดข้อมูลผิดวัน...")
 def get_wrong_date_data(start_date, end_date, branch_filter, limit):
-    """Cached wrong date query."""
+    """Cached wrong date list (displayed columns only)."""
     from database.connection import get_session as _get_session
-    from database.models import Card as _Card
-    from sqlalchemy import and_ as _and
-    from utils.branch_display import get_branch_short_name as _short
+    from services.read_models import anomaly_frame, wrong_date_select
 
     _session = _get_session()
     try:
-        _date_filter = _and(_Card.print_date >= start_date, _Card.print_date <= end_date)
-        q = _session.query(_Card).filter(_date_filter, _Card.wrong_date == True)
-        if branch_filter and branch_filter != 'ทั้งหมด':
-            q = q.filter(_Card.branch_code == branch_filter)
-        results = q.limit(limit).all()
-        return [{
-            'Appointment ID': c.appointment_id,
-            'รหัสศูนย์': c.branch_code,
-            'ชื่อศูนย์': _short(c.branch_code, c.branch_name),
-            'วันที่นัด': c.appt_date,
-            'วันที่ออกบัตร': c.print_date,
-            'Serial Number': c.serial_number,
-            'สถานะ': 'บัตรดี' if c.print_status == 'G' else 'บัตรเสีย',
-            'ผู้ให้บริการ': c.operator or '-',
-        } for c in results]
+        branch_code = branch_filter if branch_filter and branch_filter != 'ทั้งหมด' else None
+        stmt = _flagged_list_select(
+            'wrong_date', wrong_date_select(start_date, end_date, branch_code),
+            _session, start_date, end_date, branch_code, limit,
+        )
+        return anomaly_frame(_session, stmt)
     finally:
         _session.close()
 
 
 @st.cache_data(ttl=3600, show_spinner="กำลังโหลดข้อมูลผิดศูนย์...")
 def get_wrong_branch_data(start_date, end_date, branch_filter, limit):
-    """Cached wrong branch query."""
+    """Cached wrong branch list (displayed columns only)."""
     from database.connection import get_session as _get_session
-    from database.models import Card as _Card
-    from sqlalchemy import and_ as _and
-    from utils.branch_display import get_branch_short_name as _short
+    from services.read_models import anomaly_frame, wrong_branch_select
 
     _session = _get_session()
     try:
-        _date_filter = _and(_Card.print_date >= start_date, _Card.print_date <= end_date)
-        q = _session.query(_Card).filter(_date_filter, _Card.wrong_branch == True)
-        if branch_filter and branch_filter != 'ทั้งหมด':
-            q = q.filter(_Card.branch_code == branch_filter)
-        results = q.limit(limit).all()
-        return [{
-            'Appointment ID': c.appointment_id,
-            'ศูนย์ที่นัด': c.appt_branch or '-',
-            'ศูนย์ที่ออกบัตร': c.branch_code,
-            'ชื่อศูนย์': _short(c.branch_code, c.branch_name),
-            'Serial Number': c.serial_number,
-            'Card ID': c.card_id,
-            'สถานะ': 'บัตรดี' if c.print_status == 'G' else 'บัตรเสีย',
-            'วันที่พิมพ์': c.print_date,
-            'ผู้ให้บริการ': c.operator or '-',
-        } for c in results]
+        branch_code = branch_filter if branch_filter and branch_filter != 'ทั้งหมด' else None
+        stmt = _flagged_list_select(
+            'wrong_branch', wrong_branch_select(start_date, end_date, branch_code),
+            _session, start_date, end_date, branch_code, limit,
+        )
+        return anomaly_frame(_session, stmt)
     finally:
         _session.close()
 
 
 @st.cache_data(ttl=3600, show_spinner="กำลังโหลดข้อมูล G>1...")
 def get_multi_g_appt_data(start_date, end_date, limit):
-    """Cached multi-G per appointment query."""
+    """Cached G cards of the ``limit`` appointments with the most G cards (G > 1)."""
     from database.connection import get_session as _get_session
-    from database.models import Card as _Card
-    from sqlalchemy import func as _func, and_ as _and
-    from utils.branch_display import get_branch_short_name as _short
+    from services.read_models import anomaly_frame, multi_g_appt_select
 
     _session = _get_session()
     try:
-        _date_filter = _and(_Card.print_date >= start_date, _Card.print_date <= end_date)
-        multi_g_appts = _session.query(
-            _Card.appointment_id,
-            _func.count(_Card.id).label('count')
-        ).filter(
-            _date_filter, _Card.print_status == 'G'
-        ).group_by(_Card.appointment_id).having(_func.count(_Card.id) > 1).order_by(
-            _func.count(_Card.id).desc()
-        ).limit(limit).all()
-
-        if not multi_g_appts:
-            return []
-
-        appt_ids = [a.appointment_id for a in multi_g_appts]
-        cards = _session.query(_Card).filter(
-            _date_filter, _Card.print_status == 'G',
-            _Card.appointment_id.in_(appt_ids)
-        ).order_by(_Card.appointment_id).all()
-
-        return [{
-            'Appointment ID': c.appointment_id,
-            'รหัสศูนย์': c.branch_code,
-            'ชื่อศูนย์': _short(c.branch_code, c.branch_name),
-            'Card ID': c.card_id,
-            'Serial Number': c.serial_number,
-            'Work Permit': c.work_permit_no,
-            'SLA (นาที)': round(c.sla_minutes, 2) if c.sla_minutes else 0,
-            'ผู้ให้บริการ': c.operator or '-',
-            'วันที่': c.print_date,
-        } for c in cards]
+        return anomaly_frame(_session, multi_g_appt_select(start_date, end_date, limit))
     finally:
         _session.close()
 
 
 @st.cache_data(ttl=3600, show_spinner="กำลังโหลดข้อมูล Card ID G>1...")
 def get_multi_g_cardid_data(start_date, end_date, limit):
-    """Cached multi-G per card_id query."""
+    """Cached G cards of the ``limit`` card IDs with the most G cards (G > 1)."""
+    from database.connection import get_session as _get_session
+    from services.read_models import anomaly_frame, multi_g_card_id_select
+
+    _session = _get_session()
+    try:
+        return anomaly_frame(_session, multi_g_card_id_select(start_date, end_date, limit))
+    finally:
+        _session.close()
+
+
+def build_anomaly_report(start_date, end_date, summary_df):
+    """All-anomalies workbook: Summary plus every Wrong Date / Wrong Branch / Multi G / Card ID G>1 row.
+
+    Runs in a background export thread (own session); detail sheets are
+    streamed from server-side cursors.
+    """
     from database.connection import get_session as _get_session
     from database.models import Card as _Card
-    from sqlalchemy import func as _func, and_ as _and
-    from utils.branch_display import get_branch_short_name as _short
+    from services.read_models import (
+        anomaly_display, wrong_date_select, wrong_branch_select, multi_g_appt_select, multi_g_card_id_select,
+    )
+
+    def _sheet(stmt):
+        return (anomaly_display(chunk) for chunk in query_chunks(_session, stmt))
 
     _session = _get_session()
     try:
-        _date_filter = _and(_Card.print_date >= start_date, _Card.print_date <= end_date)
-        multi_g = _session.query(
-            _Card.card_id,
-            _func.count(_Card.id).label('count')
-        ).filter(
-            _date_filter, _Card.print_status == 'G',
-            _Card.card_id.isnot(None), _Card.card_id != ''
-        ).group_by(_Card.card_id).having(_func.count(_Card.id) > 1).order_by(
-            _func.count(_Card.id).desc()
-        ).limit(limit).all()
-
-        if not multi_g:
-            return []
-
-        card_id_list = [c.card_id for c in multi_g]
-        cards = _session.query(_Card).filter(
-            _date_filter, _Card.print_status == 'G',
-            _Card.card_id.in_(card_id_list)
-        ).order_by(_Card.card_id).all()
-
-        return [{
-            'Card ID': c.card_id,
-            'Appointment ID': c.appointment_id,
-            'รหัสศูนย์': c.branch_code,
-            'ชื่อศูนย์': _short(c.branch_code, c.branch_name),
-            'Serial Number': c.serial_number,
-            'Work Permit': c.work_permit_no,
-            'ผู้ให้บริการ': c.operator or '-',
-            'วันที่': c.print_date,
-        } for c in cards]
+        return xlsx_export({
+            'Summary': summary_df,
+            'Wrong Date': _sheet(wrong_date_select(start_date, end_date).order_by(_Card.id)),
+            'Wrong Branch': _sheet(wrong_branch_select(start_date, end_date).order_by(_Card.id)),
+            'Multi G Cards': _sheet(multi_g_appt_select(start_date, end_date)),
+            'Card ID G More Than 1': _sheet(multi_g_card_id_select(start_date, end_date)),
+        })
     finally:
         _session.close()
 
+
 # Check authentication
 require_login()
 
@@ -434,11 +416,7 @@ try:
             # Find related cards
             related_cards = session.query(Card).filter(
                 date_filter,
-                or_(
-                    Card.appointment_id.ilike(f'%{search_term}%'),
-                    Card.serial_number.ilike(f'%{search_term}%'),
-                    Card.card_id.ilike(f'%{search_term}%')
-                )
+                identifier_search_filter(Card, search_term, ('appointment_id', 'serial_number', 'card_id'))
             ).all()
 
             if related_cards:
@@ -592,10 +570,9 @@ try:
             with col2:
                 wd_limit = st.slider("จำนวนแสดง", 100, 5000, 500, key="wd_limit")
 
-            data = get_wrong_date_data(start_date, end_date, wd_branch_filter, wd_limit)
+            df = get_wrong_date_data(start_date, end_date, wd_branch_filter, wd_limit)
 
-            if data:
-                df = pd.DataFrame(data)
+            if not df.empty:
                 st.dataframe(df, use_container_width=True, hide_index=True, height=400)
 
                 st.markdown("##### 📊 สรุปตามศูนย์")
@@ -603,12 +580,10 @@ try:
                 center_counts = center_counts.sort_values('จำนวน', ascending=False).head(15)
                 st.dataframe(center_counts, use_container_width=True, hide_index=True)
 
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Wrong Date')
-                st.download_button("📥 ดาวน์โหลด Excel", buffer.getvalue(),
-                    f"wrong_date_{start_date}_{end_date}.xlsx",
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                export_download_button("📥 ดาวน์โหลด Excel", "anomaly_wrong_date",
+                    (start_date, end_date, wd_branch_filter, wd_limit),
+                    lambda df=df: xlsx_export({'Wrong Date': df}),
+                    f"wrong_date_{start_date}_{end_date}.xlsx")
             else:
                 st.success("✅ ไม่พบรายการนัดหมายผิดวัน")
 
@@ -623,10 +598,9 @@ try:
             with col2:
                 wb_limit = st.slider("จำนวนแสดง", 100, 5000, 500, key="wb_limit")
 
-            data = get_wrong_branch_data(start_date, end_date, wb_branch_filter, wb_limit)
+            df = get_wrong_branch_data(start_date, end_date, wb_branch_filter, wb_limit)
 
-            if data:
-                df = pd.DataFrame(data)
+            if not df.empty:
                 st.dataframe(df, use_container_width=True, hide_index=True, height=400)
 
                 # Summary by center
@@ -635,13 +609,11 @@ try:
                 center_counts = center_counts.sort_values('จำนวน', ascending=False)
                 st.dataframe(center_counts, use_container_width=True, hide_index=True)
 
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Wrong Branch')
-                    center_counts.to_excel(writer, index=False, sheet_name='Summary by Center')
-                st.download_button("📥 ดาวน์โหลด Excel", buffer.getvalue(),
-                    f"wrong_branch_{start_date}_{end_date}.xlsx",
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                export_download_button("📥 ดาวน์โหลด Excel", "anomaly_wrong_branch",
+                    (start_date, end_date, wb_branch_filter, wb_limit),
+                    lambda df=df, center_counts=center_counts: xlsx_export(
+                        {'Wrong Branch': df, 'Summary by Center': center_counts}),
+                    f"wrong_branch_{start_date}_{end_date}.xlsx")
             else:
                 st.success("✅ ไม่พบรายการออกบัตรผิดศูนย์")
 
@@ -652,11 +624,10 @@ try:
 
             mg_limit = st.slider("จำนวน Appointment แสดง", 50, 500, 100, key="mg_limit")
 
-            data = get_multi_g_appt_data(start_date, end_date, mg_limit)
+            df = get_multi_g_appt_data(start_date, end_date, mg_limit)
 
-            if data:
-                df = pd.DataFrame(data)
-                st.info(f"พบ **{multi_g_count:,}** Appointment ที่มีบัตรดีมากกว่า 1 ใบ (แสดง {len(multi_g_appts)} รายการ รวม **{len(df):,}** บัตร)")
+            if not df.empty:
+                st.info(f"พบ **{multi_g_count:,}** Appointment ที่มีบัตรดีมากกว่า 1 ใบ (แสดง {df['Appointment ID'].nunique(dropna=False)} รายการ รวม **{len(df):,}** บัตร)")
                 st.dataframe(df, use_container_width=True, hide_index=True, height=400)
 
                 # Summary by appointment
@@ -665,13 +636,11 @@ try:
                 appt_summary = appt_summary.sort_values('จำนวนบัตร', ascending=False)
                 st.dataframe(appt_summary.head(20), use_container_width=True, hide_index=True)
 
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Multi G Cards')
-                    appt_summary.to_excel(writer, index=False, sheet_name='By Appointment')
-                st.download_button("📥 ดาวน์โหลด Excel", buffer.getvalue(),
-                    f"multi_g_cards_{start_date}_{end_date}.xlsx",
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                export_download_button("📥 ดาวน์โหลด Excel", "anomaly_multi_g",
+                    (start_date, end_date, mg_limit),
+                    lambda df=df, appt_summary=appt_summary: xlsx_export(
+                        {'Multi G Cards': df, 'By Appointment': appt_summary}),
+                    f"multi_g_cards_{start_date}_{end_date}.xlsx")
             else:
                 st.success("✅ ไม่พบ Appointment ที่มีบัตรดีมากกว่า 1 ใบ")
 
@@ -682,11 +651,10 @@ try:
 
             cg_limit = st.slider("จำนวน Card ID แสดง", 50, 500, 100, key="cg_limit")
 
-            data = get_multi_g_cardid_data(start_date, end_date, cg_limit)
+            df = get_multi_g_cardid_data(start_date, end_date, cg_limit)
 
-            if data:
-                df = pd.DataFrame(data)
-                st.info(f"พบ **{card_id_g_count:,}** Card ID ที่มีบัตรดีมากกว่า 1 ใบ (แสดง {len(multi_g_card_ids)} รายการ รวม **{len(df):,}** บัตร)")
+            if not df.empty:
+                st.info(f"พบ **{card_id_g_count:,}** Card ID ที่มีบัตรดีมากกว่า 1 ใบ (แสดง {df['Card ID'].nunique()} รายการ รวม **{len(df):,}** บัตร)")
                 st.dataframe(df, use_container_width=True, hide_index=True, height=400)
 
                 # Summary by Card ID
@@ -695,13 +663,11 @@ try:
                 card_summary = card_summary.sort_values('จำนวนบัตร', ascending=False)
                 st.dataframe(card_summary.head(20), use_container_width=True, hide_index=True)
 
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Card ID G More Than 1')
-                    card_summary.to_excel(writer, index=False, sheet_name='By Card ID')
-                st.download_button("📥 ดาวน์โหลด Excel", buffer.getvalue(),
-                    f"card_id_g_more_than_1_{start_date}_{end_date}.xlsx",
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                export_download_button("📥 ดาวน์โหลด Excel", "anomaly_card_id_g",
+                    (start_date, end_date, cg_limit),
+                    lambda df=df, card_summary=card_summary: xlsx_export(
+                        {'Card ID G More Than 1': df, 'By Card ID': card_summary}),
+                    f"card_id_g_more_than_1_{start_date}_{end_date}.xlsx")
             else:
                 st.success("✅ ไม่พบ Card ID ที่มีบัตรดีมากกว่า 1 ใบ")
 
@@ -709,35 +675,22 @@ try:
         st.markdown("---")
         st.markdown('<div class="section-header-blue">📥 ส่งออกข้อมูลทั้งหมด</div>', unsafe_allow_html=True)
 
-        if st.button("📥 ดาวน์โหลดรายงานความผิดปกติทั้งหมด", type="primary", use_container_width=True):
-            with st.spinner("กำลังสร้างไฟล์..."):
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    # Summary sheet
-                    summary_df = pd.DataFrame({
-                        'ประเภทความผิดปกติ': [
-                            'นัดหมายผิดวัน',
-                            'Appt ID G > 1', 'Card ID G > 1'
-                        ],
-                        'จำนวน': [
-                            wrong_date_count,
-                            multi_g_count, card_id_g_count
-                        ]
-                    })
-                    summary_df.to_excel(writer, index=False, sheet_name='Summary')
-
-                    # Wrong Date
-                    wrong_date_data = session.query(Card).filter(date_filter, Card.wrong_date == True).all()
-                    if wrong_date_data:
-                        pd.DataFrame([{
-                            'Appointment ID': c.appointment_id, 'รหัสศูนย์': c.branch_code,
-                            'วันที่นัด': c.appt_date, 'วันที่ออกบัตร': c.print_date,
-                            'ผู้ให้บริการ': c.operator
-                        } for c in wrong_date_data]).to_excel(writer, index=False, sheet_name='Wrong Date')
-
-                st.download_button("📥 ดาวน์โหลด", buffer.getvalue(),
-                    f"all_anomalies_{start_date}_{end_date}.xlsx",
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        summary_df = pd.DataFrame({
+            'ประเภทความผิดปกติ': [
+                'นัดหมายผิดวัน', 'ออกบัตรผิดศูนย์',
+                'Appt ID G > 1', 'Card ID G > 1'
+            ],
+            'จำนวน': [
+                wrong_date_count, wrong_branch_count,
+                multi_g_count, card_id_g_count
+            ]
+        })
+        export_download_button(
+            "📥 ดาวน์โหลดรายงานความผิดปกติทั้งหมด", "anomaly_all", (start_date, end_date),
+            lambda start=start_date, end=end_date, summary=summary_df: build_anomaly_report(start, end, summary),
+            f"all_anomalies_{start_date}_{end_date}.xlsx",
+            button_type="primary", use_container_width=True,
+        )
 
     else:
         st.markdown("""
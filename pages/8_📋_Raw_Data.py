@@ -1,7 +1,6 @@
 """Raw Data page - View all data with comprehensive filters and complete columns."""
 import streamlit as st
 import pandas as pd
-from io import BytesIO
 import sys
 import os
 
@@ -10,10 +9,11 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from database.connection import init_db, get_session, get_branch_name_map_cached
 from database.models import Card, Report
 from services.data_service import DataService
-from sqlalchemy import func, and_
+from services.export_service import xlsx_export, csv_export, read_export, XLSX_MIME, CSV_MIME
+from sqlalchemy import func, case
 from utils.theme import apply_theme, render_theme_toggle
 from utils.auth_check import require_login
-from utils.branch_display import get_branch_short_name
+from services.read_models import rows_to_frame, dash, yes_no, flag_array, short_branch_names, round_or_blank
 
 init_db()
 
@@ -29,6 +29,104 @@ apply_theme()
 st.markdown("<h2 style='margin-bottom: 5px; color: #1E293B;'>📋 Raw Data</h2>", unsafe_allow_html=True)
 st.markdown("<p style='color: #64748B; margin-bottom: 20px;'>ดูและส่งออกข้อมูลบัตรทั้งหมด</p>", unsafe_allow_html=True)
 
+# Columns read for the listing (rows are tuples; print_date + id are the page cursor)
+RAW_DATA_COLUMNS = [
+    Card.id, Card.appointment_id, Card.card_id, Card.serial_number, Card.work_permit_no,
+    Card.print_status, Card.print_date, Card.operator, Card.branch_code, Card.branch_name, Card.region,
+    Card.sla_minutes, Card.sla_start, Card.sla_stop, Card.sla_duration, Card.sla_confirm_type, Card.sla_over_12min,
+    Card.qlog_id, Card.qlog_branch, Card.qlog_date, Card.qlog_queue_no, Card.qlog_type, Card.qlog_time_in,
+    Card.qlog_time_call, Card.wait_time_minutes, Card.wait_time_hms, Card.qlog_sla_status,
+    Card.appt_date, Card.appt_branch, Card.appt_status, Card.wrong_date, Card.wrong_branch,
+    Card.is_mobile_unit, Card.is_ob_center, Card.old_appointment, Card.is_valid_sla_status,
+    Card.wait_over_1hour, Card.emergency, Card.form_id, Card.form_type, Card.reject_type,
+]
+
+
+# Raw flag column -> label in the 'Flags' column
+RAW_DATA_FLAGS = [
+    ('sla_over_12min', 'SLA>12'), ('wrong_branch', 'ผิดศูนย์'), ('wrong_date', 'ผิดวัน'),
+    ('wait_over_1hour', 'รอ>1ชม'), ('emergency', 'Emergency'),
+]
+
+
+def cards_to_frame(rows, branch_name_map):
+    """Display DataFrame for a batch of RAW_DATA_COLUMNS rows (built column by column)."""
+    cards = rows_to_frame(rows, [column.key for column in RAW_DATA_COLUMNS])
+
+    # Get branch name from BranchMaster
+    branch_names = pd.Series([
+        branch_name_map.get(code, name or code or '-')
+        for code, name in zip(cards['branch_code'].to_numpy(dtype=object, na_value=None),
+                              cards['branch_name'].to_numpy(dtype=object, na_value=None))
+    ], dtype=object)
+    flags = [flag_array(cards[column]) for column, _ in RAW_DATA_FLAGS]
+    labels = [label for _, label in RAW_DATA_FLAGS]
+
+    # Order columns by importance - key card data first
+    return pd.DataFrame({
+        # Primary card identification
+        'Appointment ID': dash(cards['appointment_id']),
+        'Card ID': dash(cards['card_id']),
+        'Serial Number': dash(cards['serial_number']),
+        'Work Permit': dash(cards['work_permit_no']),
+        'สถานะ': dash(cards['print_status']),
+        'วันที่พิมพ์': cards['print_date'],
+        'ผู้ให้บริการ': dash(cards['operator']),
+        # Center info
+        'ศูนย์บริการ': short_branch_names(cards['branch_code'], branch_names),
+        'ภูมิภาค': dash(cards['region']),
+        # SLA info
+        'SLA (นาที)': round_or_blank(cards['sla_minutes']),
+        'SLA Start': dash(cards['sla_start']),
+        'SLA Stop': dash(cards['sla_stop']),
+        'SLA Duration': dash(cards['sla_duration']),
+        'SLA Confirm Type': dash(cards['sla_confirm_type']),
+        'SLA Over 12min': yes_no(cards['sla_over_12min']),
+        # Queue info (may be empty for monthly reports)
+        'Qlog ID': dash(cards['qlog_id']),
+        'Qlog Branch': dash(cards['qlog_branch']),
+        'Qlog Date': dash(cards['qlog_date']),
+        'Qlog Queue No': dash(cards['qlog_queue_no']),
+        'Qlog Type': dash(cards['qlog_type']),
+        'Time In': dash(cards['qlog_time_in']),
+        'Time Call': dash(cards['qlog_time_call']),
+        'Wait (นาที)': round_or_blank(cards['wait_time_minutes']),
+        'Wait Time (HMS)': dash(cards['wait_time_hms']),
+        'Qlog SLA Status': dash(cards['qlog_sla_status']),
+        # Appointment info
+        'วันที่นัด': dash(cards['appt_date']),
+        'ศูนย์ที่นัด': dash(cards['appt_branch']),
+        'สถานะนัดหมาย': dash(cards['appt_status']),
+        # Flags
+        'Wrong Date': yes_no(cards['wrong_date']),
+        'Wrong Branch': yes_no(cards['wrong_branch']),
+        'Mobile Unit': yes_no(cards['is_mobile_unit']),
+        'OB Center': yes_no(cards['is_ob_center']),
+        'Old Appointment': yes_no(cards['old_appointment']),
+        'Valid SLA Status': yes_no(cards['is_valid_sla_status']),
+        'Wait Over 1hr': yes_no(cards['wait_over_1hour']),
+        'Emergency': yes_no(cards['emergency']),
+        'Flags': [', '.join(label for label, on in zip(labels, row) if on) or '-' for row in zip(*flags)],
+        # Other
+        'Form ID': dash(cards['form_id']),
+        'Form Type': dash(cards['form_type']),
+        'สาเหตุบัตรเสีย': dash(cards['reject_type']),
+    })
+
+
+def _next_page(cursor):
+    st.session_state.raw_data_cursors.append(cursor)
+
+
+def _previous_page():
+    if len(st.session_state.raw_data_cursors) > 1:
+        st.session_state.raw_data_cursors.pop()
+
+
+def _first_page():
+    st.session_state.raw_data_cursors = [None]
+
+
 session = get_session()
 
 try:
@@ -73,36 +171,50 @@ try:
         show_wrong_date = st.sidebar.checkbox("นัดหมายผิดวัน")
         show_wait_over = st.sidebar.checkbox("รอคิวเกิน 1 ชม.")
 
-        # Display option - Show all or limited
+        # Display option - rows per page (keyset pagination)
         st.sidebar.markdown("#### การแสดงผล")
-        show_all_rows = st.sidebar.checkbox("แสดงข้อมูลทั้งหมด", value=False, help="ถ้าไม่เลือก จะแสดงสูงสุด 5000 แถว")
+        page_size = st.sidebar.selectbox("จำนวนแถวต่อหน้า", options=[100, 500, 1000, 5000], index=2)
 
-        # Build query
-        query = session.query(Card)
-
-        # Apply filters
-        query = query.filter(Card.print_date >= start_date)
-        query = query.filter(Card.print_date <= end_date)
+        # Build filters
+        filters = [Card.print_date >= start_date, Card.print_date <= end_date]
 
         if selected_branches:
-            query = query.filter(Card.branch_code.in_(selected_branches))
+            filters.append(Card.branch_code.in_(selected_branches))
 
         if status_filter == 'บัตรดี (G)':
-            query = query.filter(Card.print_status == 'G')
+            filters.append(Card.print_status == 'G')
         elif status_filter == 'บัตรเสีย (B)':
-            query = query.filter(Card.print_status == 'B')
+            filters.append(Card.print_status == 'B')
 
         if show_sla_over:
-            query = query.filter(Card.sla_over_12min == True)
+            filters.append(Card.sla_over_12min == True)
         if show_wrong_branch:
-            query = query.filter(Card.wrong_branch == True)
+            filters.append(Card.wrong_branch == True)
         if show_wrong_date:
-            query = query.filter(Card.wrong_date == True)
+            filters.append(Card.wrong_date == True)
         if show_wait_over:
-            query = query.filter(Card.wait_over_1hour == True)
-
-        # Get total count after filters
-        filtered_count = query.count()
+            filters.append(Card.wait_over_1hour == True)
+
+        # Count and stats of all filtered rows in one aggregate query
+        filtered_count, good_count, bad_count, avg_sla, avg_wait = session.query(
+            func.count(Card.id),
+            func.sum(case((Card.print_status == 'G', 1), else_=0)),
+            func.sum(case((Card.print_status == 'B', 1), else_=0)),
+            func.avg(Card.sla_minutes),
+            func.avg(Card.wait_time_minutes),
+        ).filter(*filters).one()
+        good_count, bad_count = good_count or 0, bad_count or 0
+
+        # Page cursors (start of each visited page); back to page 1 when the filters change
+        filter_key = (
+            start_date, end_date, tuple(selected_branches), status_filter,
+            show_sla_over, show_wrong_branch, show_wrong_date, show_wait_over, page_size,
+        )
+        if st.session_state.get('raw_data_filter_key') != filter_key:
+            st.session_state.raw_data_filter_key = filter_key
+            st.session_state.raw_data_cursors = [None]
+        page_no = len(st.session_state.raw_data_cursors)
+        total_pages = max(1, -(-filtered_count // page_size))
 
         # Summary stats
         col1, col2, col3 = st.columns(3)
@@ -111,91 +223,18 @@ try:
         with col2:
             st.metric("ผลลัพธ์ที่กรอง", f"{filtered_count:,}")
         with col3:
-            if show_all_rows:
-                st.metric("แสดงผล", f"{filtered_count:,}")
-            else:
-                st.metric("แสดงผล", f"{min(5000, filtered_count):,}")
+            st.metric("หน้า", f"{page_no:,} / {total_pages:,}")
 
-        # Execute query
-        if show_all_rows:
-            results = query.order_by(Card.print_date.desc()).all()
-        else:
-            results = query.order_by(Card.print_date.desc()).limit(5000).all()
+        # Execute query - one page of column tuples (no ORM objects)
+        results, next_cursor = DataService.fetch_cards_page(
+            session, filters, RAW_DATA_COLUMNS, page_size, after=st.session_state.raw_data_cursors[-1]
+        )
 
         if results:
             # Get branch name mapping from BranchMaster
             branch_name_map = get_branch_name_map_cached()
 
-            # Convert to DataFrame with columns ordered by importance
-            data = []
-            for card in results:
-                flags = []
-                if card.sla_over_12min:
-                    flags.append("SLA>12")
-                if card.wrong_branch:
-                    flags.append("ผิดศูนย์")
-                if card.wrong_date:
-                    flags.append("ผิดวัน")
-                if card.wait_over_1hour:
-                    flags.append("รอ>1ชม")
-                if card.emergency:
-                    flags.append("Emergency")
-
-                # Get branch name from BranchMaster
-                branch_name = branch_name_map.get(card.branch_code, card.branch_name or card.branch_code or '-')
-
-                # Order columns by importance - key card data first
-                data.append({
-                    # Primary card identification
-                    'Appointment ID': card.appointment_id or '-',
-                    'Card ID': card.card_id or '-',
-                    'Serial Number': card.serial_number or '-',
-                    'Work Permit': card.work_permit_no or '-',
-                    'สถานะ': card.print_status or '-',
-                    'วันที่พิมพ์': card.print_date,
-                    'ผู้ให้บริการ': card.operator or '-',
-                    # Center info
-                    'ศูนย์บริการ': get_branch_short_name(card.branch_code, branch_name),
-                    'ภูมิภาค': card.region or '-',
-                    # SLA info
-                    'SLA (นาที)': round(card.sla_minutes, 2) if card.sla_minutes else None,
-                    'SLA Start': card.sla_start or '-',
-                    'SLA Stop': card.sla_stop or '-',
-                    'SLA Duration': card.sla_duration or '-',
-                    'SLA Confirm Type': card.sla_confirm_type or '-',
-                    'SLA Over 12min': 'Y' if card.sla_over_12min else 'N',
-                    # Queue info (may be empty for monthly reports)
-                    'Qlog ID': card.qlog_id or '-',
-                    'Qlog Branch': card.qlog_branch or '-',
-                    'Qlog Date': card.qlog_date or '-',
-                    'Qlog Queue No': card.qlog_queue_no if card.qlog_queue_no else '-',
-                    'Qlog Type': card.qlog_type or '-',
-                    'Time In': card.qlog_time_in or '-',
-                    'Time Call': card.qlog_time_call or '-',
-                    'Wait (นาที)': round(card.wait_time_minutes, 2) if card.wait_time_minutes else None,
-                    'Wait Time (HMS)': card.wait_time_hms or '-',
-                    'Qlog SLA Status': card.qlog_sla_status or '-',
-                    # Appointment info
-                    'วันที่นัด': card.appt_date or '-',
-                    'ศูนย์ที่นัด': card.appt_branch or '-',
-                    'สถานะนัดหมาย': card.appt_status or '-',
-                    # Flags
-                    'Wrong Date': 'Y' if card.wrong_date else 'N',
-                    'Wrong Branch': 'Y' if card.wrong_branch else 'N',
-                    'Mobile Unit': 'Y' if card.is_mobile_unit else 'N',
-                    'OB Center': 'Y' if card.is_ob_center else 'N',
-                    'Old Appointment': 'Y' if card.old_appointment else 'N',
-                    'Valid SLA Status': 'Y' if card.is_valid_sla_status else 'N',
-                    'Wait Over 1hr': 'Y' if card.wait_over_1hour else 'N',
-                    'Emergency': 'Y' if card.emergency else 'N',
-                    'Flags': ', '.join(flags) if flags else '-',
-                    # Other
-                    'Form ID': card.form_id or '-',
-                    'Form Type': card.form_type or '-',
-                    'สาเหตุบัตรเสีย': card.reject_type or '-',
-                })
-
-            df = pd.DataFrame(data)
+            df = cards_to_frame(results, branch_name_map)
 
             # Column selector - reordered for better visibility
             col_groups = {
@@ -235,8 +274,12 @@ try:
             else:
                 display_df = df
 
-            # Display data - show ALL rows without limit
-            st.caption(f"แสดง {len(display_df):,} แถว x {len(display_df.columns)} คอลัมน์")
+            # Display data - current page only
+            first_row = (page_no - 1) * page_size + 1
+            st.caption(
+                f"แสดงแถว {first_row:,} - {first_row + len(display_df) - 1:,} จาก {filtered_count:,} "
+                f"x {len(display_df.columns)} คอลัมน์"
+            )
             st.caption("*หมายเหตุ: ข้อมูล Queue (Qlog) อาจไม่มีสำหรับบางรายงาน โดยเฉพาะรายงานรายเดือน*")
 
             # Use st.dataframe with dynamic height based on data
@@ -248,46 +291,66 @@ try:
                 height=height
             )
 
+            # Page navigation (keyset: each page continues after the last row of the previous one)
+            col1, col2, col3, col4 = st.columns([1, 1, 2, 1])
+            with col1:
+                st.button("⏮ หน้าแรก", on_click=_first_page, disabled=page_no == 1, use_container_width=True)
+            with col2:
+                st.button("◀ ก่อนหน้า", on_click=_previous_page, disabled=page_no == 1, use_container_width=True)
+            with col3:
+                st.markdown(
+                    f"<div style='text-align: center; padding-top: 8px;'>หน้า {page_no:,} / {total_pages:,}</div>",
+                    unsafe_allow_html=True
+                )
+            with col4:
+                st.button(
+                    "ถัดไป ▶", on_click=_next_page, args=(next_cursor,),
+                    disabled=next_cursor is None, use_container_width=True
+                )
+
             # Export section
             st.markdown("---")
 
             col1, col2, col3 = st.columns(3)
 
             with col1:
-                buffer1 = BytesIO()
-                with pd.ExcelWriter(buffer1, engine='xlsxwriter') as writer:
-                    display_df.to_excel(writer, index=False, sheet_name='Data')
-
                 st.download_button(
-                    "Excel (คอลัมน์ที่เลือก)",
-                    buffer1.getvalue(),
+                    "Excel (หน้านี้, คอลัมน์ที่เลือก)",
+                    read_export(xlsx_export({'Data': display_df})),
                     f"raw_data_selected_{start_date}_{end_date}.xlsx",
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    XLSX_MIME,
                     use_container_width=True
                 )
 
-            with col2:
-                buffer2 = BytesIO()
-                with pd.ExcelWriter(buffer2, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Data')
+            # All filtered rows: read chunk by chunk through a server-side cursor and
+            # streamed into the file, so memory does not grow with the row count
+            def _all_rows():
+                for rows in DataService.iter_cards(session, filters, RAW_DATA_COLUMNS):
+                    yield cards_to_frame(rows, branch_name_map)
 
-                st.download_button(
-                    "Excel (ทุกคอลัมน์)",
-                    buffer2.getvalue(),
-                    f"raw_data_full_{start_date}_{end_date}.xlsx",
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
-                )
+            with col2:
+                if st.button("เตรียม Excel (ทุกแถว, ทุกคอลัมน์)", use_container_width=True):
+                    with st.spinner(f"กำลังเตรียมไฟล์ {filtered_count:,} แถว..."):
+                        xlsx_data = read_export(xlsx_export({'Data': _all_rows()}))
+                    st.download_button(
+                        "Excel (ทุกแถว, ทุกคอลัมน์)",
+                        xlsx_data,
+                        f"raw_data_full_{start_date}_{end_date}.xlsx",
+                        XLSX_MIME,
+                        use_container_width=True
+                    )
 
             with col3:
-                csv = df.to_csv(index=False).encode('utf-8-sig')
-                st.download_button(
-                    "CSV (ทุกคอลัมน์)",
-                    csv,
-                    f"raw_data_{start_date}_{end_date}.csv",
-                    "text/csv",
-                    use_container_width=True
-                )
+                if st.button("เตรียม CSV (ทุกแถว, ทุกคอลัมน์)", use_container_width=True):
+                    with st.spinner(f"กำลังเตรียมไฟล์ {filtered_count:,} แถว..."):
+                        csv_data = read_export(csv_export(_all_rows()))
+                    st.download_button(
+                        "CSV (ทุกแถว, ทุกคอลัมน์)",
+                        csv_data,
+                        f"raw_data_{start_date}_{end_date}.csv",
+                        CSV_MIME,
+                        use_container_width=True
+                    )
 
             # Quick stats
             st.markdown("---")
@@ -295,17 +358,12 @@ try:
 
             col1, col2, col3, col4 = st.columns(4)
 
-            good_count = len(df[df['สถานะ'] == 'G'])
-            bad_count = len(df[df['สถานะ'] == 'B'])
-            avg_sla = df['SLA (นาที)'].mean() if 'SLA (นาที)' in df.columns else 0
-            avg_wait = df['Wait (นาที)'].mean() if 'Wait (นาที)' in df.columns else 0
-
             with col1:
-                good_pct = (good_count / len(df) * 100) if len(df) > 0 else 0
+                good_pct = (good_count / filtered_count * 100) if filtered_count > 0 else 0
                 st.metric("บัตรดี (G)", f"{good_count:,}", f"{good_pct:.1f}%")
 
             with col2:
-                bad_pct = (bad_count / len(df) * 100) if len(df) > 0 else 0
+                bad_pct = (bad_count / filtered_count * 100) if filtered_count > 0 else 0
                 st.metric("บัตรเสีย (B)", f"{bad_count:,}", f"{bad_pct:.1f}%")
 
             with col3:
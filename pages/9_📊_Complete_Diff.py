@@ -1,7 +1,5 @@
 """Complete Diff page - ส่วนต่างบัตรสมบูรณ์ (Appt ID with G > 1)."""
 import streamlit as st
-import pandas as pd
-from io import BytesIO
 import plotly.express as px
 import plotly.graph_objects as go
 import sys
@@ -11,10 +9,11 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.connection import init_db, get_session
 from database.models import Card, Report, CompleteDiff
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, select
 from utils.auth_check import require_login
 from utils.theme import apply_theme
-from utils.branch_display import get_branch_short_name
+from services.export_service import xlsx_export, csv_export, read_export, XLSX_MIME, CSV_MIME
+from services.read_models import complete_diff_frame, read_frame
 
 init_db()
 
@@ -187,32 +186,16 @@ try:
         </div>
         """, unsafe_allow_html=True)
     else:
-        # Build query
-        query = session.query(CompleteDiff)
-
-        if start_date and end_date:
-            query = query.filter(CompleteDiff.print_date >= start_date)
-            query = query.filter(CompleteDiff.print_date <= end_date)
-
-        if search_term:
-            search_pattern = f"%{search_term}%"
-            query = query.filter(
-                or_(
-                    CompleteDiff.appointment_id.ilike(search_pattern),
-                    CompleteDiff.serial_number.ilike(search_pattern),
-                    CompleteDiff.card_id.ilike(search_pattern),
-                    CompleteDiff.work_permit_no.ilike(search_pattern),
-                )
-            )
-
-        results = query.order_by(CompleteDiff.print_date.desc()).all()
+        # Displayed columns only, as an Arrow-backed frame (no ORM objects)
+        df = complete_diff_frame(session, start_date, end_date, search_term)
 
         # Summary stats
         st.markdown('<div class="section-header">สรุปภาพรวม</div>', unsafe_allow_html=True)
 
-        total_records = len(results)
-        unique_appts = len(set([r.appointment_id for r in results]))
-        unique_serials = len(set([r.serial_number for r in results if r.serial_number]))
+        total_records = len(df)
+        unique_appts = df['Appointment ID'].nunique(dropna=False)
+        serials = df['Serial Number'].dropna()
+        unique_serials = serials[serials != ''].nunique()
         diff_count = unique_serials - unique_appts if unique_serials > unique_appts else 0
 
         col1, col2, col3, col4 = st.columns(4)
@@ -249,7 +232,7 @@ try:
             </div>
             """, unsafe_allow_html=True)
 
-        if results:
+        if not df.empty:
             # Alert box
             st.markdown(f"""
             <div class="alert-box">
@@ -261,25 +244,6 @@ try:
             # Detail table
             st.markdown('<div class="section-header">รายละเอียด Appointment ID ที่มี G > 1</div>', unsafe_allow_html=True)
 
-            # Convert to DataFrame
-            data = []
-            for r in results:
-                data.append({
-                    'Appointment ID': r.appointment_id,
-                    'จำนวน G': r.g_count,
-                    'รหัสศูนย์': r.branch_code,
-                    'ชื่อศูนย์': get_branch_short_name(r.branch_code, r.branch_name),
-                    'ภูมิภาค': r.region or '-',
-                    'Card ID': r.card_id,
-                    'Serial Number': r.serial_number,
-                    'Work Permit': r.work_permit_no,
-                    'SLA (นาที)': round(r.sla_minutes, 2) if r.sla_minutes else None,
-                    'ผู้ให้บริการ': r.operator or '-',
-                    'วันที่พิมพ์': r.print_date,
-                })
-
-            df = pd.DataFrame(data)
-
             # Show dataframe
             st.dataframe(
                 df,
@@ -350,26 +314,20 @@ try:
             col1, col2, col3 = st.columns([1, 1, 2])
 
             with col1:
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Complete Diff')
-                    appt_summary.to_excel(writer, index=False, sheet_name='Summary')
-
                 st.download_button(
                     "ดาวน์โหลด Excel",
-                    buffer.getvalue(),
+                    read_export(xlsx_export({'Complete Diff': df, 'Summary': appt_summary})),
                     f"complete_diff_{start_date}_{end_date}.xlsx",
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    XLSX_MIME,
                     use_container_width=True
                 )
 
             with col2:
-                csv = df.to_csv(index=False).encode('utf-8-sig')
                 st.download_button(
                     "ดาวน์โหลด CSV",
-                    csv,
+                    read_export(csv_export(df)),
                     f"complete_diff_{start_date}_{end_date}.csv",
-                    "text/csv",
+                    CSV_MIME,
                     use_container_width=True
                 )
 
@@ -403,25 +361,19 @@ try:
             st.warning(f"พบ {len(appt_g_counts)} Appointment ID ที่มีบัตรดี (G) > 1 ในตาราง Cards")
 
             with st.expander("ดูรายละเอียด", expanded=False):
-                appt_data = []
-                for appt_id, count in appt_g_counts[:50]:  # Limit to 50
-                    cards = session.query(Card).filter(
-                        Card.appointment_id == appt_id,
-                        Card.print_status == 'G'
-                    ).all()
-
-                    for card in cards:
-                        appt_data.append({
-                            'Appointment ID': card.appointment_id,
-                            'จำนวน G': count,
-                            'Card ID': card.card_id,
-                            'Serial Number': card.serial_number,
-                            'ศูนย์': card.branch_code,
-                            'วันที่พิมพ์': card.print_date,
-                        })
-
-                if appt_data:
-                    st.dataframe(pd.DataFrame(appt_data), use_container_width=True, hide_index=True)
+                g_counts = dict(appt_g_counts[:50])  # Limit to 50
+                # G cards of all listed appointments in one query
+                appt_df = read_frame(session, select(
+                    Card.appointment_id.label('Appointment ID'), Card.card_id.label('Card ID'),
+                    Card.serial_number.label('Serial Number'), Card.branch_code.label('ศูนย์'),
+                    Card.print_date.label('วันที่พิมพ์'),
+                ).where(
+                    Card.appointment_id.in_(list(g_counts)), Card.print_status == 'G'
+                ).order_by(Card.appointment_id, Card.id))
+
+                if not appt_df.empty:
+                    appt_df.insert(1, 'จำนวน G', appt_df['Appointment ID'].map(g_counts).astype(int))
+                    st.dataframe(appt_df, use_container_width=True, hide_index=True)
         else:
             st.success("ไม่พบ Appointment ID ที่มีบัตรดี (G) > 1 ในช่วงเวลาที่เลือก")
 
@@ -0,0 +1,135 @@
+"""Single-scan multi-level aggregation (GROUPING SETS).
+
+Pages often need the same measures at several levels (per center, per
+region, per center per day, ...). Running one GROUP BY per level scans the
+table once per level. ``aggregate_grouping_sets`` computes every level in a
+single statement:
+
+- PostgreSQL: ``GROUP BY GROUPING SETS (...)``; rows are routed back to
+  their set with ``GROUPING()``.
+- SQLite: no GROUPING SETS support, so the filtered rows are read once and
+  each set is aggregated with pandas.
+
+Usage:
+    tables = aggregate_grouping_sets(
+        session,
+        grouping_sets={
+            'by_branch': [QLog.branch_code],
+            'by_branch_date': [QLog.branch_code, QLog.qlog_date],
+        },
+        measures={'checkin_count': ('count', QLog.id)},
+        filters=[QLog.qlog_date >= start_date],
+    )
+    tables['by_branch']  # DataFrame: branch_code, checkin_count
+"""
+import pandas as pd
+from sqlalchemy import func, tuple_
+
+from database.connection import is_sqlite
+
+# measure kind -> (SQL aggregate builder, pandas aggregation)
+_AGGREGATES = {
+    'count': (lambda e: func.count(e), 'count'),
+    'count_distinct': (lambda e: func.count(func.distinct(e)), 'nunique'),
+    'sum': (lambda e: func.sum(e), 'sum'),
+    'avg': (lambda e: func.avg(e), 'mean'),
+    'min': (lambda e: func.min(e), 'min'),
+    'max': (lambda e: func.max(e), 'max'),
+}
+
+
+def _dimension_columns(grouping_sets: dict) -> dict:
+    """All distinct dimension columns across the sets, keyed by column name (stable order)."""
+    dims = {}
+    for columns in grouping_sets.values():
+        for col in columns:
+            dims.setdefault(col.key, col)
+    return dims
+
+
+def _to_numeric(df: pd.DataFrame, measures: dict) -> pd.DataFrame:
+    """Measures as plain numbers (PostgreSQL returns Decimal for SUM/AVG)."""
+    for name in measures:
+        df[name] = pd.to_numeric(df[name], errors='coerce')
+    return df
+
+
+def _aggregate_sql(session, grouping_sets, measures, filters, dims):
+    dim_names = list(dims)
+    measure_cols = [
+        _AGGREGATES[kind][0](expr).label(name) for name, (kind, expr) in measures.items()
+    ]
+    query = session.query(
+        *[col.label(name) for name, col in dims.items()],
+        func.grouping(*dims.values()).label('_grouping'),
+        *measure_cols,
+    ).filter(*filters).group_by(
+        func.grouping_sets(*[tuple_(*columns) for columns in grouping_sets.values()])
+    )
+    df = pd.DataFrame(query.all(), columns=dim_names + ['_grouping'] + list(measures))
+
+    # GROUPING(a, b, c) sets bit (n-1-i) when dimension i is rolled up in that row
+    result = {}
+    for set_name, columns in grouping_sets.items():
+        keys = [col.key for col in columns]
+        mask = sum(1 << (len(dim_names) - 1 - i) for i, name in enumerate(dim_names) if name not in keys)
+        part = df.loc[df['_grouping'] == mask, keys + list(measures)].reset_index(drop=True)
+        result[set_name] = _to_numeric(part, measures)
+    return result
+
+
+def aggregate_frame(df: pd.DataFrame, grouping_sets: dict, measures: dict) -> dict:
+    """Grouping-sets aggregation of an in-memory frame (SQLite fallback, analytics snapshot).
+
+    Args:
+        df: Raw rows.
+        grouping_sets: {name: [column name, ...]}.
+        measures: {label: (kind, column name)} with the kinds of ``aggregate_grouping_sets``.
+
+    Returns:
+        {name: DataFrame} like ``aggregate_grouping_sets``.
+    """
+    named_aggs = {name: (col, _AGGREGATES[kind][1]) for name, (kind, col) in measures.items()}
+    result = {}
+    for set_name, keys in grouping_sets.items():
+        if keys:
+            part = df.groupby(list(keys), dropna=False, sort=False).agg(**named_aggs).reset_index()
+        else:
+            # Grand total ()
+            part = pd.DataFrame([{name: getattr(df[col], agg)() for name, (col, agg) in named_aggs.items()}])
+        result[set_name] = _to_numeric(part, measures)
+    return result
+
+
+def _aggregate_pandas(session, grouping_sets, measures, filters, dims):
+    raw_cols = [col.label(name) for name, col in dims.items()]
+    raw_cols += [expr.label(f'_m_{name}') for name, (kind, expr) in measures.items()]
+    df = pd.DataFrame(session.query(*raw_cols).filter(*filters).all(),
+                      columns=list(dims) + [f'_m_{name}' for name in measures])
+    return aggregate_frame(
+        df,
+        {set_name: [col.key for col in columns] for set_name, columns in grouping_sets.items()},
+        {name: (kind, f'_m_{name}') for name, (kind, expr) in measures.items()},
+    )
+
+
+def aggregate_grouping_sets(session, grouping_sets: dict, measures: dict, filters=()) -> dict:
+    """Aggregate ``measures`` over several groupings with one table scan.
+
+    Args:
+        session: SQLAlchemy session.
+        grouping_sets: {name: [column, ...]} - one entry per output table.
+            Two sets must not group by the same columns.
+        measures: {label: (kind, expression)} where kind is one of
+            count, count_distinct, sum, avg, min, max.
+        filters: WHERE conditions shared by all sets.
+
+    Returns:
+        {name: DataFrame} with the set's columns (by column name) followed by
+        the measure labels. NULL dimension values form their own group, as in
+        a plain GROUP BY.
+    """
+    dims = _dimension_columns(grouping_sets)
+    if is_sqlite:
+        return _aggregate_pandas(session, grouping_sets, measures, filters, dims)
+    return _aggregate_sql(session, grouping_sets, measures, filters, dims)
@@ -0,0 +1,266 @@
+"""Optional columnar snapshot of the hot fact columns (Arrow / Parquet).
+
+When ``ANALYTICS_SNAPSHOT_DIR`` is set and ``pyarrow`` is installed, the
+hot columns of ``cards``, ``bio_records``, ``qlogs`` and ``appointments``
+are mirrored to local Parquet files, one file per upload (report), with
+branch / status / name columns dictionary-encoded::
+
+    <ANALYTICS_SNAPSHOT_DIR>/cards/part_<report_id>.parquet
+    <ANALYTICS_SNAPSHOT_DIR>/qlogs/part_<upload_id>.parquet
+    ...
+
+A table is kept current by ``sync_snapshot``: files of deleted uploads are
+removed, and a file is (re)written when its upload is new, was imported or
+replaced by the Upload page (upload ids can be reused once deleted), or its
+row count no longer matches the database.
+Range aggregations then scan the files with ``pyarrow.dataset`` (column
+projection + predicate pushdown, multi-threaded) instead of the database.
+
+While a table is being synced (or has never been synced) ``scan_snapshot``
+returns None and callers use their SQL path.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import Boolean, Date, Float, Integer, func
+
+from database.connection import get_session
+from database.models import (
+    Report, Card, AppointmentUpload, Appointment, QLogUpload, QLog, BioUpload, BioRecord,
+)
+from utils.logger import log_error, log_perf
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pads
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+ANALYTICS_SNAPSHOT_DIR = os.environ.get("ANALYTICS_SNAPSHOT_DIR", "")
+
+_SYNCED_MARKER = '_SYNCED'
+
+# table -> (model, partition column, partition (upload) model, hot columns, dictionary-encoded columns)
+SNAPSHOT_TABLES = {
+    'cards': (
+        Card, Card.report_id, Report,
+        ['id', 'report_id', 'appointment_id', 'card_id', 'serial_number', 'branch_code', 'branch_name',
+         'region', 'operator', 'print_date', 'print_status', 'sla_minutes', 'sla_over_12min',
+         'wrong_branch', 'wrong_date', 'appt_date', 'appt_branch'],
+        ['branch_code', 'branch_name', 'region', 'operator', 'print_status', 'appt_branch'],
+    ),
+    'bio_records': (
+        BioRecord, BioRecord.upload_id, BioUpload,
+        ['id', 'upload_id', 'appointment_id', 'serial_number', 'branch_code', 'print_date',
+         'print_status', 'sla_minutes'],
+        ['branch_code', 'print_status'],
+    ),
+    'qlogs': (
+        QLog, QLog.upload_id, QLogUpload,
+        ['id', 'upload_id', 'appointment_code', 'branch_code', 'qlog_date', 'qlog_type',
+         'qlog_num', 'qlog_status', 'wait_time_seconds'],
+        ['branch_code', 'qlog_type', 'qlog_status'],
+    ),
+    'appointments': (
+        Appointment, Appointment.upload_id, AppointmentUpload,
+        ['id', 'upload_id', 'appointment_id', 'branch_code', 'appt_date', 'appt_status'],
+        ['branch_code', 'appt_status'],
+    ),
+}
+
+# Upload page source -> snapshot table
+SNAPSHOT_SOURCES = {
+    'unified': 'cards',
+    'bio': 'bio_records',
+    'qlog': 'qlogs',
+    'appointment': 'appointments',
+}
+
+_sync_locks = {table: threading.Lock() for table in SNAPSHOT_TABLES}
+# Bumped per sync request; a sync only marks the table ready if no newer request arrived meanwhile
+_sync_requests = {table: 0 for table in SNAPSHOT_TABLES}
+# Partitions to rewrite at the next sync (imported / replaced / deleted uploads)
+_pending_rewrites = {table: set() for table in SNAPSHOT_TABLES}
+
+
+def is_snapshot_enabled() -> bool:
+    """True when a snapshot directory is configured and pyarrow is available."""
+    return bool(ANALYTICS_SNAPSHOT_DIR) and pa is not None
+
+
+def _table_dir(table: str) -> str:
+    return os.path.join(ANALYTICS_SNAPSHOT_DIR, table)
+
+
+def _partition_path(table: str, partition_id: int) -> str:
+    return os.path.join(_table_dir(table), f'part_{partition_id}.parquet')
+
+
+def is_snapshot_ready(table: str) -> bool:
+    """True when ``table`` has been fully synced and no sync is running."""
+    return is_snapshot_enabled() and os.path.exists(os.path.join(_table_dir(table), _SYNCED_MARKER))
+
+
+def _mark_not_ready(table: str):
+    """Drop ``table``'s ready marker so readers fall back to SQL until the next sync ends."""
+    marker = os.path.join(_table_dir(table), _SYNCED_MARKER)
+    if os.path.exists(marker):
+        os.remove(marker)
+
+
+def _arrow_type(column_type):
+    if isinstance(column_type, Boolean):
+        return pa.bool_()
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, Float):
+        return pa.float64()
+    if isinstance(column_type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def _write_partition(session, table: str, partition_id: int) -> int:
+    """Export one upload's rows to a Parquet file (atomic replace). Returns row count."""
+    model, partition_col, _, columns, dictionary_columns = SNAPSHOT_TABLES[table]
+    rows = session.query(*[getattr(model, c) for c in columns]).filter(partition_col == partition_id).all()
+
+    arrays = []
+    for i, name in enumerate(columns):
+        # Explicit types so every file of a table has the same schema (all-null columns included)
+        array = pa.array([r[i] for r in rows], type=_arrow_type(getattr(model, name).type))
+        if name in dictionary_columns:
+            array = array.dictionary_encode()
+        arrays.append(array)
+
+    path = _partition_path(table, partition_id)
+    tmp_path = f'{path}.tmp'
+    pq.write_table(pa.Table.from_arrays(arrays, names=columns), tmp_path)
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+def _file_row_count(table: str, partition_id: int):
+    """Row count of a partition file (from the Parquet footer), or None if unreadable."""
+    try:
+        return pq.read_metadata(_partition_path(table, partition_id)).num_rows
+    except Exception:
+        return None
+
+
+def sync_snapshot(table: str) -> int:
+    """Bring ``table``'s Parquet files in line with its uploads (blocking).
+
+    Removes files of deleted uploads and writes files that are missing,
+    requested for rewrite (``sync_snapshot_in_background(upload_ids=...)``)
+    or whose row count differs from the upload's rows in the database. The
+    table is marked not-ready while syncing.
+
+    Returns:
+        Number of rows written.
+    """
+    if not is_snapshot_enabled():
+        return 0
+    start_time = time.perf_counter()
+    written = 0
+    # A sync requested while another runs waits for it, then picks up what it missed
+    with _sync_locks[table]:
+        request = _sync_requests[table]
+        rewrite_ids, _pending_rewrites[table] = _pending_rewrites[table], set()
+        table_dir = _table_dir(table)
+        os.makedirs(table_dir, exist_ok=True)
+        _mark_not_ready(table)
+
+        _, partition_col, upload_model, _, _ = SNAPSHOT_TABLES[table]
+        session = get_session()
+        try:
+            upload_ids = {r[0] for r in session.query(upload_model.id)}
+            row_counts = dict(session.query(partition_col, func.count()).group_by(partition_col).all())
+            existing = {
+                int(name[len('part_'):-len('.parquet')]) for name in os.listdir(table_dir)
+                if name.startswith('part_') and name.endswith('.parquet')
+            }
+            for partition_id in sorted(existing - upload_ids):
+                os.remove(_partition_path(table, partition_id))
+            for partition_id in sorted(upload_ids):
+                if (partition_id not in existing or partition_id in rewrite_ids
+                        or _file_row_count(table, partition_id) != row_counts.get(partition_id, 0)):
+                    written += _write_partition(session, table, partition_id)
+        finally:
+            session.close()
+
+        if _sync_requests[table] == request:
+            open(os.path.join(table_dir, _SYNCED_MARKER), 'w').close()
+        log_perf(f"sync_snapshot({table}, {written:,} rows)", (time.perf_counter() - start_time) * 1000)
+    return written
+
+
+def sync_snapshot_in_background(source: str = None, upload_ids=()):
+    """Sync the table of an Upload page ``source`` (or every table) in a daemon thread.
+
+    ``upload_ids``: uploads the Upload page imported, replaced or deleted;
+    their files are rewritten even if one with the same id exists.
+    """
+    if not is_snapshot_enabled():
+        return
+    if source is None:
+        tables = list(SNAPSHOT_TABLES)
+    elif source in SNAPSHOT_SOURCES:
+        tables = [SNAPSHOT_SOURCES[source]]
+    else:
+        return
+
+    # Before returning to the caller: page caches refilled from now on must not read the old files
+    for table in tables:
+        _pending_rewrites[table].update(i for i in upload_ids if i is not None)
+        _sync_requests[table] += 1
+        _mark_not_ready(table)
+
+    def _run():
+        for table in tables:
+            try:
+                sync_snapshot(table)
+            except Exception as e:
+                log_error(f"[SNAPSHOT] {table} sync failed: {e}")
+
+    threading.Thread(target=_run, name="analytics-snapshot-sync", daemon=True).start()
+
+
+def scan_snapshot(table: str, columns: list, filters=None):
+    """Read ``columns`` of ``table`` from the snapshot as a pandas DataFrame.
+
+    Args:
+        table: Key of ``SNAPSHOT_TABLES``.
+        columns: Columns to read (only these are decoded).
+        filters: Row filters pushed down to the Parquet scan, as
+            ``[(column, op, value), ...]`` (ANDed), e.g.
+            ``[('print_date', '>=', start_date), ('print_date', '<=', end_date)]``.
+
+    Returns:
+        DataFrame (dictionary columns decoded, dates as ``datetime.date``),
+        or None when the snapshot is disabled or not ready - use SQL instead.
+    """
+    if not is_snapshot_ready(table):
+        return None
+    start_time = time.perf_counter()
+    try:
+        table_dir = _table_dir(table)
+        paths = [
+            os.path.join(table_dir, name) for name in sorted(os.listdir(table_dir))
+            if name.startswith('part_') and name.endswith('.parquet')
+        ]
+        dataset = pads.dataset(paths, format='parquet')
+        expression = pq.filters_to_expression(filters) if filters else None
+        result = dataset.to_table(columns=columns, filter=expression)
+    except Exception as e:
+        log_error(f"[SNAPSHOT] {table} scan failed, using SQL: {e}")
+        return None
+    decoded = [
+        col.cast(col.type.value_type) if pa.types.is_dictionary(col.type) else col
+        for col in result.columns
+    ]
+    df = pa.Table.from_arrays(decoded, names=result.column_names).to_pandas()
+    log_perf(f"scan_snapshot({table}, {len(df):,} rows)", (time.perf_counter() - start_time) * 1000)
+    return df
@@ -0,0 +1,158 @@
+"""Anomaly checks for a whole set of cards in a fixed number of queries.
+
+The Search page used to run up to four queries per card (related G cards,
+duplicate serials, SLA / wrong-center records, bad cards). ``enrich_anomalies``
+resolves the same checks for every card of a result set with four set-based
+queries (``IN`` over the distinct appointment IDs / serials), projecting only
+the columns the page shows, and groups the rows in memory.
+"""
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+from sqlalchemy import literal, null, select, union_all
+
+from database.models import Card, BadCard, AnomalySLA, WrongCenter
+from utils.logger import log_perf
+
+
+def _records(rows) -> list:
+    return [SimpleNamespace(**row._asdict()) for row in rows]
+
+
+def _group_by(records, key) -> dict:
+    groups = defaultdict(list)
+    for record in records:
+        groups[getattr(record, key)].append(record)
+    return groups
+
+
+def enrich_anomalies(session, cards) -> dict:
+    """Anomalies of each card (same checks and texts as the per-card detail view).
+
+    Args:
+        session: Database session.
+        cards: Card objects (anything with the Card attributes) to check.
+
+    Returns:
+        {card.id: [{'type', 'title', 'description', 'details'}, ...]}.
+        ``details`` holds lightweight records (SimpleNamespace with the
+        displayed columns) or None.
+    """
+    start_time = time.perf_counter()
+    appt_ids = sorted({c.appointment_id for c in cards if c.appointment_id})
+    serials = sorted({c.serial_number for c in cards if c.serial_number})
+
+    good_by_appt, cards_by_serial, bad_by_appt = {}, {}, {}
+    sla_by_appt, sla_by_serial, wc_by_appt, wc_by_serial = {}, {}, {}, {}
+    if appt_ids:
+        # Query 1: G cards of the appointments
+        good_by_appt = _group_by(_records(session.query(
+            Card.appointment_id, Card.serial_number, Card.card_id, Card.branch_code,
+            Card.operator, Card.print_date, Card.sla_minutes,
+        ).filter(Card.appointment_id.in_(appt_ids), Card.print_status == 'G').order_by(Card.id)), 'appointment_id')
+        # Query 2: bad cards of the appointments
+        bad_by_appt = _group_by(_records(session.query(
+            BadCard.appointment_id, BadCard.serial_number, BadCard.card_id,
+            BadCard.reject_reason, BadCard.operator, BadCard.print_date,
+        ).filter(BadCard.appointment_id.in_(appt_ids)).order_by(BadCard.id)), 'appointment_id')
+    if serials:
+        # Query 3: all cards sharing the serials
+        cards_by_serial = _group_by(_records(session.query(
+            Card.serial_number, Card.appointment_id, Card.card_id, Card.print_status,
+            Card.branch_code, Card.print_date,
+        ).filter(Card.serial_number.in_(serials)).order_by(Card.id)), 'serial_number')
+    if appt_ids or serials:
+        # Query 4: SLA and wrong-center records matching an appointment or a serial
+        def _matches(model):
+            return (model.appointment_id.in_(appt_ids)) | (model.serial_number.in_(serials))
+
+        records = _records(session.execute(union_all(
+            select(
+                literal('sla').label('kind'), AnomalySLA.id, AnomalySLA.appointment_id, AnomalySLA.serial_number,
+                AnomalySLA.sla_minutes, AnomalySLA.branch_code, AnomalySLA.branch_name,
+                null().label('expected_branch'), null().label('actual_branch'),
+            ).where(_matches(AnomalySLA)),
+            select(
+                literal('wrong_center').label('kind'), WrongCenter.id, WrongCenter.appointment_id,
+                WrongCenter.serial_number, null().label('sla_minutes'), null().label('branch_code'),
+                null().label('branch_name'), WrongCenter.expected_branch, WrongCenter.actual_branch,
+            ).where(_matches(WrongCenter)),
+        ).order_by('kind', 'id')))
+        # First record per appointment / serial, like the former .first() lookups
+        for record in records:
+            by_appt, by_serial = (sla_by_appt, sla_by_serial) if record.kind == 'sla' else (wc_by_appt, wc_by_serial)
+            by_appt.setdefault(record.appointment_id, record)
+            by_serial.setdefault(record.serial_number, record)
+
+    result = {}
+    for card in cards:
+        appt_id, serial = card.appointment_id, card.serial_number
+        anomalies = []
+
+        related_g_cards = good_by_appt.get(appt_id, []) if appt_id else []
+        if len(related_g_cards) > 1:
+            anomalies.append({
+                'type': 'multiple_g',
+                'title': f'นัดหมายนี้มีบัตรดี (G) มากกว่า 1 ใบ ({len(related_g_cards)} ใบ)',
+                'description': 'ต้องตรวจสอบว่าเป็นการออกบัตรซ้ำหรือไม่',
+                'details': related_g_cards
+            })
+
+        dup_serial_cards = cards_by_serial.get(serial, []) if serial else []
+        if len(dup_serial_cards) > 1:
+            anomalies.append({
+                'type': 'duplicate_serial',
+                'title': f'Serial Number ซ้ำ ({len(dup_serial_cards)} รายการ)',
+                'description': f'Serial {serial} ถูกใช้งานหลายครั้ง',
+                'details': dup_serial_cards
+            })
+
+        sla_anomaly = (appt_id and sla_by_appt.get(appt_id)) or (serial and sla_by_serial.get(serial))
+        if sla_anomaly:
+            anomalies.append({
+                'type': 'sla_over',
+                'title': f'SLA เกิน 12 นาที ({round(sla_anomaly.sla_minutes, 2) if sla_anomaly.sla_minutes else "-"} นาที)',
+                'description': f'ศูนย์: {sla_anomaly.branch_name or sla_anomaly.branch_code}',
+                'details': None
+            })
+
+        wrong_center = (appt_id and wc_by_appt.get(appt_id)) or (serial and wc_by_serial.get(serial))
+        if wrong_center:
+            anomalies.append({
+                'type': 'wrong_center',
+                'title': 'ออกบัตรผิดศูนย์',
+                'description': f'ศูนย์ที่นัด: {wrong_center.expected_branch} | ศูนย์ที่ออก: {wrong_center.actual_branch}',
+                'details': None
+            })
+
+        # Flags on the card itself
+        if card.wrong_date:
+            anomalies.append({
+                'type': 'wrong_date',
+                'title': 'นัดหมายผิดวัน',
+                'description': f'วันที่นัด: {card.appt_date} | วันที่ออกบัตร: {card.print_date}',
+                'details': None
+            })
+
+        if card.wait_over_1hour:
+            anomalies.append({
+                'type': 'wait_over',
+                'title': 'รอคิวเกิน 1 ชั่วโมง',
+                'description': f'เวลารอคิว: {card.wait_time_hms or "-"}',
+                'details': None
+            })
+
+        bad_cards = bad_by_appt.get(appt_id, []) if appt_id else []
+        if bad_cards:
+            anomalies.append({
+                'type': 'has_bad_cards',
+                'title': f'นัดหมายนี้มีบัตรเสีย ({len(bad_cards)} ใบ)',
+                'description': 'มีประวัติการออกบัตรเสียก่อนหน้า',
+                'details': bad_cards
+            })
+
+        result[card.id] = anomalies
+
+    log_perf(f"enrich_anomalies({len(cards):,} cards)", (time.perf_counter() - start_time) * 1000)
+    return result
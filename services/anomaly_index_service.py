@@ -0,0 +1,280 @@
+"""Maintenance and lookup of the anomalies table (Anomaly page, Overview).
+
+``anomalies`` holds card anomalies per (anomaly type, key, print date,
+branch) with the card count and the member card ids:
+
+- multi_g_appt / multi_g_card_id / duplicate_serial: the G cards of every
+  appointment ID / card ID / serial with more than one G card in total.
+  A key can only have more than one G card inside a date range if it has
+  more than one overall, so "G > 1 between two dates" becomes
+  ``GROUP BY key HAVING SUM(card_count) > 1`` over these rows instead of
+  over every card in the range.
+- wrong_date / wrong_branch (key ''): flagged cards per day and branch;
+  a count is ``SUM(card_count)``.
+
+A report upload/delete refreshes only what it touches (``get_report_anomaly_scope``):
+the keys of its G cards and the print dates of its flagged cards. The
+first full build runs in a background thread; until it has finished
+``is_anomaly_index_ready()`` is False and callers query ``cards`` directly.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import and_, func, or_, select
+
+from database.connection import get_session
+from database.models import Card, CardAnomaly
+from services.journey_service import ID_CHUNK_SIZE, is_derived_table_ready, set_derived_table_ready
+from utils.logger import log_info, log_error, log_perf
+
+ANOMALY_READY_KEY = 'anomaly_index_ready'
+
+# anomaly type -> key column (G cards of keys with more than one G card)
+ANOMALY_KEY_TYPES = {
+    'multi_g_appt': Card.appointment_id,
+    'multi_g_card_id': Card.card_id,
+    'duplicate_serial': Card.serial_number,
+}
+# anomaly type -> flag column (flagged cards per day and branch)
+ANOMALY_FLAG_TYPES = {
+    'wrong_date': Card.wrong_date,
+    'wrong_branch': Card.wrong_branch,
+}
+
+# print dates per refresh batch
+DATE_CHUNK_SIZE = 31
+
+_backfill_lock = threading.Lock()
+
+
+def _non_blank(column):
+    return and_(column.isnot(None), column != '')
+
+
+def _grouped_rows(anomaly_type, records) -> list:
+    """(key, print date, branch, card id) records, sorted -> anomaly rows."""
+    groups = defaultdict(list)
+    for key, event_date, branch_code, card_id in records:
+        groups[(key, event_date, branch_code)].append(card_id)
+    return [{
+        'anomaly_type': anomaly_type,
+        'anomaly_key': key,
+        'event_date': event_date,
+        'branch_code': branch_code,
+        'card_count': len(ids),
+        'member_ids': ','.join(str(i) for i in ids),
+    } for (key, event_date, branch_code), ids in groups.items()]
+
+
+def _build_key_rows(session, anomaly_type: str, keys: list) -> list:
+    """Rows of one keyed type for a batch of keys (keys with <= 1 G card get none)."""
+    key_column = ANOMALY_KEY_TYPES[anomaly_type]
+    multi_keys = select(key_column).where(
+        Card.print_status == 'G', key_column.in_(keys)
+    ).group_by(key_column).having(func.count(Card.id) > 1)
+    records = session.query(key_column, Card.print_date, Card.branch_code, Card.id).filter(
+        Card.print_status == 'G', key_column.in_(multi_keys)
+    ).order_by(key_column, Card.print_date, Card.branch_code, Card.id)
+    return _grouped_rows(anomaly_type, records)
+
+
+def _build_flag_rows(session, anomaly_type: str, dates: list) -> list:
+    """Rows of one flag type for a batch of print dates."""
+    records = session.query(Card.print_date, Card.branch_code, Card.id).filter(
+        ANOMALY_FLAG_TYPES[anomaly_type] == True, Card.print_date.in_(dates)
+    ).order_by(Card.print_date, Card.branch_code, Card.id)
+    return _grouped_rows(anomaly_type, (('', d, b, i) for d, b, i in records))
+
+
+# ============== Maintenance ==============
+
+def empty_anomaly_scope() -> dict:
+    """Scope with nothing to refresh: {keyed type: set of keys, 'dates': set of print dates}."""
+    scope = {anomaly_type: set() for anomaly_type in ANOMALY_KEY_TYPES}
+    scope['dates'] = set()
+    return scope
+
+
+def merge_anomaly_scopes(*scopes) -> dict:
+    """Union of scopes (None entries are skipped)."""
+    merged = empty_anomaly_scope()
+    for scope in scopes:
+        for name, values in (scope or {}).items():
+            merged[name].update(values)
+    return merged
+
+
+def get_report_anomaly_scope(session, report_id: int) -> dict:
+    """Keys and print dates a Bio Unified Report contributes to ``anomalies``.
+
+    Call before deleting the report's cards (the same scope is refreshed afterwards).
+    """
+    scope = empty_anomaly_scope()
+    for anomaly_type, key_column in ANOMALY_KEY_TYPES.items():
+        scope[anomaly_type].update(r[0] for r in session.query(key_column).filter(
+            Card.report_id == report_id, Card.print_status == 'G', _non_blank(key_column)
+        ).distinct())
+    scope['dates'].update(r[0] for r in session.query(Card.print_date).filter(
+        Card.report_id == report_id, Card.print_date.isnot(None),
+        or_(*[flag == True for flag in ANOMALY_FLAG_TYPES.values()]),
+    ).distinct())
+    return scope
+
+
+def refresh_anomalies(scope: dict) -> int:
+    """Recompute the anomaly rows of the keys and dates in ``scope`` (delete + insert per batch).
+
+    Returns:
+        Number of anomaly rows written.
+    """
+    start_time = time.perf_counter()
+    session = get_session()
+    written = 0
+    try:
+        for anomaly_type in ANOMALY_KEY_TYPES:
+            keys = sorted(scope.get(anomaly_type) or ())
+            for offset in range(0, len(keys), ID_CHUNK_SIZE):
+                chunk = keys[offset:offset + ID_CHUNK_SIZE]
+                rows = _build_key_rows(session, anomaly_type, chunk)
+                session.query(CardAnomaly).filter(
+                    CardAnomaly.anomaly_type == anomaly_type, CardAnomaly.anomaly_key.in_(chunk)
+                ).delete(synchronize_session=False)
+                if rows:
+                    session.bulk_insert_mappings(CardAnomaly, rows)
+                session.commit()
+                written += len(rows)
+
+        dates = sorted(scope.get('dates') or ())
+        for offset in range(0, len(dates), DATE_CHUNK_SIZE):
+            chunk = dates[offset:offset + DATE_CHUNK_SIZE]
+            rows = [row for anomaly_type in ANOMALY_FLAG_TYPES for row in _build_flag_rows(session, anomaly_type, chunk)]
+            session.query(CardAnomaly).filter(
+                CardAnomaly.anomaly_type.in_(ANOMALY_FLAG_TYPES), CardAnomaly.event_date.in_(chunk)
+            ).delete(synchronize_session=False)
+            if rows:
+                session.bulk_insert_mappings(CardAnomaly, rows)
+            session.commit()
+            written += len(rows)
+        return written
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        log_perf(
+            f"refresh_anomalies({sum(len(v) for v in scope.values()):,} keys/dates)",
+            (time.perf_counter() - start_time) * 1000,
+        )
+
+
+# ============== Lookup ==============
+
+def _in_range(start_date, end_date, branch_codes=None):
+    filters = [CardAnomaly.event_date >= start_date, CardAnomaly.event_date <= end_date]
+    if branch_codes:
+        filters.append(CardAnomaly.branch_code.in_(branch_codes))
+    return filters
+
+
+def multi_key_select(anomaly_type: str, start_date, end_date, branch_codes=None, limit: int = None):
+    """Keys of a keyed type with more than one G card in the range (the ``limit`` largest if given)."""
+    stmt = select(CardAnomaly.anomaly_key).where(
+        CardAnomaly.anomaly_type == anomaly_type, *_in_range(start_date, end_date, branch_codes)
+    ).group_by(CardAnomaly.anomaly_key).having(func.sum(CardAnomaly.card_count) > 1)
+    if limit:
+        stmt = stmt.order_by(func.sum(CardAnomaly.card_count).desc(), CardAnomaly.anomaly_key).limit(limit)
+    return stmt
+
+
+def get_anomaly_counts(session, start_date, end_date, branch_codes=None) -> dict:
+    """Anomaly counts for a print date range (two indexed reads of ``anomalies``).
+
+    Returns:
+        {keyed type: {'keys': keys with G > 1, 'cards': their G cards},
+         flag type: {'cards': flagged cards}} for every type.
+    """
+    counts = {anomaly_type: {'keys': 0, 'cards': 0} for anomaly_type in ANOMALY_KEY_TYPES}
+    counts.update({anomaly_type: {'cards': 0} for anomaly_type in ANOMALY_FLAG_TYPES})
+
+    per_key = select(
+        CardAnomaly.anomaly_type, func.sum(CardAnomaly.card_count).label('cards'),
+    ).where(
+        CardAnomaly.anomaly_type.in_(ANOMALY_KEY_TYPES), *_in_range(start_date, end_date, branch_codes)
+    ).group_by(CardAnomaly.anomaly_type, CardAnomaly.anomaly_key).having(
+        func.sum(CardAnomaly.card_count) > 1
+    ).subquery()
+    for anomaly_type, keys, cards in session.execute(select(
+        per_key.c.anomaly_type, func.count(), func.sum(per_key.c.cards)
+    ).group_by(per_key.c.anomaly_type)):
+        counts[anomaly_type] = {'keys': int(keys), 'cards': int(cards or 0)}
+
+    for anomaly_type, cards in session.execute(select(
+        CardAnomaly.anomaly_type, func.sum(CardAnomaly.card_count)
+    ).where(
+        CardAnomaly.anomaly_type.in_(ANOMALY_FLAG_TYPES), *_in_range(start_date, end_date, branch_codes)
+    ).group_by(CardAnomaly.anomaly_type)):
+        counts[anomaly_type] = {'cards': int(cards or 0)}
+    return counts
+
+
+def get_flagged_card_ids(session, anomaly_type: str, start_date, end_date, branch_codes=None, limit: int = None) -> list:
+    """Ids of flagged cards (wrong_date / wrong_branch) in the range, oldest day first, up to ``limit``."""
+    ids = []
+    for (member_ids,) in session.execute(select(CardAnomaly.member_ids).where(
+        CardAnomaly.anomaly_type == anomaly_type, *_in_range(start_date, end_date, branch_codes)
+    ).order_by(CardAnomaly.event_date, CardAnomaly.branch_code)):
+        ids.extend(int(i) for i in member_ids.split(','))
+        if limit and len(ids) >= limit:
+            return ids[:limit]
+    return ids
+
+
+# ============== Backfill ==============
+
+def is_anomaly_index_ready() -> bool:
+    """True once the full backfill has completed (report uploads/deletes keep it current)."""
+    return is_derived_table_ready(ANOMALY_READY_KEY)
+
+
+def rebuild_anomaly_index() -> int:
+    """Full rebuild from ``cards`` (blocking). Returns the number of anomaly rows written."""
+    if not _backfill_lock.acquire(blocking=False):
+        log_info("[ANOMALY] rebuild skipped: already running")
+        return 0
+    try:
+        session = get_session()
+        try:
+            session.query(CardAnomaly).delete(synchronize_session=False)
+            session.commit()
+            scope = empty_anomaly_scope()
+            for anomaly_type, key_column in ANOMALY_KEY_TYPES.items():
+                scope[anomaly_type].update(r[0] for r in session.query(key_column).filter(
+                    Card.print_status == 'G', _non_blank(key_column)
+                ).group_by(key_column).having(func.count(Card.id) > 1))
+            scope['dates'].update(r[0] for r in session.query(Card.print_date).filter(
+                Card.print_date.isnot(None), or_(*[flag == True for flag in ANOMALY_FLAG_TYPES.values()]),
+            ).distinct())
+        finally:
+            session.close()
+
+        written = refresh_anomalies(scope)
+        set_derived_table_ready(ANOMALY_READY_KEY, True)
+        log_info(f"[ANOMALY] full rebuild: {written:,} rows")
+        return written
+    finally:
+        _backfill_lock.release()
+
+
+def start_anomaly_index_backfill():
+    """Run the full rebuild in a daemon thread if it has never completed."""
+    if is_anomaly_index_ready():
+        return
+
+    def _run():
+        try:
+            rebuild_anomaly_index()
+        except Exception as e:
+            log_error(f"[ANOMALY] backfill failed: {e}")
+
+    threading.Thread(target=_run, name="anomaly-index-backfill", daemon=True).start()
@@ -0,0 +1,167 @@
+"""Maintenance of the appointments_current table.
+
+The appointment importer appends a new ``appointments`` row whenever an
+appointment moves to another date or branch, so ``appointments`` is the
+full version history. ``appointments_current`` keeps exactly one row per
+appointment_id (the latest version) so forecast and slot queries can use
+plain ``COUNT(*)`` instead of ``COUNT(DISTINCT appointment_id)``.
+
+Refreshed for the appointment_ids of each appointment upload/delete; the
+first full build runs in a background thread, and until it has finished
+``is_current_appointments_ready()`` is False and queries read the same
+latest versions from the history (``latest_appointment_versions``), so
+booking counts do not change when it finishes.
+"""
+import threading
+import time
+
+from sqlalchemy import func, case, select
+from sqlalchemy.orm import aliased
+
+from database.connection import get_session
+from database.models import Appointment, AppointmentCurrent
+from services.journey_service import ID_CHUNK_SIZE, is_derived_table_ready, set_derived_table_ready
+from utils.logger import log_info, log_error, log_perf
+from utils.timezone import now_th
+
+CURRENT_READY_KEY = 'appointments_current_ready'
+
+_backfill_lock = threading.Lock()
+# Set when a full rebuild has ended (derived tables built from appointments_current wait for it)
+_backfill_done = threading.Event()
+
+
+def _build_current(session, ids: list) -> list:
+    """Latest version (highest appointments.id) of each appointment_id in ``ids``."""
+    current = {}
+    versions = {}
+    for r in session.query(
+        Appointment.id, Appointment.appointment_id, Appointment.upload_id,
+        Appointment.appt_date, Appointment.appt_time, Appointment.branch_code, Appointment.appt_status
+    ).filter(Appointment.appointment_id.in_(ids)).order_by(Appointment.id):
+        versions[r.appointment_id] = versions.get(r.appointment_id, 0) + 1
+        current[r.appointment_id] = {
+            'appointment_id': r.appointment_id,
+            'appointment_row_id': r.id,
+            'upload_id': r.upload_id,
+            'appt_date': r.appt_date,
+            'appt_time': r.appt_time,
+            'branch_code': r.branch_code,
+            'appt_status': r.appt_status,
+        }
+
+    now = now_th()
+    for appt_id, row in current.items():
+        row['version_count'] = versions[appt_id]
+        row['updated_at'] = now
+    return list(current.values())
+
+
+def refresh_current_appointments(appointment_ids) -> int:
+    """Upsert appointments_current for the given appointment_ids (delete + insert per batch).
+
+    Ids with no remaining version in ``appointments`` are removed.
+
+    Returns:
+        Number of current rows written.
+    """
+    ids = sorted({i for i in appointment_ids if i})
+    if not ids:
+        return 0
+
+    start_time = time.perf_counter()
+    session = get_session()
+    written = 0
+    try:
+        for offset in range(0, len(ids), ID_CHUNK_SIZE):
+            chunk = ids[offset:offset + ID_CHUNK_SIZE]
+            rows = _build_current(session, chunk)
+            session.query(AppointmentCurrent).filter(
+                AppointmentCurrent.appointment_id.in_(chunk)
+            ).delete(synchronize_session=False)
+            if rows:
+                session.bulk_insert_mappings(AppointmentCurrent, rows)
+            session.commit()
+            written += len(rows)
+        return written
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        log_perf(f"refresh_current_appointments({len(ids):,} ids)", (time.perf_counter() - start_time) * 1000)
+
+
+def is_current_appointments_ready() -> bool:
+    """True once the full backfill has completed (incremental refreshes keep it current)."""
+    return is_derived_table_ready(CURRENT_READY_KEY)
+
+
+def latest_appointment_versions():
+    """The rows appointments_current holds, computed from the history (``Appointment`` alias).
+
+    Latest version (highest appointments.id) of each non-blank appointment_id,
+    picked with ROW_NUMBER() like ``_build_current``.
+    """
+    ranked = select(*Appointment.__table__.c, func.row_number().over(
+        partition_by=Appointment.appointment_id, order_by=Appointment.id.desc(),
+    ).label('rn')).where(Appointment.appointment_id.isnot(None), Appointment.appointment_id != '').subquery()
+    latest = select(*[ranked.c[c.name] for c in Appointment.__table__.c]).where(ranked.c.rn == 1)
+    return aliased(Appointment, latest.subquery('latest_appointments'))
+
+
+def get_booking_table():
+    """Rows for booking counts: appointments_current once built, else the latest versions from the history."""
+    return AppointmentCurrent if is_current_appointments_ready() else latest_appointment_versions()
+
+
+def booking_count(appt, condition=None):
+    """Count appointments (``get_booking_table`` has one row per appointment_id)."""
+    return func.count() if condition is None else func.count(case((condition, 1)))
+
+
+def rebuild_all_current_appointments() -> int:
+    """Full rebuild from every appointment_id in ``appointments`` (blocking)."""
+    if not _backfill_lock.acquire(blocking=False):
+        log_info("[APPT_CURRENT] rebuild skipped: already running")
+        return 0
+    try:
+        session = get_session()
+        try:
+            ids = {r[0] for r in session.query(Appointment.appointment_id).distinct()}
+            ids.update(r[0] for r in session.query(AppointmentCurrent.appointment_id))
+        finally:
+            session.close()
+
+        written = refresh_current_appointments(ids)
+        set_derived_table_ready(CURRENT_READY_KEY, True)
+        log_info(f"[APPT_CURRENT] full rebuild: {written:,} appointments")
+        return written
+    finally:
+        _backfill_lock.release()
+        _backfill_done.set()
+
+
+def wait_for_current_appointments_backfill(timeout: float = None) -> bool:
+    """Block until the appointments_current table is built (or its backfill has ended).
+
+    Returns:
+        True if appointments_current is ready.
+    """
+    if not is_current_appointments_ready():
+        _backfill_done.wait(timeout)
+    return is_current_appointments_ready()
+
+
+def start_current_appointments_backfill():
+    """Run the full rebuild in a daemon thread if it has never completed."""
+    if is_current_appointments_ready():
+        return
+
+    def _run():
+        try:
+            rebuild_all_current_appointments()
+        except Exception as e:
+            log_error(f"[APPT_CURRENT] backfill failed: {e}")
+
+    threading.Thread(target=_run, name="appointments-current-backfill", daemon=True).start()
@@ -0,0 +1,174 @@
+"""Forward booking matrix shared by Overview, Forecast and Queue Slots.
+
+Overview (``get_upcoming_appointments``), Forecast
+(``get_upcoming_appointments_full``) and Queue Slots (``get_booked_slots``)
+all need SUCCESS/WAITING bookings per (branch, date) from the current
+month onwards. ``get_booking_matrix`` reads them with one GROUP BY and
+keeps them as a branch x day NumPy array, computed once per data version
+(see ``utils.query_cache.get_data_version``). Period counts, daily series,
+per-center totals and capacity usage are then array slices and sums.
+
+Counts are per appointment (its latest version: ``appointments_current``
+once it is built, the same rows computed from the version history before),
+so sums over several days count a rescheduled appointment once.
+"""
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from database.connection import get_session
+from database.models import BranchMaster
+from services.appointment_current_service import get_booking_table, booking_count
+from utils.logger import log_perf
+from utils.query_cache import shared_resource, get_data_version
+
+BOOKED_STATUSES = ('SUCCESS', 'WAITING')
+
+
+class BookingMatrix:
+    """SUCCESS/WAITING bookings per branch (rows) and day (columns) from ``start_date``.
+
+    Attributes:
+        start_date: Date of column 0 (first day of the month it was built in).
+        branch_codes: Branch code per row (object array; may hold None / '').
+        counts: int32 array (branches x days).
+        capacity_map: {branch_code: max_capacity} for branches with a capacity.
+        capacity: float array per row (NaN when the branch has no capacity).
+        registered: bool array per row, True when the branch is in BranchMaster.
+    """
+
+    def __init__(self, start_date, branch_codes, counts, capacity_map, registered_codes):
+        self.start_date = start_date
+        self.branch_codes = np.array(branch_codes, dtype=object)
+        self.counts = counts
+        self.capacity_map = capacity_map
+        self.registered_codes = registered_codes
+        self.capacity = np.array([capacity_map.get(b, np.nan) for b in branch_codes], dtype=float)
+        self.registered = np.array([b in registered_codes for b in branch_codes], dtype=bool)
+
+    @property
+    def num_days(self) -> int:
+        return self.counts.shape[1]
+
+    def covers(self, start_date) -> bool:
+        """True if ``start_date`` is inside the horizon (later days are simply zero)."""
+        return start_date >= self.start_date
+
+    def window(self, start_date, end_date, selected_branches=None, exclude=()):
+        """Rows and columns for a date range and optional branch filter.
+
+        Args:
+            start_date, end_date: Inclusive range; must start inside the horizon
+                (``covers``), else ValueError.
+            selected_branches: Branch codes to keep (None = all).
+            exclude: Branch codes to drop (e.g. ``(None, '')``).
+
+        Returns:
+            (row_index, dates, counts) where ``counts`` is the sub-matrix
+            for ``row_index`` rows and the list of ``dates``.
+        """
+        if not self.covers(start_date):
+            raise ValueError(f"{start_date} is before the matrix start {self.start_date}")
+        first = (start_date - self.start_date).days
+        last = min((end_date - self.start_date).days, self.num_days - 1)
+        dates = [start_date + timedelta(days=i) for i in range(max(last - first + 1, 0))]
+
+        keep = np.ones(len(self.branch_codes), dtype=bool)
+        if selected_branches:
+            keep &= np.isin(self.branch_codes, list(selected_branches))
+        for code in exclude:
+            keep &= np.array([b != code for b in self.branch_codes], dtype=bool)
+        rows = np.flatnonzero(keep)
+        return rows, dates, self.counts[rows, first:first + len(dates)]
+
+    def usage_pct(self, rows, counts):
+        """Booked / capacity * 100 per cell (NaN where the branch has no capacity)."""
+        capacity = self.capacity[rows]
+        if counts.ndim == 2:
+            capacity = capacity[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(capacity > 0, counts / capacity * 100, np.nan)
+
+
+def usage_status(usage_pct):
+    """'over' (>= 100%), 'warning' (>= 80%) or 'normal' per element."""
+    return np.select([usage_pct >= 100, usage_pct >= 80], ['over', 'warning'], 'normal')
+
+
+def _load_capacities(session):
+    """({branch_code: max_capacity}, set of all BranchMaster codes)."""
+    capacity_map = {}
+    registered = set()
+    for r in session.query(BranchMaster.branch_code, BranchMaster.max_capacity):
+        registered.add(r.branch_code)
+        if r.max_capacity is not None:
+            capacity_map[r.branch_code] = r.max_capacity
+    return capacity_map, registered
+
+
+def _query_booked(session, start_date, end_date=None, statuses=BOOKED_STATUSES, selected_branches=None):
+    """One GROUP BY (branch_code, appt_date) with the booking count per cell."""
+    appt = get_booking_table()
+    filters = [appt.appt_date >= start_date]
+    if end_date is not None:
+        filters.append(appt.appt_date <= end_date)
+    if statuses:
+        filters.append(appt.appt_status.in_(statuses))
+    if selected_branches:
+        filters.append(appt.branch_code.in_(selected_branches))
+    return session.query(
+        appt.branch_code, appt.appt_date, booking_count(appt).label('booked')
+    ).filter(*filters).group_by(appt.branch_code, appt.appt_date).all()
+
+
+def _to_matrix(start_date, rows, capacity_map, registered) -> BookingMatrix:
+    branch_codes = sorted({r.branch_code for r in rows}, key=lambda b: (b is None, b or ''))
+    branch_index = {b: i for i, b in enumerate(branch_codes)}
+    num_days = max(((r.appt_date - start_date).days for r in rows), default=-1) + 1
+    counts = np.zeros((len(branch_codes), num_days), dtype=np.int32)
+    if rows:
+        counts[
+            [branch_index[r.branch_code] for r in rows],
+            [(r.appt_date - start_date).days for r in rows],
+        ] = [r.booked for r in rows]
+    return BookingMatrix(start_date, branch_codes, counts, capacity_map, registered)
+
+
+@shared_resource()
+def _build_booking_matrix(start_date, data_version):
+    start_time = time.perf_counter()
+    session = get_session()
+    try:
+        rows = _query_booked(session, start_date)
+        capacity_map, registered = _load_capacities(session)
+    finally:
+        session.close()
+
+    matrix = _to_matrix(start_date, rows, capacity_map, registered)
+    # Shared by all sessions without copies
+    matrix.counts.flags.writeable = False
+    log_perf(f"build_booking_matrix({matrix.counts.shape[0]}x{matrix.num_days})", (time.perf_counter() - start_time) * 1000)
+    return matrix
+
+
+def get_booking_matrix() -> BookingMatrix:
+    """Booking matrix from the first day of the current month (built once per data version, shared read-only)."""
+    return _build_booking_matrix(date.today().replace(day=1), get_data_version())
+
+
+def load_booking_matrix(start_date, end_date, statuses=BOOKED_STATUSES, selected_branches=None) -> BookingMatrix:
+    """Uncached matrix for any date range (history views), with one GROUP BY.
+
+    Args:
+        statuses: Appointment statuses to count (None = all statuses).
+
+    Capacities are taken from the shared matrix, so no extra query is run.
+    """
+    shared = get_booking_matrix()
+    session = get_session()
+    try:
+        rows = _query_booked(session, start_date, end_date, statuses, selected_branches)
+    finally:
+        session.close()
+    return _to_matrix(start_date, rows, shared.capacity_map, shared.registered_codes)
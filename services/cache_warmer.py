@@ -0,0 +1,173 @@
+"""Background pre-warming of the dashboard result cache.
+
+After every upload (and periodically) the most-used views are recomputed
+in a background thread and stored in the shared result cache, so the
+first viewer of each page does not pay the cold-query cost:
+
+- Overview: last 7 days, last 30 days (page default), current month
+- Forecast: next 30 days and next 90 days (page default)
+- Queue Slots: current month, next 7 working days (all centers)
+- By Center: current month and the page default (full date range)
+"""
+import calendar
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from database.connection import get_session
+from database.models import Card
+from services.dashboard_queries import (
+    get_overview_stats, get_daily_stats, get_upcoming_appointments, get_appointment_service_stats,
+    get_upcoming_appointments_full,
+    get_slot_availability,
+    get_card_breakdowns_cached, get_service_funnel_by_branch_cached,
+)
+from utils.logger import log_info, log_error, log_perf
+from utils.query_cache import invalidate_query_cache
+
+# Scheduled re-warm interval: shorter than the 1-hour cache TTL so the
+# standard views are refreshed before they go stale.
+PREWARM_INTERVAL_SECONDS = 30 * 60
+
+_prewarm_lock = threading.Lock()
+# Reason of a run requested while another was in progress (run right after it)
+_pending_reason = None
+_pending_lock = threading.Lock()
+_scheduler_started = False
+_scheduler_lock = threading.Lock()
+
+
+def _get_print_date_range():
+    """Min/max Card.print_date (same range the Overview/By Center filters use)."""
+    session = get_session()
+    try:
+        return session.query(func.min(Card.print_date), func.max(Card.print_date)).first()
+    finally:
+        session.close()
+
+
+def _next_working_days(start: date, count: int) -> list:
+    """Next ``count`` Mon-Fri dates starting from ``start`` (Queue Slots 7-day table)."""
+    days = []
+    d = start
+    while len(days) < count:
+        if d.weekday() < 5:
+            days.append(d)
+        d += timedelta(days=1)
+    return days
+
+
+def get_standard_views() -> list:
+    """List of (cached_function, args) pairs matching the pages' default filters."""
+    today = date.today()
+    views = []
+
+    min_date, max_date = _get_print_date_range()
+    if min_date and max_date:
+        month_start = max(min_date, max_date.replace(day=1))
+        overview_ranges = [
+            (max(min_date, max_date - timedelta(days=7)), max_date),   # "7 วัน" (clamped like the page)
+            (max(min_date, max_date - timedelta(days=30)), max_date),  # default / "30 วัน"
+            (month_start, max_date),                                   # current month
+        ]
+        for start, end in overview_ranges:
+            views += [
+                (get_overview_stats, (start, end, None)),
+                (get_daily_stats, (start, end, None)),
+                (get_appointment_service_stats, (start, end, None)),
+            ]
+        for start, end in [(month_start, max_date), (min_date, max_date)]:
+            views += [
+                (get_card_breakdowns_cached, (start, end)),
+                (get_service_funnel_by_branch_cached, (start, end)),
+            ]
+
+    views.append((get_upcoming_appointments, (None,)))
+    for days in (30, 90):
+        views.append((get_upcoming_appointments_full, (None, today, today + timedelta(days=days - 1), False)))
+
+    first_day = today.replace(day=1)
+    last_day = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+    upcoming = _next_working_days(today, 7)
+    for start, end in [(first_day, last_day), (upcoming[0], upcoming[-1])]:
+        views.append((get_slot_availability, (start, end, None)))
+    return views
+
+
+def prewarm_standard_views(reason: str = "scheduled"):
+    """Recompute all standard views into the result cache (blocking).
+
+    If another pre-warm is in progress, one follow-up run is queued instead
+    (requests arriving meanwhile share it), so data imported during a
+    scheduled run is still warmed. Failures of individual views are logged
+    and do not stop the others.
+    """
+    global _pending_reason
+    while reason is not None:
+        if not _prewarm_lock.acquire(blocking=False):
+            with _pending_lock:
+                _pending_reason = reason
+            log_info(f"[PREWARM] queued ({reason}): a run is in progress")
+            return
+        try:
+            _prewarm(reason)
+        finally:
+            _prewarm_lock.release()
+        with _pending_lock:
+            reason, _pending_reason = _pending_reason, None
+
+
+def _prewarm(reason: str):
+    """One pass over ``get_standard_views`` (caller holds ``_prewarm_lock``)."""
+    start_time = time.perf_counter()
+    try:
+        views = get_standard_views()
+        failed = 0
+        for cached_func, args in views:
+            try:
+                cached_func.refresh(*args)
+            except Exception as e:
+                failed += 1
+                log_error(f"[PREWARM] {cached_func.__name__}{args} failed: {e}")
+        log_info(f"[PREWARM] {reason}: {len(views) - failed}/{len(views)} views warmed")
+    except Exception as e:
+        log_error(f"[PREWARM] {reason} failed: {e}")
+    finally:
+        log_perf(f"prewarm_standard_views({reason})", (time.perf_counter() - start_time) * 1000)
+
+
+def prewarm_in_background(reason: str = "upload"):
+    """Start ``prewarm_standard_views`` in a daemon thread and return immediately."""
+    threading.Thread(
+        target=prewarm_standard_views, args=(reason,), name="cache-prewarm", daemon=True
+    ).start()
+
+
+def refresh_after_import(source: str):
+    """Post-import hook: mark cached results stale and re-warm the standard views.
+
+    Call after an upload or delete has been committed. Non-standard views
+    keep serving their previous result until their own background refresh
+    finishes (see ``stale_while_revalidate``).
+    """
+    invalidate_query_cache()
+    prewarm_in_background(reason=f"import {source}")
+
+
+def start_prewarm_scheduler(interval_seconds: int = PREWARM_INTERVAL_SECONDS):
+    """Start the periodic pre-warm thread once per process (idempotent)."""
+    global _scheduler_started
+    with _scheduler_lock:
+        if _scheduler_started:
+            return
+        _scheduler_started = True
+
+    def _loop():
+        while True:
+            prewarm_standard_views(reason="scheduled")
+            time.sleep(interval_seconds)
+
+    threading.Thread(target=_loop, name="cache-prewarm-scheduler", daemon=True).start()
+    log_info(f"[PREWARM] scheduler started (every {interval_seconds // 60} min)")
@@ -0,0 +1,244 @@
+"""Maintenance and lookup of the canonical_cards table (Overview headline counts).
+
+A card (serial number) can be in ``cards`` and ``delivery_cards`` of several
+overlapping Bio Unified Reports (daily and monthly) and in
+``card_delivery_records``. ``canonical_cards`` keeps one row per
+(serial_number, print_status): the winning source row by
+
+1. source: cards > card_delivery_records > delivery_cards
+   (printed at a center first; delivery records carry their own print date,
+   report delivery sheets only their report),
+2. the latest upload (highest report / upload id),
+3. the lowest row id,
+
+so "distinct good cards at centers / delivered" and "bad delivered cards"
+become plain counts over an index instead of ``COUNT(DISTINCT serial_number)``
+over unions. A report delivery sheet counts in a range when its report has
+cards printed in that range (at the selected centers); ``report_card_dates``
+records those (report, print date, branch) at import so the lookup does not
+scan ``cards``.
+
+An upload/delete refreshes only its serials (``get_upload_serials``,
+collected before a delete) and its reports' dates. The first full build
+runs in a background thread; until it has finished
+``is_canonical_cards_ready()`` is False and the same counts are computed
+from the source tables (``canonical_from_sources``).
+"""
+import threading
+import time
+
+from sqlalchemy import and_, func, literal, null, or_, select, union_all
+
+from database.connection import get_session
+from database.models import Card, DeliveryCard, CardDeliveryRecord, CanonicalCard, ReportCardDate
+from services.journey_service import ID_CHUNK_SIZE, is_derived_table_ready, set_derived_table_ready
+from utils.logger import log_info, log_error, log_perf
+
+CANONICAL_READY_KEY = 'canonical_cards_ready'
+
+# source table -> (serial, status, row id, upload id, event date, branch), in precedence order
+CANONICAL_SOURCES = {
+    'cards': (
+        Card.serial_number, Card.print_status, Card.id, Card.report_id, Card.print_date, Card.branch_code,
+    ),
+    'card_delivery_records': (
+        CardDeliveryRecord.serial_number, CardDeliveryRecord.print_status, CardDeliveryRecord.id,
+        CardDeliveryRecord.upload_id, func.date(CardDeliveryRecord.create_date), null(),
+    ),
+    'delivery_cards': (
+        DeliveryCard.serial_number, DeliveryCard.print_status, DeliveryCard.id, DeliveryCard.report_id, null(), null(),
+    ),
+}
+
+# Upload page source -> source tables
+CANONICAL_UPLOAD_SOURCES = {
+    'unified': ('cards', 'delivery_cards'),
+    'card_delivery': ('card_delivery_records',),
+}
+
+_backfill_lock = threading.Lock()
+
+
+def canonical_from_sources(serials=None):
+    """The rows of ``canonical_cards`` computed from the source tables (subquery).
+
+    Used to refresh a batch of ``serials`` and, with ``serials=None``, by the
+    Overview until the backfill has finished (a window over every card row:
+    slower than the table, fine as a fallback).
+    """
+    candidates = []
+    for rank, (source, (serial, status, row_id, upload_id, event_date, branch)) in enumerate(CANONICAL_SOURCES.items()):
+        stmt = select(
+            serial.label('serial_number'), status.label('print_status'),
+            literal(source).label('source'), literal(rank).label('source_rank'),
+            row_id.label('row_id'), upload_id.label('upload_id'),
+            event_date.label('event_date'), branch.label('branch_code'),
+        ).where(serial.isnot(None), serial != '', status.isnot(None), status != '')
+        if serials is not None:
+            stmt = stmt.where(serial.in_(serials))
+        candidates.append(stmt)
+    rows = union_all(*candidates).subquery()
+    ranked = select(rows, func.row_number().over(
+        partition_by=(rows.c.serial_number, rows.c.print_status),
+        order_by=(rows.c.source_rank, rows.c.upload_id.desc(), rows.c.row_id),
+    ).label('rn')).subquery()
+    return select(
+        *[c for c in ranked.c if c.key not in ('source_rank', 'rn')]
+    ).where(ranked.c.rn == 1).subquery('canonical_from_sources')
+
+
+# ============== Maintenance ==============
+
+def get_upload_serials(session, upload_source: str, upload_id: int) -> set:
+    """Serials an upload contributes to ``canonical_cards`` (call before deleting its rows)."""
+    serials = set()
+    for source in CANONICAL_UPLOAD_SOURCES.get(upload_source, ()):
+        serial, _, _, upload_column, _, _ = CANONICAL_SOURCES[source]
+        serials.update(r[0] for r in session.execute(
+            select(serial).where(upload_column == upload_id, serial.isnot(None), serial != '').distinct()
+        ))
+    return serials
+
+
+def refresh_canonical_cards(serials) -> int:
+    """Recompute the canonical rows of ``serials`` (delete + insert per batch).
+
+    Returns:
+        Number of canonical rows written.
+    """
+    start_time = time.perf_counter()
+    serials = sorted(serials or ())
+    session = get_session()
+    written = 0
+    try:
+        for offset in range(0, len(serials), ID_CHUNK_SIZE):
+            chunk = serials[offset:offset + ID_CHUNK_SIZE]
+            rows = [dict(r) for r in session.execute(select(canonical_from_sources(chunk))).mappings()]
+            session.query(CanonicalCard).filter(
+                CanonicalCard.serial_number.in_(chunk)
+            ).delete(synchronize_session=False)
+            if rows:
+                session.bulk_insert_mappings(CanonicalCard, rows)
+            session.commit()
+            written += len(rows)
+        return written
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        log_perf(f"refresh_canonical_cards({len(serials):,} serials)", (time.perf_counter() - start_time) * 1000)
+
+
+def refresh_report_card_dates(report_ids) -> None:
+    """Recompute the (print date, branch) rows of imported, replaced or deleted reports."""
+    report_ids = [i for i in set(report_ids or ()) if i is not None]
+    if not report_ids:
+        return
+    session = get_session()
+    try:
+        session.query(ReportCardDate).filter(
+            ReportCardDate.report_id.in_(report_ids)
+        ).delete(synchronize_session=False)
+        session.execute(ReportCardDate.__table__.insert().from_select(
+            ['report_id', 'print_date', 'branch_code'],
+            select(Card.report_id, Card.print_date, Card.branch_code).where(
+                Card.report_id.in_(report_ids), Card.print_date.isnot(None)
+            ).distinct(),
+        ))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+# ============== Lookup ==============
+
+def get_canonical_card_counts(session, start_date, end_date, selected_branches=None, from_sources=False) -> dict:
+    """Overview card counts for a print date range: plain counts of canonical rows.
+
+    Good at centers: cards printed in the range (at the selected centers).
+    Delivered: card delivery records printed in the range, and report
+    delivery sheets of reports with cards in the range (at the selected
+    centers). ``from_sources`` computes the canonical rows from the source
+    tables (before the backfill has finished).
+
+    Returns:
+        {'good_at_center', 'good_delivery', 'bad_delivery'}: distinct cards.
+    """
+    if from_sources:
+        c = canonical_from_sources().c
+        report_dates = (Card.report_id, Card.print_date, Card.branch_code)
+    else:
+        c = CanonicalCard.__table__.c
+        report_dates = (ReportCardDate.report_id, ReportCardDate.print_date, ReportCardDate.branch_code)
+    report_id, print_date, branch_code = report_dates
+
+    at_center = [c.source == 'cards', c.event_date >= start_date, c.event_date <= end_date]
+    report_filters = [print_date >= start_date, print_date <= end_date]
+    if selected_branches:
+        at_center.append(c.branch_code.in_(selected_branches))
+        report_filters.append(branch_code.in_(selected_branches))
+    delivered = or_(
+        and_(c.source == 'card_delivery_records', c.event_date >= start_date, c.event_date <= end_date),
+        and_(c.source == 'delivery_cards', c.upload_id.in_(select(report_id).where(*report_filters).distinct())),
+    )
+    good = c.print_status == 'G'
+    row = session.execute(select(
+        func.count().filter(good, *at_center),
+        func.count().filter(good, delivered),
+        func.count().filter(c.print_status == 'B', delivered),
+    ).where(c.print_status.in_(('G', 'B')), or_(and_(*at_center), delivered))).one()
+    return {'good_at_center': row[0] or 0, 'good_delivery': row[1] or 0, 'bad_delivery': row[2] or 0}
+
+
+# ============== Backfill ==============
+
+def is_canonical_cards_ready() -> bool:
+    """True once the full backfill has completed (upload hooks keep it current)."""
+    return is_derived_table_ready(CANONICAL_READY_KEY)
+
+
+def rebuild_canonical_cards() -> int:
+    """Full rebuild from the card sources (blocking). Returns the number of canonical rows written."""
+    if not _backfill_lock.acquire(blocking=False):
+        log_info("[CANONICAL] rebuild skipped: already running")
+        return 0
+    try:
+        session = get_session()
+        try:
+            session.query(CanonicalCard).delete(synchronize_session=False)
+            session.commit()
+            serials = set()
+            for serial, *_ in CANONICAL_SOURCES.values():
+                serials.update(r[0] for r in session.execute(
+                    select(serial).where(serial.isnot(None), serial != '').distinct()
+                ))
+            report_ids = [r[0] for r in session.execute(select(Card.report_id).distinct())]
+        finally:
+            session.close()
+
+        for offset in range(0, len(report_ids), ID_CHUNK_SIZE):
+            refresh_report_card_dates(report_ids[offset:offset + ID_CHUNK_SIZE])
+        written = refresh_canonical_cards(serials)
+        set_derived_table_ready(CANONICAL_READY_KEY, True)
+        log_info(f"[CANONICAL] full rebuild: {written:,} rows")
+        return written
+    finally:
+        _backfill_lock.release()
+
+
+def start_canonical_cards_backfill():
+    """Run the full rebuild in a daemon thread if it has never completed."""
+    if is_canonical_cards_ready():
+        return
+
+    def _run():
+        try:
+            rebuild_canonical_cards()
+        except Exception as e:
+            log_error(f"[CANONICAL] backfill failed: {e}")
+
+    threading.Thread(target=_run, name="canonical-cards-backfill", daemon=True).start()
@@ -0,0 +1,1150 @@
+"""Cached dashboard queries shared by pages and background jobs.
+
+The heavy per-page aggregations live here (instead of inside the page
+scripts) so they can be imported by background jobs such as the cache
+pre-warmer in ``services/cache_warmer.py``. Each function is wrapped with
+``stale_while_revalidate`` so pages and background jobs share one
+process-wide result cache.
+"""
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, and_, case, exists, select
+
+from database.connection import get_session, get_branch_name_map_cached, run_concurrent_queries
+from database.models import (
+    Card, Appointment, QLog, BioRecord,
+    CardDeliveryRecord, AppointmentJourney, SlotAvailability,
+)
+from services.aggregation import aggregate_grouping_sets
+from services.analytics_snapshot import scan_snapshot
+from services.booking_matrix import BOOKED_STATUSES, get_booking_matrix, load_booking_matrix, usage_status
+from services.metric_cube import get_card_cube, get_bio_cube
+from services.anomaly_index_service import is_anomaly_index_ready, get_anomaly_counts
+from services.canonical_card_service import is_canonical_cards_ready, get_canonical_card_counts
+from services.journey_service import is_journey_ready, journey_from_sources
+from services.slot_availability_service import is_slot_availability_ready, slot_cut_filters
+from services.appointment_current_service import get_booking_table, booking_count
+from utils.branch_display import get_branch_short_name, get_branch_short_name_map
+from utils.logger import log_perf
+from utils.query_cache import stale_while_revalidate
+
+
+def _stat_value(value, default=0):
+    """NaN/None -> default (pandas marks empty AVG/MAX as NaN)."""
+    return default if value is None or pd.isna(value) else value
+
+
+# ============== Service Funnel ==============
+
+# Journey columns (booking, check-in, print) per funnel level ('total' = no grouping)
+_JOURNEY_LEVEL_COLUMNS = {
+    'total': (None, None, None),
+    'branch': ('branch_code', 'checkin_branch_code', 'print_branch_code'),
+    'date': ('appt_date', 'checkin_date', 'print_date'),
+}
+
+
+def _grouped_count(group_col, count_expr, filters):
+    """Query fn for run_concurrent_queries: {group_key: count} (key None when ungrouped)."""
+    def _run(s):
+        if group_col is None:
+            return {None: s.query(count_expr).filter(*filters).scalar() or 0}
+        rows = s.query(group_col, count_expr).filter(*filters).group_by(group_col).all()
+        return {key: count for key, count in rows}
+    return _run
+
+
+def _journey_funnel_queries(j, levels, start_date, end_date, selected_branches):
+    """Funnel queries over journey rows ``j`` (one row per appointment, plain counts)."""
+    branch_filter = selected_branches if selected_branches and len(selected_branches) > 0 else None
+
+    booked = [j.c.appt_date >= start_date, j.c.appt_date <= end_date, ~j.c.appt_status.in_(['CANCEL', 'EXPIRED'])]
+    checked_in = [j.c.checkin_date >= start_date, j.c.checkin_date <= end_date]
+    printed = [j.c.print_date >= start_date, j.c.print_date <= end_date]
+    if branch_filter:
+        booked.append(j.c.branch_code.in_(branch_filter))
+        checked_in.append(j.c.checkin_branch_code.in_(branch_filter))
+        printed.append(j.c.print_branch_code.in_(branch_filter))
+
+    queries = {}
+    for level in levels:
+        appt_col, checkin_col, print_col = (
+            None if name is None else j.c[name] for name in _JOURNEY_LEVEL_COLUMNS[level]
+        )
+        # Printed without a check-in in scope (same branch / same day for grouped levels)
+        checkin_match = and_(*checked_in, *([checkin_col == print_col] if checkin_col is not None else []))
+        no_checkin = case((checkin_match, 0), else_=1) == 1
+        queries[(level, 'total_appts')] = _grouped_count(appt_col, func.count(), booked)
+        queries[(level, 'checked_in')] = _grouped_count(checkin_col, func.count(), checked_in)
+        queries[(level, 'bio_served')] = _grouped_count(print_col, func.count(), printed)
+        queries[(level, 'skip_queue')] = _grouped_count(print_col, func.count(), printed + [no_checkin])
+    return queries
+
+
+def get_service_funnel_counts(start_date, end_date, selected_branches=None, levels=('total',)):
+    """
+    Appointment service funnel computed inside the database (counts only).
+
+    นัดหมาย (total_appts) = Appointment ทุก status ยกเว้น CANCEL, EXPIRED
+    มา Check-in (checked_in) = QLog ที่มี qlog_num
+    ออกบัตร (bio_served) = BioRecord unique appointment_id
+    ไม่ผ่านตู้คิว (skip_queue) = BioRecord ที่ไม่มี QLog check-in
+    No-Show (no_show) = total_appts - checked_in - skip_queue
+
+    Each appointment counts once, by its journey row: latest booking
+    version, first check-in, first print (see journey_service). Reads
+    ``appointment_journey`` once it has been built, otherwise the same rows
+    computed from the source tables (``journey_from_sources``), so counts
+    do not change when the backfill finishes. For the 'branch' and 'date'
+    levels a check-in must be in the same branch / on the same day.
+    All queries of all levels run concurrently.
+
+    Args:
+        levels: any of 'total', 'branch', 'date'
+
+    Returns:
+        {level: {key: {'total_appts', 'checked_in', 'bio_served', 'skip_queue', 'no_show'}}}
+        with key None for 'total', branch_code for 'branch', date for 'date'.
+        Keys are the union of appointment and BioRecord groups.
+    """
+    journeys = AppointmentJourney.__table__ if is_journey_ready() else journey_from_sources()
+    results = run_concurrent_queries(_journey_funnel_queries(journeys, levels, start_date, end_date, selected_branches))
+
+    funnel = {}
+    for level in levels:
+        counts = {metric: results[(level, metric)] for metric in ('total_appts', 'checked_in', 'bio_served', 'skip_queue')}
+        rows = {}
+        for key in counts['total_appts'].keys() | counts['bio_served'].keys():
+            total = counts['total_appts'].get(key, 0)
+            checkin = counts['checked_in'].get(key, 0)
+            skip_queue = counts['skip_queue'].get(key, 0)
+            rows[key] = {
+                'total_appts': total,
+                'checked_in': checkin,
+                'bio_served': counts['bio_served'].get(key, 0),
+                'skip_queue': skip_queue,
+                'no_show': max(0, total - checkin - skip_queue),
+            }
+        funnel[level] = rows
+    return funnel
+
+
+# ============== Overview ==============
+
+@stale_while_revalidate(ttl=3600)
+def get_overview_stats(start_date, end_date, selected_branches=None):
+    """Get cached overview statistics - independent queries run concurrently."""
+    start_time = time.perf_counter()
+    try:
+        # Base date filter
+        filters = [Card.print_date >= start_date, Card.print_date <= end_date]
+
+        # Add branch filter if specified
+        if selected_branches and len(selected_branches) > 0:
+            filters.append(Card.branch_code.in_(selected_branches))
+
+        date_filter = and_(*filters)
+
+        # ==================== Additive Card / BioRecord counters: in-memory metric cubes ====================
+        card_totals = get_card_cube().aggregate(
+            start_date, end_date, selected_branches=selected_branches
+        ).iloc[0]
+        bio_totals = get_bio_cube().aggregate(
+            start_date, end_date, selected_branches=selected_branches
+        ).iloc[0]
+
+        # ==================== Appointment-related queries (optimized) ====================
+        appt_one_g = select(Card.appointment_id).where(
+            date_filter, Card.print_status == 'G',
+            Card.appointment_id.isnot(None), Card.appointment_id != ''
+        ).group_by(Card.appointment_id).having(func.count(Card.id) == 1)
+
+        # Combined: complete_cards + unique_work_permit in one query (saves 1 query)
+        def _complete_stats(session):
+            return session.query(
+                func.count(func.distinct(Card.serial_number)).label('complete_sn'),
+                func.count(func.distinct(Card.work_permit_no)).label('complete_wp'),
+            ).filter(
+                date_filter, Card.print_status == 'G',
+                Card.appointment_id.in_(appt_one_g),
+                Card.card_id.isnot(None), Card.card_id != '',
+                Card.serial_number.isnot(None), Card.serial_number != '',
+                Card.work_permit_no.isnot(None), Card.work_permit_no != ''
+            ).first()
+
+        # Single subquery for appointments with multiple G cards (count + sum in one read)
+        multi_g_appts = select(
+            Card.appointment_id,
+            func.count(Card.id).label('cnt')
+        ).where(
+            date_filter, Card.print_status == 'G',
+            Card.appointment_id.isnot(None), Card.appointment_id != ''
+        ).group_by(Card.appointment_id).having(func.count(Card.id) > 1).subquery()
+
+        def _multi_g_stats(session):
+            return session.query(
+                func.count().label('appts'),
+                func.coalesce(func.sum(multi_g_appts.c.cnt), 0).label('records'),
+            ).select_from(multi_g_appts).first()
+
+        def _duplicate_serial(session):
+            return session.query(Card.serial_number).filter(
+                date_filter, Card.print_status == 'G',
+                Card.serial_number.isnot(None), Card.serial_number != ''
+            ).group_by(Card.serial_number).having(func.count(Card.id) > 1).count()
+
+        # ==================== QLog Wait Time Stats (separate query) ====================
+        # Logic SLA รอคิว (ตาม Logic documentation):
+        # - Type A (OB centers): นำมาคิดทุกรายการ, ตก SLA ถ้า TimeCall - Train_Time > 60 นาที
+        # - Type B (SC centers): นำมาคิดเฉพาะ EI และ T, ตก SLA ถ้า TimeCall > SLA_TimeEnd
+        # - เฉพาะนัดหมายที่มีการออกบัตร (G) แล้วเท่านั้น
+        # Note: ถ้าไม่มี sla_time_end/qlog_train_time จะ fallback ใช้ wait_time_seconds > 3600
+
+        # Get appointment_codes that have printed cards (G) - from BioRecord
+        printed_appt_codes = select(BioRecord.appointment_id).where(
+            BioRecord.print_date >= start_date,
+            BioRecord.print_date <= end_date,
+            BioRecord.print_status == 'G',
+            BioRecord.appointment_id.isnot(None),
+            BioRecord.appointment_id != ''
+        )
+        if selected_branches and len(selected_branches) > 0:
+            printed_appt_codes = printed_appt_codes.where(BioRecord.branch_code.in_(selected_branches))
+        printed_appt_codes = printed_appt_codes.distinct()
+
+        qlog_filters = [
+            QLog.qlog_date >= start_date,
+            QLog.qlog_date <= end_date,
+            QLog.appointment_code.in_(printed_appt_codes)  # Only appointments with printed cards
+        ]
+        if selected_branches and len(selected_branches) > 0:
+            qlog_filters.append(QLog.branch_code.in_(selected_branches))
+
+        # Combined Type A + Type B in a single query using CASE (saves 1 query)
+        # Type A (OB centers): ALL records with printed cards, fail if wait > 3600s
+        # Type B (SC centers): Only EI and T with printed cards, fail if wait > 3600s
+        def _qlog_wait_stats(session):
+            return session.query(
+                # Type A counts
+                func.sum(case((and_(QLog.qlog_type == 'A', QLog.wait_time_seconds.isnot(None)), 1), else_=0)).label('a_total'),
+                func.sum(case((and_(QLog.qlog_type == 'A', QLog.wait_time_seconds.isnot(None), QLog.wait_time_seconds <= 3600), 1), else_=0)).label('a_pass'),
+                func.avg(case((and_(QLog.qlog_type == 'A', QLog.wait_time_seconds.isnot(None)), QLog.wait_time_seconds))).label('a_avg'),
+                # Type B counts (only EI and T)
+                func.sum(case((and_(QLog.qlog_type == 'B', QLog.sla_status.in_(['EI', 'T']), QLog.wait_time_seconds.isnot(None)), 1), else_=0)).label('b_total'),
+                func.sum(case((and_(QLog.qlog_type == 'B', QLog.sla_status.in_(['EI', 'T']), QLog.wait_time_seconds.isnot(None), QLog.wait_time_seconds <= 3600), 1), else_=0)).label('b_pass'),
+                func.avg(case((and_(QLog.qlog_type == 'B', QLog.sla_status.in_(['EI', 'T']), QLog.wait_time_seconds.isnot(None)), QLog.wait_time_seconds))).label('b_avg'),
+            ).filter(and_(*qlog_filters)).first()
+
+        # ==================== Fan out: queries are independent, run them concurrently ====================
+        queries = {
+            'complete_stats': _complete_stats,
+            'qlog_wait_stats': _qlog_wait_stats,
+        }
+        # Distinct good / bad delivery cards: plain counts over canonical_cards (computed from the sources until built)
+        from_sources = not is_canonical_cards_ready()
+        queries['canonical_counts'] = lambda session: get_canonical_card_counts(
+            session, start_date, end_date, selected_branches, from_sources=from_sources
+        )
+        # Multi G / duplicate serials: one read of the precomputed anomalies once it is built
+        if is_anomaly_index_ready():
+            queries['anomaly_counts'] = lambda session: get_anomaly_counts(
+                session, start_date, end_date, selected_branches
+            )
+        else:
+            queries['multi_g_stats'] = _multi_g_stats
+            queries['duplicate_serial'] = _duplicate_serial
+        results = run_concurrent_queries(queries)
+
+        canonical_counts = results['canonical_counts']
+        unique_at_center = canonical_counts['good_at_center']
+        unique_delivery = canonical_counts['good_delivery']
+        unique_total = unique_at_center + unique_delivery
+        bad_delivery_total = canonical_counts['bad_delivery']
+        bad_at_center = int(card_totals['bad_count'])
+        wrong_branch = int(card_totals['wrong_branch_count'])
+        wrong_date = int(card_totals['wrong_date_count'])
+        sla_over_12 = int(card_totals['sla_over_count'])
+        wait_over_1hr = int(card_totals['wait_over_1hr'])
+        wait_total = int(card_totals['wait_total'])
+        wait_pass = int(card_totals['wait_pass'])
+        avg_wait = float(card_totals['wait_sum']) / wait_total if wait_total else 0
+        incomplete = int(card_totals['incomplete'])
+
+        sla_total = int(bio_totals['sla_total'])
+        sla_pass = int(bio_totals['sla_pass'])
+        avg_sla = float(bio_totals['sla_sum']) / sla_total if sla_total else 0
+
+        bad_cards = bad_at_center + bad_delivery_total
+
+        complete_stats = results['complete_stats']
+        complete_cards = complete_stats.complete_sn or 0
+        unique_work_permit = complete_stats.complete_wp or 0
+
+        if 'anomaly_counts' in results:
+            anomaly_counts = results['anomaly_counts']
+            appt_multiple_g = anomaly_counts['multi_g_appt']['keys']
+            appt_multiple_records = anomaly_counts['multi_g_appt']['cards']
+            duplicate_serial = anomaly_counts['duplicate_serial']['keys']
+        else:
+            appt_multiple_g = results['multi_g_stats'].appts or 0
+            appt_multiple_records = results['multi_g_stats'].records or 0
+            duplicate_serial = results['duplicate_serial']
+
+        qlog_combined = results['qlog_wait_stats']
+        type_a_total = qlog_combined.a_total or 0
+        type_a_pass = qlog_combined.a_pass or 0
+        type_b_total = qlog_combined.b_total or 0
+        type_b_pass = qlog_combined.b_pass or 0
+
+        qlog_wait_total = type_a_total + type_b_total
+        qlog_wait_pass = type_a_pass + type_b_pass
+        qlog_wait_over_1hr = qlog_wait_total - qlog_wait_pass
+
+        # Weighted average (combine Type A and Type B averages)
+        type_a_avg = qlog_combined.a_avg or 0
+        type_b_avg = qlog_combined.b_avg or 0
+        if qlog_wait_total > 0:
+            qlog_avg_wait_sec = (type_a_avg * type_a_total + type_b_avg * type_b_total) / qlog_wait_total
+        else:
+            qlog_avg_wait_sec = 0
+        qlog_avg_wait_min = qlog_avg_wait_sec / 60 if qlog_avg_wait_sec else 0
+
+        # Use QLog data if Card wait_time is empty
+        final_wait_total = wait_total if wait_total > 0 else qlog_wait_total
+        final_wait_pass = wait_pass if wait_total > 0 else qlog_wait_pass
+        final_avg_wait = avg_wait if wait_total > 0 else qlog_avg_wait_min
+        final_wait_over_1hr = wait_over_1hr if wait_total > 0 else qlog_wait_over_1hr
+
+        return {
+            'unique_at_center': unique_at_center,
+            'unique_delivery': unique_delivery,
+            'unique_total': unique_total,
+            'bad_cards': bad_cards,
+            'complete_cards': complete_cards,
+            'unique_work_permit': unique_work_permit,
+            'appt_multiple_g': appt_multiple_g,
+            'appt_multiple_records': appt_multiple_records,
+            'incomplete': incomplete,
+            'wrong_branch': wrong_branch,
+            'wrong_date': wrong_date,
+            'sla_over_12': sla_over_12,
+            'duplicate_serial': duplicate_serial,
+            'sla_total': sla_total,
+            'sla_pass': sla_pass,
+            'avg_sla': avg_sla,
+            'wait_total': final_wait_total,
+            'wait_pass': final_wait_pass,
+            'avg_wait': final_avg_wait,
+            'wait_over_1hr': final_wait_over_1hr,
+        }
+    finally:
+        duration = (time.perf_counter() - start_time) * 1000
+        log_perf(f"get_overview_stats({start_date} to {end_date})", duration)
+
+
+def _daily_bio_stats_from_snapshot(start_date, end_date, selected_branches=None):
+    """``get_daily_stats`` BioRecord counts from the analytics snapshot (None if not available)."""
+    filters = [('print_date', '>=', start_date), ('print_date', '<=', end_date)]
+    if selected_branches:
+        filters.append(('branch_code', 'in', list(selected_branches)))
+    df = scan_snapshot('bio_records', ['print_date', 'branch_code', 'print_status', 'serial_number'], filters)
+    if df is None:
+        return None
+
+    df = df[df['print_date'].notna()]
+    branch = df['branch_code'].fillna('')
+    good = df['print_status'] == 'G'
+    bad = df['print_status'] == 'B'
+    bio_data = {}
+    for center, code in (('sc', '-SC-'), ('ob', '-OB-')):
+        in_center = branch.str.contains(code, regex=False)
+        good_serials = df['serial_number'].where(good & in_center)
+        bio_data[f'{center}_good'] = good_serials.groupby(df['print_date']).nunique()
+        bio_data[f'{center}_bad'] = (bad & in_center).groupby(df['print_date']).sum()
+    daily = pd.DataFrame(bio_data, index=df['print_date'].unique()).fillna(0).astype(int)
+    return {dt: row for dt, row in zip(daily.index, daily.to_dict('records'))}
+
+
+@stale_while_revalidate(ttl=3600)
+def get_daily_stats(start_date, end_date, selected_branches=None):
+    """Get cached daily statistics for chart - separated by center type (SC/OB)."""
+    start_time = time.perf_counter()
+    session = get_session()
+    try:
+        from database.models import BioRecord
+
+        # Base date filter for BioRecord
+        filters = [BioRecord.print_date >= start_date, BioRecord.print_date <= end_date]
+
+        # Add branch filter if specified
+        if selected_branches and len(selected_branches) > 0:
+            filters.append(BioRecord.branch_code.in_(selected_branches))
+
+        date_filter = and_(*filters)
+
+        # Query BioRecord data - separated by center type (SC vs OB)
+        # SC = ศูนย์บริการ (branch_code contains '-SC-')
+        # OB = ศูนย์แรกรับ (branch_code contains '-OB-')
+        bio_data = _daily_bio_stats_from_snapshot(start_date, end_date, selected_branches)
+        daily_stats = [] if bio_data is not None else session.query(
+            BioRecord.print_date,
+            # SC ศูนย์บริการ
+            func.count(func.distinct(BioRecord.serial_number)).filter(
+                BioRecord.print_status == 'G',
+                BioRecord.branch_code.like('%-SC-%')
+            ).label('sc_good'),
+            func.sum(case((and_(BioRecord.print_status == 'B', BioRecord.branch_code.like('%-SC-%')), 1), else_=0)).label('sc_bad'),
+            # OB ศูนย์แรกรับ
+            func.count(func.distinct(BioRecord.serial_number)).filter(
+                BioRecord.print_status == 'G',
+                BioRecord.branch_code.like('%-OB-%')
+            ).label('ob_good'),
+            func.sum(case((and_(BioRecord.print_status == 'B', BioRecord.branch_code.like('%-OB-%')), 1), else_=0)).label('ob_bad'),
+        ).filter(
+            date_filter, BioRecord.print_date.isnot(None)
+        ).group_by(BioRecord.print_date).order_by(BioRecord.print_date).all()
+
+        # Convert to dict for easy lookup
+        bio_data = bio_data if bio_data is not None else {d.print_date: {
+            'sc_good': d.sc_good or 0, 'sc_bad': d.sc_bad or 0,
+            'ob_good': d.ob_good or 0, 'ob_bad': d.ob_bad or 0
+        } for d in daily_stats}
+
+        # Query CardDeliveryRecord data (บัตรจัดส่ง 68/69)
+        cdr_filters = [
+            func.date(CardDeliveryRecord.create_date) >= start_date,
+            func.date(CardDeliveryRecord.create_date) <= end_date
+        ]
+        if selected_branches and len(selected_branches) > 0:
+            cdr_filters.append(CardDeliveryRecord.branch_code.in_(selected_branches))
+
+        cdr_stats = session.query(
+            func.date(CardDeliveryRecord.create_date).label('print_date'),
+            func.count(func.distinct(CardDeliveryRecord.serial_number)).filter(
+                CardDeliveryRecord.print_status == 'G'
+            ).label('delivery_g'),
+            func.sum(case((CardDeliveryRecord.print_status == 'B', 1), else_=0)).label('delivery_bad'),
+        ).filter(
+            and_(*cdr_filters),
+            CardDeliveryRecord.create_date.isnot(None)
+        ).group_by(func.date(CardDeliveryRecord.create_date)).all()
+
+        # Convert to dict
+        cdr_data = {d.print_date: {'delivery_g': d.delivery_g or 0, 'delivery_bad': d.delivery_bad or 0} for d in cdr_stats}
+
+        # Merge all dates
+        all_dates = sorted(set(bio_data.keys()) | set(cdr_data.keys()))
+
+        result = []
+        for dt in all_dates:
+            bio = bio_data.get(dt, {'sc_good': 0, 'sc_bad': 0, 'ob_good': 0, 'ob_bad': 0})
+            cdr = cdr_data.get(dt, {'delivery_g': 0, 'delivery_bad': 0})
+            result.append((
+                dt,
+                bio['sc_good'],        # ศูนย์บริการ SC (G)
+                bio['ob_good'],        # ศูนย์แรกรับ OB (G)
+                cdr['delivery_g'],     # บัตรจัดส่ง (G)
+                bio['sc_bad'],         # บัตรเสีย SC
+                bio['ob_bad'],         # บัตรเสีย OB
+                cdr['delivery_bad'],   # บัตรเสีย จัดส่ง
+            ))
+
+        return result
+    finally:
+        session.close()
+        duration = (time.perf_counter() - start_time) * 1000
+        log_perf(f"get_daily_stats({start_date} to {end_date})", duration)
+
+
+@stale_while_revalidate(ttl=3600)
+def get_upcoming_appointments(selected_branches=None):
+    """
+    Get upcoming appointments for workload forecasting.
+    Shows appointments from today onwards (future dates).
+    Includes capacity comparison from BranchMaster.max_capacity.
+
+    All counts are slices of the shared booking matrix (services/booking_matrix.py).
+    """
+    start_time = time.perf_counter()
+    try:
+        today = date.today()
+        matrix = get_booking_matrix()
+        rows, dates, counts = matrix.window(today, today + timedelta(days=matrix.num_days), selected_branches)
+        daily_totals = counts.sum(axis=0)
+        booked_days = np.flatnonzero(daily_totals)
+
+        if len(booked_days) == 0:
+            return {
+                'has_data': False,
+                'today': 0,
+                'tomorrow': 0,
+                'next_7_days': 0,
+                'next_30_days': 0,
+                'daily_data': [],
+                'by_center': [],
+                'by_center_daily': [],
+                'over_capacity_count': 0,
+                'max_date': None
+            }
+
+        # Daily breakdown for chart — show ALL available future appointment data
+        max_future_date = dates[booked_days[-1]]
+        daily_data = [{'date': dates[i], 'count': int(daily_totals[i])} for i in booked_days]
+
+        # Daily breakdown by center type (SC vs OB) for branches in BranchMaster
+        codes = matrix.branch_codes[rows]
+        branch_types = np.array([
+            parts[1] if len(parts) >= 2 else '' for parts in (str(b or '').split('-') for b in codes)
+        ], dtype=object)
+        registered = matrix.registered[rows]
+        sc_daily = counts[registered & (branch_types == 'SC')].sum(axis=0)
+        ob_daily = counts[registered & (branch_types == 'OB')].sum(axis=0)
+        typed_days = np.flatnonzero((sc_daily > 0) | (ob_daily > 0))
+        daily_sc = [{'date': dates[i], 'count': int(sc_daily[i])} for i in typed_days]
+        daily_ob = [{'date': dates[i], 'count': int(ob_daily[i])} for i in typed_days]
+
+        # Capacity totals from BranchMaster
+        # Exclude mobile units (-MB-) from total_capacity as they operate on-demand (max 160/day)
+        # Mobile units have branch_code like ACR-MB-S-001, BKK-MB-S-001 (contains -MB-)
+        capacity_map = matrix.capacity_map
+        total_capacity = 0
+        capacity_sc = 0
+        capacity_ob = 0
+        for bcode, capacity in capacity_map.items():
+            bcode = str(bcode or '')
+            parts = bcode.split('-')
+            btype = parts[1] if len(parts) >= 2 else ''
+            if '-MB-' not in bcode.upper():
+                total_capacity += capacity
+            if btype == 'SC':
+                capacity_sc += capacity
+            elif btype == 'OB':
+                capacity_ob += capacity
+
+        # By center breakdown with capacity (top 15 centers with most appointments in next 7 days)
+        branch_map = get_branch_name_map_cached()
+        week = counts[:, :7]
+        week_totals = week.sum(axis=1)
+        top = np.argsort(-week_totals, kind='stable')[:15]
+        top = top[week_totals[top] > 0]
+        avg_daily = week_totals[top] / 7
+        avg_usage = matrix.usage_pct(rows[top], avg_daily)
+        avg_status = usage_status(avg_usage)
+
+        by_center = []
+        for i, r in enumerate(top):
+            code = codes[r]
+            usage_pct = avg_usage[i]
+            by_center.append({
+                'branch_code': code,
+                'branch_name': branch_map.get(code, code),
+                'count': int(week_totals[r]),
+                'avg_daily': round(float(avg_daily[i]), 1),
+                'capacity': capacity_map.get(code),
+                'usage_pct': round(float(usage_pct), 1) if usage_pct > 0 else None,
+                'status': str(avg_status[i])
+            })
+
+        # By center daily breakdown (for heatmap) - next 7 days
+        cell_rows, cell_days = np.nonzero(week)
+        cell_counts = week[cell_rows, cell_days]
+        cell_usage = matrix.usage_pct(rows[cell_rows], cell_counts)
+        cell_status = usage_status(cell_usage)
+
+        by_center_daily = []
+        for r, d, count, usage_pct, status in zip(cell_rows, cell_days, cell_counts, cell_usage, cell_status):
+            code = codes[r]
+            by_center_daily.append({
+                'branch_code': code,
+                'branch_name': branch_map.get(code, code),
+                'date': dates[d],
+                'count': int(count),
+                'capacity': capacity_map.get(code),
+                'usage_pct': round(float(usage_pct), 1) if usage_pct > 0 else None,
+                'status': str(status)
+            })
+
+        return {
+            'has_data': True,
+            'today': int(daily_totals[0]),
+            'tomorrow': int(daily_totals[1:2].sum()),
+            'next_7_days': int(daily_totals[:7].sum()),
+            'next_30_days': int(daily_totals[:30].sum()),
+            'daily_data': daily_data,
+            'daily_sc': daily_sc,
+            'daily_ob': daily_ob,
+            'by_center': by_center,
+            'by_center_daily': by_center_daily,
+            'over_capacity_count': int((cell_status == 'over').sum()),
+            'max_date': max_future_date,
+            'total_capacity': total_capacity,
+            'capacity_sc': capacity_sc,
+            'capacity_ob': capacity_ob,
+        }
+    finally:
+        duration = (time.perf_counter() - start_time) * 1000
+        log_perf("get_upcoming_appointments", duration)
+
+
+@stale_while_revalidate(ttl=3600)
+def get_appointment_service_stats(start_date, end_date, selected_branches=None):
+    """
+    Get appointment → check-in → card issuance funnel statistics.
+    นัดหมาย = Appointment (ทุก status ยกเว้น CANCEL, EXPIRED)
+    มา Check-in = QLog ที่มี qlog_num (มาถึงศูนย์ รับบัตรคิวแล้ว)
+    ออกบัตร = BioRecord unique appointment_id (มีการพิมพ์บัตรจริง)
+    ไม่ผ่านตู้คิว = มี BioRecord แต่ไม่มี QLog (ข้ามตู้คิว/ระบบขัดข้อง)
+    No-Show = ไม่มีทั้ง QLog และ BioRecord
+
+    Counts come from ``get_service_funnel_counts`` (same engine as By Center).
+    """
+    start_time = time.perf_counter()
+    session = get_session()
+    try:
+        # Check if we have data
+        has_appt_data = session.query(exists().where(Appointment.id.isnot(None))).scalar()
+
+        if not has_appt_data:
+            return {
+                'has_data': False,
+                'total_appointments': 0,
+                'checked_in': 0,
+                'card_issued': 0,
+                'skip_queue': 0,
+                'no_show': 0,
+                'daily_data': []
+            }
+
+        funnel = get_service_funnel_counts(
+            start_date, end_date, selected_branches, levels=('total', 'date')
+        )
+        total = funnel['total'][None]
+
+        # Daily breakdown for chart (days with appointments)
+        daily_data = [{
+            'date': dt,
+            'total_appt': row['total_appts'],
+            'checked_in': row['checked_in'],
+            'card_issued': row['bio_served'],
+            'skip_queue': row['skip_queue'],
+            'no_show': row['no_show'],
+        } for dt, row in funnel['date'].items() if row['total_appts'] > 0]
+
+        # Sort by date
+        daily_data = sorted(daily_data, key=lambda x: x['date'])
+
+        return {
+            'has_data': True,
+            'total_appointments': total['total_appts'],
+            'checked_in': total['checked_in'],
+            'card_issued': total['bio_served'],
+            'skip_queue': total['skip_queue'],
+            'no_show': total['no_show'],
+            'daily_data': daily_data
+        }
+    finally:
+        session.close()
+        duration = (time.perf_counter() - start_time) * 1000
+        log_perf(f"get_appointment_service_stats({start_date} to {end_date})", duration)
+
+
+# ============== Forecast ==============
+
+@stale_while_revalidate(ttl=3600)
+def get_checkin_data(selected_branches=None, start_date=None, end_date=None):
+    """
+    Get check-in data from QLog for comparison with appointments.
+    Returns aggregated check-in counts by branch and date.
+    """
+    session = get_session()
+    try:
+        if start_date is None:
+            start_date = date.today()
+        if end_date is None:
+            end_date = start_date + timedelta(days=29)
+
+        # Check if we have QLog data
+        has_qlog = session.query(QLog).first() is not None
+        if not has_qlog:
+            return {'has_data': False, 'by_branch': [], 'by_branch_date': []}
+
+        # Build filters
+        filters = [
+            QLog.qlog_date >= start_date,
+            QLog.qlog_date <= end_date,
+        ]
+        if selected_branches and len(selected_branches) > 0:
+            filters.append(QLog.branch_code.in_(selected_branches))
+
+        branch_map = get_branch_name_map_cached()
+
+        # By branch and by branch+date in one scan
+        tables = aggregate_grouping_sets(
+            session,
+            grouping_sets={
+                'by_branch': [QLog.branch_code],
+                'by_branch_date': [QLog.branch_code, QLog.qlog_date],
+            },
+            measures={'checkin_count': ('count', QLog.id)},
+            filters=filters,
+        )
+
+        by_branch = []
+        for r in tables['by_branch'].itertuples(index=False):
+            branch_code = _stat_value(r.branch_code, None)
+            by_branch.append({
+                'branch_code': branch_code,
+                'branch_name': branch_map.get(branch_code, branch_code),
+                'checkin_count': int(r.checkin_count)
+            })
+
+        by_branch_date = []
+        for r in tables['by_branch_date'].itertuples(index=False):
+            branch_code = _stat_value(r.branch_code, None)
+            by_branch_date.append({
+                'branch_code': branch_code,
+                'branch_name': branch_map.get(branch_code, branch_code),
+                'date': r.qlog_date,
+                'checkin_count': int(r.checkin_count)
+            })
+
+        return {
+            'has_data': True,
+            'by_branch': by_branch,
+            'by_branch_date': by_branch_date
+        }
+    finally:
+        session.close()
+
+
+def _upcoming_full_from_matrix(matrix, selected_branches, start_date, end_date):
+    """``get_upcoming_appointments_full`` result as slices of a booking matrix."""
+    today = date.today()
+    rows, dates, counts = matrix.window(start_date, end_date, selected_branches, exclude=(None, ''))
+    daily_totals = counts.sum(axis=0)
+    booked_days = np.flatnonzero(daily_totals)
+
+    if len(booked_days) == 0:
+        return {
+            'has_data': False,
+            'today': 0,
+            'tomorrow': 0,
+            'next_7_days': 0,
+            'next_30_days': 0,
+            'daily_data': [],
+            'by_center': [],
+            'by_center_daily': [],
+            'over_capacity_count': 0,
+            'warning_count': 0,
+            'max_date': None
+        }
+
+    max_future_date = dates[booked_days[-1]]
+    daily_data = [{'date': dates[i], 'count': int(daily_totals[i])} for i in booked_days]
+
+    # Exclude mobile units (-MB-) from total_capacity as they operate on-demand (max 160/day)
+    capacity_map = matrix.capacity_map
+    total_capacity = sum(c for b, c in capacity_map.items() if '-MB-' not in str(b).upper())
+
+    branch_map = get_branch_name_map_cached()
+    short_name_map = get_branch_short_name_map()
+    codes = matrix.branch_codes[rows]
+
+    # By center (all centers): total, average per day and busiest day
+    totals = counts.sum(axis=1)
+    max_daily = counts.max(axis=1, initial=0)
+    centers = np.argsort(-totals, kind='stable')
+    centers = centers[totals[centers] > 0]
+    days_in_range = (max_future_date - today).days + 1
+    avg_daily = totals[centers] / days_in_range if days_in_range > 0 else totals[centers].astype(float)
+    # Use max_daily for status calculation (more accurate for detecting over-capacity days)
+    max_usage = matrix.usage_pct(rows[centers], max_daily[centers])
+    avg_usage = matrix.usage_pct(rows[centers], avg_daily)
+    max_status = usage_status(max_usage)
+
+    by_center = []
+    for i, r in enumerate(centers):
+        code = codes[r]
+        by_center.append({
+            'branch_code': code,
+            'branch_name': short_name_map.get(code, branch_map.get(code, code)),
+            'count': int(totals[r]),
+            'avg_daily': round(float(avg_daily[i]), 1),
+            'max_daily': int(max_daily[r]),
+            'capacity': capacity_map.get(code),
+            'usage_pct': round(float(avg_usage[i]), 1) if avg_usage[i] > 0 else None,
+            'max_usage_pct': round(float(max_usage[i]), 1) if max_usage[i] > 0 else None,
+            'status': str(max_status[i])
+        })
+
+    # By center daily breakdown (for detailed view)
+    cell_rows, cell_days = np.nonzero(counts)
+    cell_counts = counts[cell_rows, cell_days]
+    cell_usage = matrix.usage_pct(rows[cell_rows], cell_counts)
+    cell_status = usage_status(cell_usage)
+
+    by_center_daily = []
+    for r, d, count, usage_pct, status in zip(cell_rows, cell_days, cell_counts, cell_usage, cell_status):
+        code = codes[r]
+        by_center_daily.append({
+            'branch_code': code,
+            'branch_name': short_name_map.get(code, branch_map.get(code, code)),
+            'date': dates[d],
+            'count': int(count),
+            'capacity': capacity_map.get(code),
+            'usage_pct': round(float(usage_pct), 1) if usage_pct > 0 else None,
+            'status': str(status)
+        })
+
+    return {
+        'has_data': True,
+        'day1': int(daily_totals[0]),
+        'day2': int(daily_totals[1:2].sum()),
+        'day7': int(daily_totals[:7].sum()),
+        'day30': int(daily_totals[:30].sum()),
+        'daily_data': daily_data,
+        'by_center': by_center,
+        'by_center_daily': by_center_daily,
+        'over_capacity_count': int((cell_status == 'over').sum()),
+        'warning_count': int((cell_status == 'warning').sum()),
+        'max_date': max_future_date,
+        'total_capacity': total_capacity,
+        'start_date': start_date,
+        'end_date': end_date
+    }
+
+
+@stale_while_revalidate(ttl=3600)
+def get_upcoming_appointments_full(selected_branches=None, start_date=None, end_date=None, include_all_status=False):
+    """
+    Get detailed appointments for workload forecasting.
+    Includes capacity comparison from BranchMaster.max_capacity.
+
+    Every count, maximum and capacity status is derived from one branch x date
+    booking matrix: the shared forward matrix for SUCCESS/WAITING views from the
+    current month on, otherwise one GROUP BY over the requested range.
+
+    Args:
+        selected_branches: tuple of branch codes to filter (None = all)
+        start_date: start date for range (default: today)
+        end_date: end date for range (default: 30 days from start)
+        include_all_status: if True, include all appointment statuses (for historical data)
+                           if False, only include SUCCESS and WAITING (for future forecast)
+    """
+    start_time = time.perf_counter()
+    try:
+        # Default to today if no start_date provided
+        if start_date is None:
+            start_date = date.today()
+        # Default to 30 days from start if no end_date provided
+        if end_date is None:
+            end_date = start_date + timedelta(days=29)
+
+        matrix = get_booking_matrix()
+        if include_all_status or not matrix.covers(start_date):
+            matrix = load_booking_matrix(
+                start_date, end_date,
+                statuses=None if include_all_status else BOOKED_STATUSES,
+                selected_branches=selected_branches,
+            )
+        return _upcoming_full_from_matrix(matrix, selected_branches, start_date, end_date)
+    finally:
+        duration = (time.perf_counter() - start_time) * 1000
+        log_perf("get_upcoming_appointments_full", duration)
+
+
+# ============== Queue Slots ==============
+
+@stale_while_revalidate(ttl=3600)
+def get_booked_slots(start_date, end_date, selected_branches=None):
+    """ดึงจำนวน appointment ที่จองแล้ว GROUP BY branch_code, appt_date."""
+    # เดือนปัจจุบันเป็นต้นไป: อ่านจาก booking matrix ที่ใช้ร่วมกับ Overview/Forecast
+    matrix = get_booking_matrix()
+    if matrix.covers(start_date):
+        rows, dates, counts = matrix.window(start_date, end_date, selected_branches, exclude=(None,))
+        cell_rows, cell_days = np.nonzero(counts)
+        codes = matrix.branch_codes[rows]
+        return {
+            (codes[r], dates[d].isoformat()): int(counts[r, d]) for r, d in zip(cell_rows, cell_days)
+        }
+
+    session = get_session()
+    try:
+        appt = get_booking_table()
+        filters = [
+            appt.appt_date >= start_date,
+            appt.appt_date <= end_date,
+            appt.appt_status.in_(['SUCCESS', 'WAITING']),
+            appt.branch_code.isnot(None),
+        ]
+        if selected_branches:
+            filters.append(appt.branch_code.in_(selected_branches))
+
+        rows = session.query(
+            appt.branch_code,
+            appt.appt_date,
+            booking_count(appt).label('booked')
+        ).filter(and_(*filters)).group_by(
+            appt.branch_code, appt.appt_date
+        ).all()
+
+        result = {}
+        for r in rows:
+            key = (r.branch_code, r.appt_date.isoformat() if r.appt_date else None)
+            result[key] = r.booked
+        return result
+    finally:
+        session.close()
+
+
+def _slot_cut_range_filters(start_date, end_date, selected_branches):
+    filters = [*slot_cut_filters(), Card.appt_date >= start_date, Card.appt_date <= end_date]
+    if selected_branches:
+        filters.append(Card.appt_branch.in_(selected_branches))
+    return filters
+
+
+@stale_while_revalidate(ttl=3600)
+def get_slot_cut_data(start_date, end_date, selected_branches=None):
+    """ดึงจำนวน slot ที่ถูกตัด — ผู้รับบริการไปออกบัตรผิดวัน/ผิดศูนย์แล้ว (รายละเอียด: get_slot_cut_details)."""
+    session = get_session()
+    try:
+        # นับ slot ที่ตัดรวม GROUP BY ศูนย์+วัน
+        agg_rows = session.query(
+            Card.appt_branch,
+            Card.appt_date,
+            func.count(func.distinct(Card.appointment_id)).label('cut_count')
+        ).filter(*_slot_cut_range_filters(start_date, end_date, selected_branches)).group_by(
+            Card.appt_branch, Card.appt_date
+        ).all()
+
+        by_branch_date = {}
+        by_branch = {}
+        total_cuts = 0
+        for r in agg_rows:
+            key = (r.appt_branch, r.appt_date.isoformat() if r.appt_date else None)
+            by_branch_date[key] = r.cut_count
+            by_branch[r.appt_branch] = by_branch.get(r.appt_branch, 0) + r.cut_count
+            total_cuts += r.cut_count
+
+        return {
+            'by_branch_date': by_branch_date,
+            'by_branch': by_branch,
+            'total_cuts': total_cuts,
+        }
+    finally:
+        session.close()
+
+
+@stale_while_revalidate(ttl=3600)
+def get_slot_cut_details(start_date, end_date, selected_branches=None):
+    """รายละเอียด slot ที่ถูกตัด สำหรับตาราง expander (โหลดเมื่อผู้ใช้เปิดดูเท่านั้น)."""
+    session = get_session()
+    try:
+        detail_rows = session.query(
+            Card.appointment_id,
+            Card.appt_branch,
+            Card.appt_date,
+            Card.branch_code,
+            Card.branch_name,
+            Card.print_date,
+            Card.serial_number,
+            Card.wrong_date,
+            Card.wrong_branch,
+        ).filter(*_slot_cut_range_filters(start_date, end_date, selected_branches)).distinct().all()
+
+        details = []
+        for r in detail_rows:
+            details.append({
+                'Appointment ID': r.appointment_id,
+                'ศูนย์นัดเดิม': r.appt_branch,
+                'วันนัดเดิม': r.appt_date.strftime('%d/%m/%Y') if r.appt_date else '-',
+                'ศูนย์ที่ไปจริง': get_branch_short_name(r.branch_code, r.branch_name),
+                'วันที่ไปจริง': r.print_date.strftime('%d/%m/%Y') if r.print_date else '-',
+                'Serial Number': r.serial_number or '-',
+                'ผิดวัน': '✓' if r.wrong_date else '',
+                'ผิดศูนย์': '✓' if r.wrong_branch else '',
+            })
+        return details
+    finally:
+        session.close()
+
+
+@stale_while_revalidate(ttl=3600)
+def get_slot_availability(start_date, end_date, selected_branches=None):
+    """จองแล้ว + ตัดแล้ว รายศูนย์/รายวัน สำหรับปฏิทิน Queue Slots.
+
+    อ่านจากตาราง slot_availability ครั้งเดียว (index slot_date, branch_code);
+    ถ้ายัง backfill ไม่เสร็จ จะคำนวณจาก get_booked_slots + get_slot_cut_data
+
+    Returns:
+        {'booked': {(branch_code, 'YYYY-MM-DD'): n},
+         'cuts': {'by_branch_date': {...}, 'by_branch': {...}, 'total_cuts': n}}
+    """
+    if not is_slot_availability_ready():
+        return {
+            'booked': get_booked_slots(start_date, end_date, selected_branches),
+            'cuts': get_slot_cut_data(start_date, end_date, selected_branches),
+        }
+
+    session = get_session()
+    try:
+        filters = [SlotAvailability.slot_date >= start_date, SlotAvailability.slot_date <= end_date]
+        if selected_branches:
+            filters.append(SlotAvailability.branch_code.in_(selected_branches))
+        rows = session.query(
+            SlotAvailability.branch_code, SlotAvailability.slot_date,
+            SlotAvailability.booked, SlotAvailability.cut
+        ).filter(*filters).all()
+
+        booked = {}
+        by_branch_date = {}
+        by_branch = {}
+        for r in rows:
+            key = (r.branch_code, r.slot_date.isoformat())
+            if r.booked:
+                booked[key] = r.booked
+            if r.cut:
+                by_branch_date[key] = r.cut
+                by_branch[r.branch_code] = by_branch.get(r.branch_code, 0) + r.cut
+        return {
+            'booked': booked,
+            'cuts': {
+                'by_branch_date': by_branch_date,
+                'by_branch': by_branch,
+                'total_cuts': sum(by_branch.values()),
+            },
+        }
+    finally:
+        session.close()
+
+
+# ============== By Center ==============
+
+# By Center breakdowns: name -> card cube dimensions (+ per day)
+_CARD_BREAKDOWNS = {
+    'center': (('branch_code', 'branch_name'), False),
+    'region': (('region',), False),
+    'center_daily': (('branch_code',), True),
+    'center_operator': (('branch_code', 'operator'), False),
+    'region_center': (('region', 'branch_code', 'branch_name'), False),
+    'region_daily': (('region',), True),
+}
+
+_CARD_BREAKDOWN_COLUMNS = [
+    'total', 'good_count', 'bad_count', 'avg_sla', 'max_sla',
+    'sla_over_count', 'wrong_branch_count', 'wrong_date_count', 'center_count',
+]
+
+
+@stale_while_revalidate(ttl=3600)
+def get_card_breakdowns_cached(start_date, end_date):
+    """All By Center card breakdowns, sliced from the in-memory card cube.
+
+    Returns:
+        {name: DataFrame} with the ``_CARD_BREAKDOWN_COLUMNS`` measures, for:
+        center (branch_code, branch_name), region (region),
+        center_daily (branch_code, print_date), center_operator (branch_code, operator),
+        region_center (region, branch_code, branch_name), region_daily (region, print_date)
+    """
+    start_time = time.perf_counter()
+    try:
+        cube = get_card_cube()
+        breakdowns = {}
+        for name, (group_by, by_day) in _CARD_BREAKDOWNS.items():
+            df = cube.aggregate(
+                start_date, end_date, group_by, by_day=by_day, count_distinct={'center_count': 'branch_code'}
+            )
+            with np.errstate(divide='ignore', invalid='ignore'):
+                df['avg_sla'] = np.where(df['sla_count'] > 0, df['sla_sum'] / df['sla_count'], np.nan)
+            keys = list(group_by) + (['print_date'] if by_day else [])
+            breakdowns[name] = df[keys + _CARD_BREAKDOWN_COLUMNS]
+        return breakdowns
+    finally:
+        duration = (time.perf_counter() - start_time) * 1000
+        log_perf(f"get_card_breakdowns_cached({start_date} to {end_date})", duration)
+
+
+def get_center_stats_cached(start_date, end_date):
+    """Center statistics, derived from ``get_card_breakdowns_cached``."""
+    df = get_card_breakdowns_cached(start_date, end_date)['center']
+    df = df[df['branch_code'].notna()].sort_values('total', ascending=False, kind='stable')
+    return [SimpleNamespace(
+        branch_code=r.branch_code,
+        branch_name=_stat_value(r.branch_name, None),
+        total=int(r.total),
+        good_count=int(_stat_value(r.good_count)),
+        bad_count=int(_stat_value(r.bad_count)),
+        avg_sla=float(_stat_value(r.avg_sla, 0.0)),
+        max_sla=float(_stat_value(r.max_sla, 0.0)),
+        sla_over_count=int(_stat_value(r.sla_over_count)),
+        wrong_branch_count=int(_stat_value(r.wrong_branch_count)),
+        wrong_date_count=int(_stat_value(r.wrong_date_count)),
+    ) for r in df.itertuples(index=False)]
+
+
+def get_region_stats_cached(start_date, end_date):
+    """Region statistics, derived from ``get_card_breakdowns_cached``."""
+    df = get_card_breakdowns_cached(start_date, end_date)['region']
+    df = df[df['region'].notna() & (df['region'] != '')].sort_values('total', ascending=False, kind='stable')
+    return [SimpleNamespace(
+        region=r.region,
+        total=int(r.total),
+        good_count=int(_stat_value(r.good_count)),
+        bad_count=int(_stat_value(r.bad_count)),
+        avg_sla=float(_stat_value(r.avg_sla, 0.0)),
+        max_sla=float(_stat_value(r.max_sla, 0.0)),
+        sla_over_count=int(_stat_value(r.sla_over_count)),
+        wrong_branch_count=int(_stat_value(r.wrong_branch_count)),
+        wrong_date_count=int(_stat_value(r.wrong_date_count)),
+        center_count=int(_stat_value(r.center_count)),
+    ) for r in df.itertuples(index=False)]
+
+
+@stale_while_revalidate(ttl=3600)
+def get_service_funnel_by_branch_cached(start_date, end_date):
+    """Get appointment service funnel (appointments, check-in, skip_queue, no_show) per branch."""
+    start_time = time.perf_counter()
+    try:
+        by_branch = get_service_funnel_counts(start_date, end_date, levels=('branch',))['branch']
+        if not any(row['total_appts'] for row in by_branch.values()):
+            return {}
+        return by_branch
+    finally:
+        duration = (time.perf_counter() - start_time) * 1000
+        log_perf(f"get_service_funnel_by_branch_cached({start_date} to {end_date})", duration)
+
+
+# ============== Anomaly ==============
+
+def get_anomaly_summary_from_snapshot(start_date, end_date):
+    """Anomaly page summary counts from the analytics snapshot of ``cards``.
+
+    Blank appointment / card IDs are left out, as in ``anomalies``.
+
+    Returns:
+        The Anomaly page summary dict, or None when the snapshot is not
+        available (the page then queries the database).
+    """
+    df = scan_snapshot(
+        'cards',
+        ['appointment_id', 'card_id', 'branch_code', 'print_status', 'wrong_date', 'wrong_branch'],
+        [('print_date', '>=', start_date), ('print_date', '<=', end_date)],
+    )
+    if df is None:
+        return None
+
+    good = df[df['print_status'] == 'G']
+    good_appt_ids = good['appointment_id'][good['appointment_id'].notna() & (good['appointment_id'] != '')]
+    good_card_ids = good['card_id'][good['card_id'].notna() & (good['card_id'] != '')]
+    return {
+        'appt_g_more_than_1': int((good_appt_ids.value_counts() > 1).sum()),
+        'card_id_g_more_than_1': int((good_card_ids.value_counts() > 1).sum()),
+        'wrong_date_count': int((df['wrong_date'] == True).sum()),
+        'wrong_branch_count': int((df['wrong_branch'] == True).sum()),
+        'branch_list': sorted(df['branch_code'].dropna().unique().tolist()),
+    }
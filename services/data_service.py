@@ -2,12 +2,22 @@
 import pandas as pd
 from datetime import date, datetime
 from typing import List, Optional, Dict, Any
-from sqlalchemy import func, and_, or_, desc
+from sqlalchemy import func, and_, desc, text, table, column, literal, select, tuple_, union_all
 from sqlalchemy.orm import Session
 
 from database.connection import session_scope, get_session
 from database.models import Report, Card, BadCard, CenterStat, AnomalySLA, WrongCenter, CompleteDiff, DeliveryCard
+from services.anomaly_index_service import get_report_anomaly_scope
+from services.canonical_card_service import get_upload_serials
 from services.excel_parser import ExcelParser
+from services.slot_availability_service import get_report_slot_dates
+from services.identity_index_service import IDENTITY_SOURCES
+from services.search_index import identifier_search_plan, NUMERIC_ID_LENGTH
+
+# Temporary table holding the identifiers of a bulk lookup (per connection)
+BULK_LOOKUP_TABLE = 'bulk_lookup_ids'
+# Tables searched by bulk lookup (identifier columns from IDENTITY_SOURCES)
+BULK_LOOKUP_SOURCES = ('cards', 'bio_records', 'card_delivery_records', 'appointments')
 
 
 class DataService:
@@ -144,8 +154,17 @@ class DataService:
         with session_scope() as session:
             # Check if report already exists — use bulk SQL DELETE (not ORM cascade)
             existing = session.query(Report).filter(Report.filename == filename).first()
+            replaced_report_id = None
+            replaced_anomaly_scope = None
+            replaced_card_serials = None
+            replaced_slot_dates = None
             if existing:
                 old_id = existing.id
+                replaced_report_id = old_id
+                # Anomaly keys/dates, serials and slot dates of the replaced cards (refreshed with the new report's)
+                replaced_anomaly_scope = get_report_anomaly_scope(session, old_id)
+                replaced_card_serials = get_upload_serials(session, 'unified', old_id)
+                replaced_slot_dates = get_report_slot_dates(session, old_id)
                 # Bulk delete child tables first (fast SQL vs slow ORM cascade)
                 for child_model in [DeliveryCard, AnomalySLA, WrongCenter, CompleteDiff, CenterStat, BadCard, Card]:
                     session.query(child_model).filter(child_model.report_id == old_id).delete(synchronize_session=False)
@@ -402,6 +421,10 @@ class DataService:
                 'total_good': total_good,
                 'total_bad': total_bad,
                 'data_source': data_source,
+                'replaced_report_id': replaced_report_id,
+                'replaced_anomaly_scope': replaced_anomaly_scope,
+                'replaced_card_serials': replaced_card_serials,
+                'replaced_slot_dates': replaced_slot_dates,
             }
 
     @staticmethod
@@ -425,19 +448,12 @@ class DataService:
         print_status: str = None,
         limit: int = 1000
     ) -> List[Card]:
-        """Search cards with various filters."""
-        query = session.query(Card)
+        """Search cards with various filters.
 
-        if search_term:
-            search_pattern = f"%{search_term}%"
-            query = query.filter(
-                or_(
-                    Card.appointment_id.ilike(search_pattern),
-                    Card.card_id.ilike(search_pattern),
-                    Card.serial_number.ilike(search_pattern),
-                    Card.work_permit_no.ilike(search_pattern),
-                )
-            )
+        The search term is classified first (``identifier_search_plan``):
+        complete IDs are index lookups, substring search is the last resort.
+        """
+        query = session.query(Card)
 
         if branch_code:
             query = query.filter(Card.branch_code == branch_code)
@@ -451,7 +467,149 @@ class DataService:
         if print_status:
             query = query.filter(Card.print_status == print_status)
 
-        return query.order_by(desc(Card.print_date)).limit(limit).all()
+        if not search_term:
+            return query.order_by(desc(Card.print_date)).limit(limit).all()
+
+        results = []
+        for condition in identifier_search_plan(Card, search_term):
+            results = query.filter(condition).order_by(desc(Card.print_date)).limit(limit).all()
+            if results:
+                break
+        return results
+
+    @staticmethod
+    def fetch_cards_page(session: Session, filters: list, columns: list, page_size: int, after: tuple = None):
+        """One page of cards, newest first, by keyset on (print_date, id).
+
+        Only ``columns`` are selected (rows are tuples, not ORM objects) and
+        the page starts right after the ``after`` cursor instead of at an
+        OFFSET, so every page costs the same (index ``ix_cards_date_id``).
+
+        Args:
+            filters: Filter expressions on Card.
+            columns: Card columns to select; must include ``Card.print_date`` and ``Card.id``.
+            page_size: Rows per page.
+            after: ``(print_date, id)`` of the last row of the previous page (None = first page).
+
+        Returns:
+            (rows, next_cursor) - ``next_cursor`` is None on the last page.
+        """
+        query = session.query(*columns).filter(*filters)
+        if after is not None:
+            query = query.filter(tuple_(Card.print_date, Card.id) < tuple_(*after))
+        rows = query.order_by(Card.print_date.desc(), Card.id.desc()).limit(page_size + 1).all()
+        if len(rows) <= page_size:
+            return rows, None
+        rows = rows[:page_size]
+        return rows, (rows[-1].print_date, rows[-1].id)
+
+    @staticmethod
+    def iter_cards(session: Session, filters: list, columns: list, chunk_size: int = 5000):
+        """All matching cards (same order as ``fetch_cards_page``) through a server-side cursor.
+
+        Yields:
+            Lists of up to ``chunk_size`` row tuples - memory stays at one chunk.
+        """
+        stmt = select(*columns).where(*filters).order_by(Card.print_date.desc(), Card.id.desc())
+        result = session.execute(stmt, execution_options={'stream_results': True, 'yield_per': chunk_size})
+        for rows in result.partitions():
+            yield rows
+
+    @staticmethod
+    def normalize_identifiers(values) -> List[str]:
+        """Clean a pasted / uploaded identifier list: strip, drop blanks and duplicates (order kept).
+
+        A trailing ``.0`` of a spreadsheet number is removed; leading zeros
+        are matched by ``bulk_lookup_identifiers`` (``identifier_lookup_keys``).
+        """
+        identifiers = []
+        for value in values:
+            if value is None or pd.isna(value):
+                continue
+            value = str(value).strip()
+            if value.endswith('.0') and value[:-2].isdigit():
+                value = value[:-2]
+            if value:
+                identifiers.append(value)
+        return list(dict.fromkeys(identifiers))
+
+    @staticmethod
+    def identifier_lookup_keys(identifier: str) -> List[str]:
+        """Values an identifier is stored as: as typed, and zero-padded to 13 if digit-only and shorter.
+
+        ExcelParser stores card IDs, serials and work permits of Bio Unified
+        Reports zero-padded (spreadsheets drop the zeros), while the bio,
+        card delivery and appointment imports keep them as in the file.
+        """
+        if identifier.isdigit() and len(identifier) < NUMERIC_ID_LENGTH:
+            return [identifier, identifier.zfill(NUMERIC_ID_LENGTH)]
+        return [identifier]
+
+    @staticmethod
+    def bulk_lookup_identifiers(session: Session, identifiers: List[str], chunk_size: int = 2000):
+        """Look up many identifiers in cards, bio_records, card_delivery_records and appointments.
+
+        The identifiers, under each of their ``identifier_lookup_keys``, are
+        loaded into a temporary table (COPY on PostgreSQL) and joined
+        against every identifier column of the four tables in one UNION ALL
+        statement, so the cost does not grow with one query per ID.
+
+        Yields:
+            DataFrames of up to ``chunk_size`` rows, in input order:
+            seq, identifier, found, source, id_type, row_id,
+            event_date, branch_code, status. A missing identifier is one row
+            with ``found`` False and no source.
+        """
+        identifiers = DataService.normalize_identifiers(identifiers)
+        if not identifiers:
+            return
+
+        session.execute(text(f"DROP TABLE IF EXISTS {BULK_LOOKUP_TABLE}"))
+        session.execute(text(
+            f"CREATE TEMPORARY TABLE {BULK_LOOKUP_TABLE} "
+            f"(seq INTEGER NOT NULL, identifier VARCHAR(50) NOT NULL, lookup_key VARCHAR(50) NOT NULL)"
+        ))
+        try:
+            session.execute(text(f"CREATE INDEX ix_{BULK_LOOKUP_TABLE}_lookup_key ON {BULK_LOOKUP_TABLE} (lookup_key)"))
+            DataService._copy_df_to_table(
+                session, BULK_LOOKUP_TABLE,
+                pd.DataFrame([
+                    {'seq': seq, 'identifier': identifier, 'lookup_key': key}
+                    for seq, identifier in enumerate(identifiers)
+                    for key in DataService.identifier_lookup_keys(identifier)
+                ]),
+                ['seq', 'identifier', 'lookup_key'],
+            )
+
+            keys = table(BULK_LOOKUP_TABLE, column('seq'), column('identifier'), column('lookup_key'))
+            # One row per input identifier (its as-typed key)
+            ids = select(keys.c.seq, keys.c.identifier).where(keys.c.lookup_key == keys.c.identifier).subquery()
+            matches = union_all(*[
+                select(
+                    keys.c.seq, literal(source).label('source'), literal(id_type).label('id_type'),
+                    model.id.label('row_id'), date_col.label('event_date'),
+                    branch_col.label('branch_code'), status_col.label('status'),
+                ).select_from(keys.join(model, id_col == keys.c.lookup_key))
+                for source in BULK_LOOKUP_SOURCES
+                for model, _, date_col, branch_col, status_col, id_columns in [IDENTITY_SOURCES[source]]
+                for id_type, id_col in id_columns.items()
+            ]).subquery()
+            stmt = select(
+                ids.c.seq, ids.c.identifier, matches.c.source.isnot(None).label('found'),
+                matches.c.source, matches.c.id_type, matches.c.row_id,
+                matches.c.event_date, matches.c.branch_code, matches.c.status,
+            ).select_from(
+                ids.outerjoin(matches, matches.c.seq == ids.c.seq)
+            ).order_by(ids.c.seq, matches.c.source, matches.c.row_id)
+
+            result = session.execute(stmt, execution_options={'yield_per': chunk_size})
+            columns = list(result.keys())
+            for rows in result.partitions():
+                chunk = pd.DataFrame(rows, columns=columns)
+                chunk['found'] = chunk['found'].astype(bool)
+                yield chunk
+        finally:
+            session.execute(text(f"DROP TABLE IF EXISTS {BULK_LOOKUP_TABLE}"))
 
     @staticmethod
     def get_overview_stats(
@@ -0,0 +1,309 @@
+"""Streaming CSV / XLSX exports with bounded memory.
+
+Exports used to build a full DataFrame and write it into a ``BytesIO``
+(``df.to_excel`` / ``df.to_csv().encode()``), holding the whole file in
+memory, usually twice. Here rows are written chunk by chunk into a
+``SpooledTemporaryFile`` (memory up to ``EXPORT_SPOOL_MAX_BYTES``, then a
+temp file on disk):
+
+- CSV: each chunk is encoded as UTF-8 with BOM (Excel opens Thai text
+  correctly), header on the first chunk only.
+- XLSX: xlsxwriter ``constant_memory`` mode flushes every row as soon as
+  the next one starts, so a sheet of any length costs one row of memory.
+
+Chunks come from any iterable of DataFrames - typically ``query_chunks``,
+which reads a query through a server-side cursor (``yield_per``).
+
+Heavy workbooks are built on request in a background thread
+(``request_export``) and kept per (export type, filters, data version) as
+temp files on disk, so page reruns never rebuild them and repeated
+downloads of the same view read the built file; the process keeps only
+their paths.
+"""
+import atexit
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from utils.logger import log_error, log_perf
+from utils.query_cache import get_data_version
+
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIME = "text/csv"
+
+# Finished export files kept on disk (least recently used evicted first)
+EXPORT_JOB_MAX_ENTRIES = 16
+EXPORT_JOB_MAX_BYTES = 256 * 1024 * 1024
+
+
+def query_chunks(session, stmt, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Rows of a Core ``select`` as DataFrames of up to ``chunk_size`` rows (server-side cursor).
+
+    Column names are the statement's labels.
+    """
+    result = session.execute(stmt, execution_options={'stream_results': True, 'yield_per': chunk_size})
+    columns = list(result.keys())
+    for rows in result.partitions():
+        yield pd.DataFrame(rows, columns=columns)
+
+
+def _as_chunks(data):
+    """A DataFrame or an iterable of DataFrames -> iterable of DataFrames."""
+    return [data] if isinstance(data, pd.DataFrame) else data
+
+
+def csv_export(data):
+    """Write a DataFrame / DataFrame chunks to a spooled CSV file (UTF-8 with BOM).
+
+    Returns:
+        SpooledTemporaryFile positioned at 0.
+    """
+    start_time = time.perf_counter()
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    out.write('\ufeff'.encode('utf-8'))
+    header = True
+    rows = 0
+    for chunk in _as_chunks(data):
+        out.write(chunk.to_csv(index=False, header=header).encode('utf-8'))
+        header = False
+        rows += len(chunk)
+    out.seek(0)
+    log_perf(f"csv_export({rows:,} rows)", (time.perf_counter() - start_time) * 1000)
+    return out
+
+
+def _cell(value):
+    """Python value xlsxwriter can write (None = blank cell)."""
+    if value is None or value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    return value
+
+
+def xlsx_export(sheets):
+    """Write sheets to a spooled XLSX file in xlsxwriter ``constant_memory`` mode.
+
+    Args:
+        sheets: ``{sheet name: DataFrame or iterable of DataFrame chunks}``
+            (or a list of (name, data) pairs), written in order. Every
+            chunk of a sheet must have the same columns; a sheet whose
+            data yields no chunk is skipped.
+
+    Returns:
+        SpooledTemporaryFile positioned at 0.
+    """
+    start_time = time.perf_counter()
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    workbook = xlsxwriter.Workbook(out, {
+        'constant_memory': True,
+        # Cell text as-is (IDs must not turn into numbers, formulas or links)
+        'strings_to_numbers': False,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+        'nan_inf_to_errors': True,
+    })
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+
+    rows = 0
+    items = sheets.items() if isinstance(sheets, dict) else sheets
+    for name, data in items:
+        worksheet = None
+        row = 0
+        for chunk in _as_chunks(data):
+            if worksheet is None:
+                worksheet = workbook.add_worksheet(name[:31])
+                for col, label in enumerate(chunk.columns):
+                    worksheet.write_string(0, col, str(label), header_format)
+                row = 1
+            for record in chunk.itertuples(index=False, name=None):
+                for col, value in enumerate(record):
+                    value = _cell(value)
+                    if value is None:
+                        continue
+                    if isinstance(value, datetime):
+                        worksheet.write_datetime(row, col, value, datetime_format)
+                    elif isinstance(value, date):
+                        worksheet.write_datetime(row, col, value, date_format)
+                    else:
+                        worksheet.write(row, col, value)
+                row += 1
+            rows += len(chunk)
+    if not workbook.worksheets():
+        workbook.add_worksheet()
+    workbook.close()
+    out.seek(0)
+    log_perf(f"xlsx_export({rows:,} rows)", (time.perf_counter() - start_time) * 1000)
+    return out
+
+
+def read_export(export) -> bytes:
+    """Contents of a finished export (for ``st.download_button``), closing the temp file."""
+    try:
+        export.seek(0)
+        return export.read()
+    finally:
+        export.close()
+
+
+# ============== Background export jobs ==============
+
+class ExportJob:
+    """An export file being built (or built) in a background thread."""
+
+    __slots__ = ('status', 'path', 'size', 'error', 'finished', 'built_at')
+
+    def __init__(self):
+        self.status = 'running'  # 'running' | 'ready' | 'failed'
+        self.path = None
+        self.size = 0
+        self.error = None
+        self.finished = threading.Event()
+        self.built_at = None
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the file is built or failed (True) or the timeout passes (False)."""
+        return self.finished.wait(timeout)
+
+    def read(self):
+        """Contents of the built file, or None if it is not built or was evicted meanwhile."""
+        if self.path is None:
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+
+# (export type, params, data version) -> ExportJob, most recently used last
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+# Built files of this process (removed on eviction and at exit)
+_jobs_dir = None
+
+
+def _store_export(export, export_type: str) -> str:
+    """Move a finished export file into the jobs directory. Returns its path."""
+    global _jobs_dir
+    with _jobs_lock:
+        if _jobs_dir is None:
+            _jobs_dir = tempfile.mkdtemp(prefix='bio-exports-')
+            atexit.register(shutil.rmtree, _jobs_dir, True)
+    fd, path = tempfile.mkstemp(prefix=f'{export_type}-', dir=_jobs_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            export.seek(0)
+            shutil.copyfileobj(export, f)
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        export.close()
+    return path
+
+
+def _remove_job_file(job: ExportJob):
+    if job.path is not None:
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+
+def _evict_jobs(version: int):
+    """Drop finished jobs of older data versions, then the least recently used beyond the limits.
+
+    Running jobs are never evicted. Caller must hold ``_jobs_lock``.
+    """
+    for key in [k for k, job in _jobs.items() if k[2] != version and job.status != 'running']:
+        _remove_job_file(_jobs.pop(key))
+    total_bytes = sum(job.size for job in _jobs.values())
+    for key in list(_jobs):
+        if len(_jobs) <= EXPORT_JOB_MAX_ENTRIES and total_bytes <= EXPORT_JOB_MAX_BYTES:
+            break
+        job = _jobs[key]
+        if job.status == 'running':
+            continue
+        total_bytes -= job.size
+        _remove_job_file(_jobs.pop(key))
+
+
+def get_export_job(export_type: str, params: tuple):
+    """The job for this export at the current data version, or None if it was never requested."""
+    key = (export_type, params, get_data_version())
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is not None:
+            _jobs.move_to_end(key)
+        return job
+
+
+def request_export(export_type: str, params: tuple, build) -> ExportJob:
+    """Start building an export in a background thread unless it is already built or running.
+
+    Args:
+        export_type: Name of the export (cache namespace and logs).
+        params: Hashable filters the file depends on (dates, branch, sort ...).
+            The current data version is added to the key, so an import
+            never serves an old file.
+        build: Callable returning an export file (``xlsx_export`` /
+            ``csv_export`` result). It runs in another thread: it must open
+            its own database session and not touch Streamlit.
+
+    Returns:
+        The (new or existing) ExportJob. A failed job, or one whose file
+        is gone, is rebuilt.
+    """
+    version = get_data_version()
+    key = (export_type, params, version)
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is not None and job.status == 'running':
+            _jobs.move_to_end(key)
+            return job
+        if job is not None and job.status == 'ready' and os.path.exists(job.path):
+            _jobs.move_to_end(key)
+            return job
+        job = ExportJob()
+        _jobs[key] = job
+        _jobs.move_to_end(key)
+
+    def _run():
+        start_time = time.perf_counter()
+        try:
+            path = _store_export(build(), export_type)
+            with _jobs_lock:
+                job.path = path
+                job.size = os.path.getsize(path)
+                job.built_at = time.time()
+                job.status = 'ready'
+                _evict_jobs(version)
+            log_perf(f"export {export_type} (background, {job.size:,} bytes)", (time.perf_counter() - start_time) * 1000)
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            log_error(f"export {export_type} failed: {e}")
+        finally:
+            job.finished.set()
+
+    threading.Thread(target=_run, name=f"export-{export_type}", daemon=True).start()
+    return job
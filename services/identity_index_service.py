@@ -0,0 +1,234 @@
+"""Maintenance and lookup of the identity_index table (cross-source timeline).
+
+``identity_index`` maps every serial number, card ID (``alien_card_id`` in
+card delivery), work permit and appointment ID to the rows that mention it
+in the eight source tables. Entries are written per upload with one
+``INSERT ... SELECT`` per identifier column, and removed by
+(source, upload_id) when the upload is deleted, so the Upload page keeps
+the index current.
+
+``get_identity_timeline`` answers "what happened to this card / person"
+with one indexed lookup. The first full build runs in a background thread;
+until it has finished the timeline is read from the source tables directly.
+"""
+import threading
+import time
+
+from sqlalchemy import func, insert, literal, null, or_, select
+
+from database.connection import get_session
+from database.models import (
+    Report, Card, BadCard, AnomalySLA, WrongCenter,
+    AppointmentUpload, Appointment, QLogUpload, QLog, BioUpload, BioRecord,
+    CardDeliveryUpload, CardDeliveryRecord, IdentityIndex,
+)
+from services.journey_service import is_derived_table_ready, set_derived_table_ready
+from utils.logger import log_info, log_error, log_perf
+
+IDENTITY_READY_KEY = 'identity_index_ready'
+
+# source table -> (model, upload column, event date, branch, status, {id_type: identifier column})
+IDENTITY_SOURCES = {
+    'cards': (
+        Card, Card.report_id, Card.print_date, Card.branch_code, Card.print_status,
+        {'appointment': Card.appointment_id, 'card_id': Card.card_id,
+         'serial': Card.serial_number, 'work_permit': Card.work_permit_no},
+    ),
+    'bad_cards': (
+        BadCard, BadCard.report_id, BadCard.print_date, BadCard.branch_code, literal('B'),
+        {'appointment': BadCard.appointment_id, 'card_id': BadCard.card_id, 'serial': BadCard.serial_number},
+    ),
+    'anomaly_sla': (
+        AnomalySLA, AnomalySLA.report_id, AnomalySLA.print_date, AnomalySLA.branch_code, null(),
+        {'appointment': AnomalySLA.appointment_id, 'serial': AnomalySLA.serial_number},
+    ),
+    'wrong_centers': (
+        WrongCenter, WrongCenter.report_id, WrongCenter.print_date, WrongCenter.actual_branch, WrongCenter.status,
+        {'appointment': WrongCenter.appointment_id, 'serial': WrongCenter.serial_number},
+    ),
+    'bio_records': (
+        BioRecord, BioRecord.upload_id, BioRecord.print_date, BioRecord.branch_code, BioRecord.print_status,
+        {'appointment': BioRecord.appointment_id, 'card_id': BioRecord.card_id,
+         'serial': BioRecord.serial_number, 'work_permit': BioRecord.work_permit_no},
+    ),
+    'card_delivery_records': (
+        CardDeliveryRecord, CardDeliveryRecord.upload_id, func.date(CardDeliveryRecord.create_date),
+        CardDeliveryRecord.branch_code, CardDeliveryRecord.print_status,
+        {'appointment': CardDeliveryRecord.appointment_id, 'card_id': CardDeliveryRecord.alien_card_id,
+         'serial': CardDeliveryRecord.serial_number},
+    ),
+    'appointments': (
+        Appointment, Appointment.upload_id, Appointment.appt_date, Appointment.branch_code, Appointment.appt_status,
+        {'appointment': Appointment.appointment_id, 'card_id': Appointment.card_id,
+         'work_permit': Appointment.work_permit_no},
+    ),
+    'qlogs': (
+        QLog, QLog.upload_id, QLog.qlog_date, QLog.branch_code, QLog.qlog_status,
+        {'appointment': QLog.appointment_code},
+    ),
+}
+
+# Upload page source -> (upload model, source tables)
+IDENTITY_UPLOAD_SOURCES = {
+    'unified': (Report, ('cards', 'bad_cards', 'anomaly_sla', 'wrong_centers')),
+    'bio': (BioUpload, ('bio_records',)),
+    'card_delivery': (CardDeliveryUpload, ('card_delivery_records',)),
+    'appointment': (AppointmentUpload, ('appointments',)),
+    'qlog': (QLogUpload, ('qlogs',)),
+}
+
+_backfill_lock = threading.Lock()
+
+
+def _index_source_upload(session, source: str, upload_id: int):
+    """Replace the entries of one upload in one source table (one INSERT ... SELECT per identifier column)."""
+    model, upload_col, date_col, branch_col, status_col, id_columns = IDENTITY_SOURCES[source]
+    session.query(IdentityIndex).filter(
+        IdentityIndex.source == source, IdentityIndex.upload_id == upload_id
+    ).delete(synchronize_session=False)
+    for id_type, id_col in id_columns.items():
+        session.execute(insert(IdentityIndex).from_select(
+            ['identifier', 'id_type', 'source', 'row_id', 'upload_id', 'event_date', 'branch_code', 'status'],
+            select(
+                id_col, literal(id_type), literal(source), model.id, upload_col, date_col, branch_col, status_col,
+            ).where(upload_col == upload_id, id_col.isnot(None), id_col != ''),
+        ))
+
+
+def index_upload_identities(upload_source: str, upload_id: int):
+    """(Re)index one imported upload of an Upload page source (unified: report id)."""
+    if upload_source not in IDENTITY_UPLOAD_SOURCES:
+        return
+    start_time = time.perf_counter()
+    session = get_session()
+    try:
+        for source in IDENTITY_UPLOAD_SOURCES[upload_source][1]:
+            _index_source_upload(session, source, upload_id)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        log_perf(f"index_upload_identities({upload_source} #{upload_id})", (time.perf_counter() - start_time) * 1000)
+
+
+def remove_upload_identities(upload_source: str, upload_id: int):
+    """Drop the entries of a deleted upload."""
+    if upload_source not in IDENTITY_UPLOAD_SOURCES:
+        return
+    session = get_session()
+    try:
+        session.query(IdentityIndex).filter(
+            IdentityIndex.source.in_(IDENTITY_UPLOAD_SOURCES[upload_source][1]),
+            IdentityIndex.upload_id == upload_id,
+        ).delete(synchronize_session=False)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+# ============== Lookup ==============
+
+def _timeline_from_sources(session, identifiers: list) -> list:
+    """Same rows as the index, read from the source tables (before the backfill has finished)."""
+    rows = []
+    for source, (model, upload_col, date_col, branch_col, status_col, id_columns) in IDENTITY_SOURCES.items():
+        for id_type, id_col in id_columns.items():
+            rows.extend(
+                (r[0], id_type, source, r[1], r[2], r[3], r[4])
+                for r in session.query(
+                    id_col, model.id, date_col, branch_col, status_col
+                ).filter(id_col.in_(identifiers))
+            )
+    return rows
+
+
+def get_identity_timeline(identifier: str) -> list:
+    """Every source row mentioning ``identifier`` (any identifier type), oldest first.
+
+    Returns:
+        List of dicts: identifier, id_type, source, row_id, event_date, branch_code, status.
+    """
+    value = (identifier or '').strip()
+    if not value:
+        return []
+    identifiers = sorted({value, value.upper()})
+
+    start_time = time.perf_counter()
+    session = get_session()
+    try:
+        if is_identity_index_ready():
+            rows = session.query(
+                IdentityIndex.identifier, IdentityIndex.id_type, IdentityIndex.source, IdentityIndex.row_id,
+                IdentityIndex.event_date, IdentityIndex.branch_code, IdentityIndex.status,
+            ).filter(IdentityIndex.identifier.in_(identifiers)).all()
+        else:
+            rows = _timeline_from_sources(session, identifiers)
+    finally:
+        session.close()
+        log_perf(f"get_identity_timeline({value})", (time.perf_counter() - start_time) * 1000)
+
+    timeline = [{
+        'identifier': r[0], 'id_type': r[1], 'source': r[2], 'row_id': r[3],
+        'event_date': r[4], 'branch_code': r[5], 'status': r[6],
+    } for r in rows]
+    timeline.sort(key=lambda e: (e['event_date'] is None, str(e['event_date'] or ''), e['source'], e['row_id']))
+    return timeline
+
+
+# ============== Backfill ==============
+
+def is_identity_index_ready() -> bool:
+    """True once the full backfill has completed (upload hooks keep it current)."""
+    return is_derived_table_ready(IDENTITY_READY_KEY)
+
+
+def rebuild_identity_index() -> int:
+    """Full rebuild, one upload at a time (blocking). Returns the number of uploads indexed."""
+    if not _backfill_lock.acquire(blocking=False):
+        log_info("[IDENTITY] rebuild skipped: already running")
+        return 0
+    try:
+        session = get_session()
+        try:
+            uploads = {
+                upload_source: [r[0] for r in session.query(upload_model.id)]
+                for upload_source, (upload_model, _) in IDENTITY_UPLOAD_SOURCES.items()
+            }
+            # Entries of uploads deleted before the index existed
+            session.query(IdentityIndex).filter(or_(*[
+                IdentityIndex.source.in_(sources) & IdentityIndex.upload_id.notin_(uploads[upload_source])
+                for upload_source, (_, sources) in IDENTITY_UPLOAD_SOURCES.items()
+            ])).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
+        indexed = 0
+        for upload_source, upload_ids in uploads.items():
+            for upload_id in upload_ids:
+                index_upload_identities(upload_source, upload_id)
+                indexed += 1
+        set_derived_table_ready(IDENTITY_READY_KEY, True)
+        log_info(f"[IDENTITY] full rebuild: {indexed:,} uploads")
+        return indexed
+    finally:
+        _backfill_lock.release()
+
+
+def start_identity_index_backfill():
+    """Run the full rebuild in a daemon thread if it has never completed."""
+    if is_identity_index_ready():
+        return
+
+    def _run():
+        try:
+            rebuild_identity_index()
+        except Exception as e:
+            log_error(f"[IDENTITY] backfill failed: {e}")
+
+    threading.Thread(target=_run, name="identity-index-backfill", daemon=True).start()
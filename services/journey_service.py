@@ -0,0 +1,301 @@
+"""Maintenance of the appointment_journey fact table.
+
+``appointment_journey`` holds one row per appointment_id with the latest
+booking, first queue check-in, card printing and card delivery outcome,
+plus the derived funnel state. It is refreshed incrementally: after an
+upload or delete only the appointment_ids touched by that file are
+recomputed from the four source tables.
+
+The first full build (backfill) runs in a background thread; until it has
+finished, ``is_journey_ready()`` is False and funnel queries read the same
+rows computed from the source tables (``journey_from_sources``), so the
+funnel does not change when the flag flips.
+"""
+import threading
+import time
+
+from sqlalchemy import func, select, union
+
+from database.connection import get_session
+from database.models import (
+    Appointment, QLog, BioRecord, CardDeliveryRecord, AppointmentJourney, SystemSetting,
+)
+from utils.logger import log_info, log_error, log_perf
+from utils.timezone import now_th
+
+JOURNEY_READY_KEY = 'appointment_journey_ready'
+
+# appointment_ids per refresh batch (one IN list per source query)
+ID_CHUNK_SIZE = 5000
+
+# upload source -> (model, appointment id column)
+JOURNEY_SOURCES = {
+    'appointment': (Appointment, Appointment.appointment_id),
+    'qlog': (QLog, QLog.appointment_code),
+    'bio': (BioRecord, BioRecord.appointment_id),
+    'card_delivery': (CardDeliveryRecord, CardDeliveryRecord.appointment_id),
+}
+
+# Source row that stands for an appointment in its journey, shared by
+# _build_journeys and journey_from_sources so both count the same thing:
+# latest booking version, first check-in, first print (undated rows last)
+BOOKING_ORDER = (Appointment.id.desc(),)
+CHECKIN_ORDER = (QLog.qlog_date.asc().nulls_last(), QLog.qlog_time_in.asc().nulls_last(), QLog.id.asc())
+PRINT_ORDER = (BioRecord.print_date.asc().nulls_last(), BioRecord.id.asc())
+
+_backfill_lock = threading.Lock()
+# key -> ready flag read from system_settings (a flag only ever changes through set_derived_table_ready)
+_ready_flags = {}
+_ready_lock = threading.Lock()
+
+
+def derive_funnel_state(appt_status, has_checkin, has_print):
+    """Funnel state of one appointment (same rules as the service funnel)."""
+    if appt_status in ('CANCEL', 'EXPIRED'):
+        return 'cancelled'
+    if has_checkin:
+        return 'served' if has_print else 'checked_in'
+    if has_print:
+        return 'skip_queue'
+    return 'no_show'
+
+
+def get_upload_appointment_ids(session, source: str, upload_id: int) -> list:
+    """Distinct appointment_ids contained in one upload of ``source``."""
+    model, id_col = JOURNEY_SOURCES[source]
+    rows = session.query(id_col).filter(
+        model.upload_id == upload_id,
+        id_col.isnot(None), id_col != ''
+    ).distinct().all()
+    return [r[0] for r in rows]
+
+
+def _first_rows(id_col, order_by, columns, *filters):
+    """One row per appointment id: the first by ``order_by`` (subquery of ``columns``)."""
+    ranked = select(
+        id_col.label('appointment_id'), *columns,
+        func.row_number().over(partition_by=id_col, order_by=order_by).label('rn'),
+    ).where(id_col.isnot(None), id_col != '', *filters).subquery()
+    return select(*[c for c in ranked.c if c.key != 'rn']).where(ranked.c.rn == 1).subquery()
+
+
+def journey_booking_rows(*filters):
+    """Latest booking version per appointment: appt_date, branch_code, appt_status."""
+    return _first_rows(Appointment.appointment_id, BOOKING_ORDER, (
+        Appointment.appt_date, Appointment.branch_code, Appointment.appt_status,
+    ), *filters)
+
+
+def journey_checkin_rows(*filters):
+    """First queue check-in (QLog with a queue number) per appointment."""
+    return _first_rows(QLog.appointment_code, CHECKIN_ORDER, (
+        QLog.qlog_date.label('checkin_date'), QLog.qlog_time_in.label('checkin_time'),
+        QLog.branch_code.label('checkin_branch_code'),
+    ), QLog.qlog_num.isnot(None), *filters)
+
+
+def journey_print_rows(*filters):
+    """First card print per appointment: print_date, print_branch_code."""
+    return _first_rows(BioRecord.appointment_id, PRINT_ORDER, (
+        BioRecord.print_date, BioRecord.branch_code.label('print_branch_code'),
+    ), *filters)
+
+
+def journey_from_sources():
+    """The funnel columns of ``appointment_journey`` computed from the source tables.
+
+    Used by the funnel until the backfill has finished, so counts do not
+    change when the ready flag flips. Window functions over whole tables:
+    slower than the journey table, fine as a fallback.
+    """
+    booking, checkin, printed = journey_booking_rows(), journey_checkin_rows(), journey_print_rows()
+    ids = union(
+        select(booking.c.appointment_id), select(checkin.c.appointment_id), select(printed.c.appointment_id)
+    ).subquery()
+    return select(
+        ids.c.appointment_id,
+        booking.c.appt_date, booking.c.branch_code, booking.c.appt_status,
+        checkin.c.checkin_date, checkin.c.checkin_branch_code,
+        printed.c.print_date, printed.c.print_branch_code,
+    ).select_from(
+        ids.outerjoin(booking, booking.c.appointment_id == ids.c.appointment_id)
+        .outerjoin(checkin, checkin.c.appointment_id == ids.c.appointment_id)
+        .outerjoin(printed, printed.c.appointment_id == ids.c.appointment_id)
+    ).subquery('journey_from_sources')
+
+
+def _build_journeys(session, ids: list) -> list:
+    """Compute journey rows for a batch of appointment_ids from the source tables."""
+    journeys = {appt_id: {'appointment_id': appt_id} for appt_id in ids}
+
+    # Booking: latest version (highest id) wins
+    booking = journey_booking_rows(Appointment.appointment_id.in_(ids))
+    for r in session.execute(select(booking)):
+        journeys[r.appointment_id].update(
+            appt_date=r.appt_date, branch_code=r.branch_code, appt_status=r.appt_status
+        )
+
+    # Check-in: first QLog with a queue number
+    checkin = journey_checkin_rows(QLog.appointment_code.in_(ids))
+    for r in session.execute(select(checkin)):
+        journeys[r.appointment_id].update(
+            checkin_date=r.checkin_date, checkin_time=r.checkin_time, checkin_branch_code=r.checkin_branch_code
+        )
+
+    # Printing: first print date/branch; G if any good card; latest good serial
+    for r in session.query(
+        BioRecord.appointment_id, BioRecord.print_date, BioRecord.branch_code,
+        BioRecord.print_status, BioRecord.serial_number
+    ).filter(BioRecord.appointment_id.in_(ids)).order_by(*PRINT_ORDER):
+        j = journeys[r.appointment_id]
+        if 'print_date' not in j:
+            j.update(print_date=r.print_date, print_branch_code=r.branch_code)
+        if r.print_status == 'G' or j.get('print_status') != 'G':
+            j.update(print_status=r.print_status, serial_number=r.serial_number)
+
+    # Delivery: latest record
+    for r in session.query(
+        CardDeliveryRecord.appointment_id, CardDeliveryRecord.print_status,
+        CardDeliveryRecord.serial_number, CardDeliveryRecord.create_date, CardDeliveryRecord.send_flag
+    ).filter(CardDeliveryRecord.appointment_id.in_(ids)).order_by(
+        CardDeliveryRecord.create_date, CardDeliveryRecord.id
+    ):
+        journeys[r.appointment_id].update(
+            delivery_status=r.print_status,
+            delivery_serial_number=r.serial_number,
+            delivery_date=r.create_date.date() if r.create_date else None,
+            delivery_sent=r.send_flag == 'Y' if r.send_flag else None,
+        )
+
+    now = now_th()
+    rows = []
+    for j in journeys.values():
+        # No source row left (e.g. after a delete) -> drop the journey
+        if len(j) == 1:
+            continue
+        j['funnel_state'] = derive_funnel_state(
+            j.get('appt_status'), j.get('checkin_date') is not None, j.get('print_date') is not None
+        )
+        j['updated_at'] = now
+        rows.append(j)
+    return rows
+
+
+def refresh_appointment_journeys(appointment_ids) -> int:
+    """Recompute journey rows for the given appointment_ids (delete + insert per batch).
+
+    Returns:
+        Number of journey rows written.
+    """
+    ids = sorted({i for i in appointment_ids if i})
+    if not ids:
+        return 0
+
+    start_time = time.perf_counter()
+    session = get_session()
+    written = 0
+    try:
+        for offset in range(0, len(ids), ID_CHUNK_SIZE):
+            chunk = ids[offset:offset + ID_CHUNK_SIZE]
+            rows = _build_journeys(session, chunk)
+            session.query(AppointmentJourney).filter(
+                AppointmentJourney.appointment_id.in_(chunk)
+            ).delete(synchronize_session=False)
+            if rows:
+                session.bulk_insert_mappings(AppointmentJourney, rows)
+            session.commit()
+            written += len(rows)
+        return written
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        log_perf(f"refresh_appointment_journeys({len(ids):,} ids)", (time.perf_counter() - start_time) * 1000)
+
+
+# ============== Backfill ==============
+
+def is_derived_table_ready(key: str) -> bool:
+    """True once the backfill flagged by ``key`` (system_settings) has completed.
+
+    A True flag is cached in process (flags only turn on through
+    ``set_derived_table_ready``); False is re-read so a backfill finishing
+    in another process is picked up.
+    """
+    with _ready_lock:
+        if _ready_flags.get(key):
+            return True
+    session = get_session()
+    try:
+        setting = session.query(SystemSetting).filter(SystemSetting.key == key).first()
+        ready = setting is not None and setting.value == 'true'
+    except Exception:
+        return False
+    finally:
+        session.close()
+    with _ready_lock:
+        _ready_flags[key] = ready
+    return ready
+
+
+def set_derived_table_ready(key: str, ready: bool):
+    """Record in system_settings that a derived table has (not) been fully built."""
+    session = get_session()
+    try:
+        setting = session.query(SystemSetting).filter(SystemSetting.key == key).first()
+        if setting is None:
+            setting = SystemSetting(key=key)
+            session.add(setting)
+        setting.value = 'true' if ready else 'false'
+        setting.updated_at = now_th()
+        session.commit()
+    finally:
+        session.close()
+    with _ready_lock:
+        _ready_flags[key] = ready
+
+
+def is_journey_ready() -> bool:
+    """True once the full backfill has completed (incremental refreshes keep it current)."""
+    return is_derived_table_ready(JOURNEY_READY_KEY)
+
+
+def rebuild_all_journeys() -> int:
+    """Full rebuild from every appointment_id in the four sources (blocking)."""
+    if not _backfill_lock.acquire(blocking=False):
+        log_info("[JOURNEY] rebuild skipped: already running")
+        return 0
+    try:
+        session = get_session()
+        try:
+            ids = set()
+            for model, id_col in JOURNEY_SOURCES.values():
+                ids.update(r[0] for r in session.query(id_col).filter(
+                    id_col.isnot(None), id_col != ''
+                ).distinct())
+            # Journeys whose sources were all deleted
+            ids.update(r[0] for r in session.query(AppointmentJourney.appointment_id))
+        finally:
+            session.close()
+
+        written = refresh_appointment_journeys(ids)
+        set_derived_table_ready(JOURNEY_READY_KEY, True)
+        log_info(f"[JOURNEY] full rebuild: {written:,} journeys")
+        return written
+    finally:
+        _backfill_lock.release()
+
+
+def start_journey_backfill():
+    """Run the full rebuild in a daemon thread if it has never completed."""
+    if is_journey_ready():
+        return
+
+    def _run():
+        try:
+            rebuild_all_journeys()
+        except Exception as e:
+            log_error(f"[JOURNEY] backfill failed: {e}")
+
+    threading.Thread(target=_run, name="journey-backfill", daemon=True).start()
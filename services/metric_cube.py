@@ -0,0 +1,238 @@
+"""In-memory metric cubes for instant date-range / branch filtering.
+
+Every (start_date, end_date, selected_branches) combination on Overview or
+By Center is its own cache key, so each filter change used to run SQL.
+Additive metrics (counts, sums, maxima) do not need that: the cube holds
+them per dimension key and day, loaded with one GROUP BY per data version
+(``utils.query_cache.get_data_version``), and any range / branch subset /
+grouping is answered with NumPy slicing and sums.
+
+Cells are kept as coordinate arrays sorted by day (only non-empty
+(key, day) cells are stored), so a date range is a contiguous slice found
+with ``searchsorted``.
+
+Cubes:
+- ``get_card_cube()``: ``cards`` by (branch_code, branch_name, region, operator) x print_date
+- ``get_bio_cube()``: ``bio_records`` by branch_code x print_date
+
+Distinct counts (unique serials, duplicate appointments) are not additive
+across days and stay in SQL.
+"""
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, case, and_, or_
+
+from database.connection import get_session
+from database.models import Card, BioRecord
+from utils.logger import log_perf
+from utils.query_cache import shared_resource, get_data_version
+
+
+class MetricCube:
+    """Additive metrics per dimension key and day.
+
+    Attributes:
+        dimensions: Dimension names, e.g. ('branch_code', 'region').
+        keys: Object array (n_keys x n_dimensions) of distinct dimension values.
+        days: int32 date ordinal per cell (sorted ascending).
+        key_index: int32 key row per cell.
+        sums: {metric: float64 array per cell}, summed on aggregation.
+        maxima: {metric: float64 array per cell (NaN = no value)}, max on aggregation.
+    """
+
+    def __init__(self, dimensions, keys, days, key_index, sums, maxima=None):
+        self.dimensions = tuple(dimensions)
+        self.keys = keys
+        self.days = days
+        self.key_index = key_index
+        self.sums = sums
+        self.maxima = maxima or {}
+        self._groupings = {}
+        # Cubes are shared by all sessions without copies: keep the cells read-only
+        for arr in (self.days, self.key_index, *self.sums.values(), *self.maxima.values()):
+            arr.flags.writeable = False
+
+    def _range(self, start_date, end_date) -> slice:
+        lo, hi = np.searchsorted(self.days, [start_date.toordinal(), end_date.toordinal() + 1])
+        return slice(lo, hi)
+
+    def _grouping(self, group_by):
+        """(group id per key, distinct group tuples), cached per grouping."""
+        if group_by not in self._groupings:
+            cols = [self.dimensions.index(name) for name in group_by]
+            groups = {}
+            ids = np.fromiter(
+                (groups.setdefault(tuple(key[cols]), len(groups)) for key in self.keys),
+                dtype=np.int64, count=len(self.keys),
+            )
+            self._groupings[group_by] = (ids, list(groups))
+        return self._groupings[group_by]
+
+    def aggregate(self, start_date, end_date, group_by=(), by_day=False, selected_branches=None,
+                  count_distinct=None, day_column='print_date') -> pd.DataFrame:
+        """Aggregate the cells of a date range.
+
+        Args:
+            start_date, end_date: Inclusive date range.
+            group_by: Dimension names to group by (() = grand total).
+            by_day: Also group by day (column ``day_column``).
+            selected_branches: Keep only these branch codes (None = all).
+            count_distinct: {label: dimension} - number of distinct non-null
+                values of ``dimension`` per group (e.g. centers per region).
+
+        Returns:
+            DataFrame with the group columns and one column per metric.
+            The grand total has exactly one row (zeros when empty).
+        """
+        group_by = tuple(group_by)
+        cells = self._range(start_date, end_date)
+        key_index = self.key_index[cells]
+        days = self.days[cells]
+        values = {name: arr[cells] for name, arr in {**self.sums, **self.maxima}.items()}
+        if selected_branches:
+            selected = set(selected_branches)
+            branch_col = self.dimensions.index('branch_code')
+            keep_key = np.fromiter((b in selected for b in self.keys[:, branch_col]), dtype=bool, count=len(self.keys))
+            keep = keep_key[key_index]
+            key_index, days = key_index[keep], days[keep]
+            values = {name: arr[keep] for name, arr in values.items()}
+
+        group_ids, group_keys = self._grouping(group_by)
+        cell_group = group_ids[key_index]
+        first_day = int(days[0]) if len(days) else 0
+        span = int(days[-1]) - first_day + 1 if len(days) else 1
+        if by_day:
+            cell_group = cell_group * span + (days - first_day)
+        combined, inverse = np.unique(cell_group, return_inverse=True)
+        if not group_by and not by_day and not len(combined):
+            combined = np.zeros(1, dtype=np.int64)
+
+        n = len(combined)
+        group_of, day_of = np.divmod(combined, span) if by_day else (combined, None)
+        data = {name: [group_keys[g][i] for g in group_of] for i, name in enumerate(group_by)}
+        if by_day:
+            data[day_column] = [date.fromordinal(int(d) + first_day) for d in day_of]
+        for name in self.sums:
+            data[name] = np.bincount(inverse, weights=values[name], minlength=n)
+        for name in self.maxima:
+            result = np.full(n, np.nan)
+            np.fmax.at(result, inverse, values[name])
+            data[name] = result
+        for label, dimension in (count_distinct or {}).items():
+            value_ids, values_list = self._grouping((dimension,))
+            cell_value = value_ids[key_index]
+            present = np.array([v != (None,) for v in values_list], dtype=bool)[cell_value]
+            pairs = np.unique(inverse[present] * len(values_list) + cell_value[present])
+            data[label] = np.bincount(pairs // max(len(values_list), 1), minlength=n)
+        return pd.DataFrame(data)
+
+
+def _to_cube(rows, dimensions, sum_metrics, max_metrics=()) -> MetricCube:
+    """Build a cube from GROUP BY rows: (*dimensions, day, *sum_metrics, *max_metrics)."""
+    n_dims = len(dimensions)
+    rows = sorted((r for r in rows if r[n_dims] is not None), key=lambda r: r[n_dims])
+    key_lookup = {}
+    key_index = np.fromiter(
+        (key_lookup.setdefault(tuple(r[:n_dims]), len(key_lookup)) for r in rows), dtype=np.int32, count=len(rows)
+    )
+    keys = np.empty((len(key_lookup), n_dims), dtype=object)
+    for key, i in key_lookup.items():
+        keys[i] = key
+    days = np.fromiter((r[n_dims].toordinal() for r in rows), dtype=np.int32, count=len(rows))
+
+    offset = n_dims + 1
+    sums = {
+        name: np.array([float(r[offset + i] or 0) for r in rows], dtype=float)
+        for i, name in enumerate(sum_metrics)
+    }
+    offset += len(sum_metrics)
+    maxima = {
+        name: np.array([np.nan if r[offset + i] is None else float(r[offset + i]) for r in rows], dtype=float)
+        for i, name in enumerate(max_metrics)
+    }
+    return MetricCube(dimensions, keys, days, key_index, sums, maxima)
+
+
+def _flag(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+# ============== Cards ==============
+
+CARD_CUBE_DIMENSIONS = ('branch_code', 'branch_name', 'region', 'operator')
+
+
+@shared_resource()
+def _build_card_cube(data_version):
+    start_time = time.perf_counter()
+    good = Card.print_status == 'G'
+    good_wait = and_(good, Card.wait_time_minutes.isnot(None))
+    metrics = {
+        'total': func.count(Card.id),
+        'good_count': _flag(good),
+        'bad_count': _flag(Card.print_status == 'B'),
+        'sla_count': func.count(Card.sla_minutes),
+        'sla_sum': func.sum(Card.sla_minutes),
+        'sla_over_count': _flag(Card.sla_over_12min == True),
+        'wrong_branch_count': _flag(Card.wrong_branch == True),
+        'wrong_date_count': _flag(Card.wrong_date == True),
+        'wait_over_1hr': _flag(Card.wait_over_1hour == True),
+        'wait_total': _flag(good_wait),
+        'wait_pass': _flag(and_(good_wait, Card.wait_time_minutes <= 60)),
+        'wait_sum': func.sum(case((good, Card.wait_time_minutes))),
+        'incomplete': _flag(and_(good, or_(
+            Card.appointment_id.is_(None), Card.appointment_id == '',
+            Card.card_id.is_(None), Card.card_id == '',
+            Card.serial_number.is_(None), Card.serial_number == '',
+            Card.work_permit_no.is_(None), Card.work_permit_no == '',
+        ))),
+    }
+    dims = [getattr(Card, name) for name in CARD_CUBE_DIMENSIONS]
+    session = get_session()
+    try:
+        rows = session.query(
+            *dims, Card.print_date, *metrics.values(), func.max(Card.sla_minutes)
+        ).group_by(*dims, Card.print_date).all()
+    finally:
+        session.close()
+
+    cube = _to_cube(rows, CARD_CUBE_DIMENSIONS, list(metrics), ['max_sla'])
+    log_perf(f"build_card_cube({len(cube.days):,} cells)", (time.perf_counter() - start_time) * 1000)
+    return cube
+
+
+def get_card_cube() -> MetricCube:
+    """Card metric cube for the current data version (built once, shared read-only by all sessions)."""
+    return _build_card_cube(get_data_version())
+
+
+# ============== Bio records ==============
+
+@shared_resource()
+def _build_bio_cube(data_version):
+    start_time = time.perf_counter()
+    good_sla = and_(BioRecord.print_status == 'G', BioRecord.sla_minutes.isnot(None))
+    metrics = {
+        'sla_total': _flag(good_sla),
+        'sla_pass': _flag(and_(good_sla, BioRecord.sla_minutes <= 12)),
+        'sla_sum': func.sum(case((good_sla, BioRecord.sla_minutes))),
+    }
+    session = get_session()
+    try:
+        rows = session.query(
+            BioRecord.branch_code, BioRecord.print_date, *metrics.values()
+        ).group_by(BioRecord.branch_code, BioRecord.print_date).all()
+    finally:
+        session.close()
+
+    cube = _to_cube(rows, ('branch_code',), list(metrics))
+    log_perf(f"build_bio_cube({len(cube.days):,} cells)", (time.perf_counter() - start_time) * 1000)
+    return cube
+
+
+def get_bio_cube() -> MetricCube:
+    """BioRecord metric cube for the current data version."""
+    return _build_bio_cube(get_data_version())
@@ -0,0 +1,199 @@
+"""Column-only read models for the list pages (Anomaly, Complete Diff, Raw Data).
+
+The list pages used to load full ORM entities (``session.query(Card)``:
+about 40 columns, identity map, one Python object per row) and rebuild a
+dict per row for display. A read model is a Core ``select`` of just the
+displayed columns, labelled with the display names, whose rows go
+straight into an Arrow-backed DataFrame (``read_frame``). Such a frame
+feeds ``st.dataframe`` and the exports as is; display rules (short branch
+names, "-" for blanks, Y/N flags) are applied per column, not per row.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import and_, case, func, select
+
+from database.models import Card, CompleteDiff
+from services.anomaly_index_service import is_anomaly_index_ready, multi_key_select
+from services.search_index import identifier_search_filter
+from utils.branch_display import get_branch_short_name
+
+# Display columns holding a branch code; 'ชื่อศูนย์' is shortened against the first one present
+BRANCH_CODE_COLUMNS = ('รหัสศูนย์', 'ศูนย์ที่ออกบัตร')
+
+
+# ============== Frames ==============
+
+def rows_to_frame(rows, columns) -> pd.DataFrame:
+    """Row tuples -> DataFrame with one Arrow array per column (``pd.ArrowDtype``)."""
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    table = pa.table({name: pa.array(column) for name, column in zip(columns, values)})
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def read_frame(session, stmt) -> pd.DataFrame:
+    """Rows of a Core ``select`` as an Arrow-backed DataFrame (columns = statement labels)."""
+    result = session.execute(stmt)
+    columns = list(result.keys())
+    return rows_to_frame(result.all(), columns)
+
+
+def _objects(series) -> np.ndarray:
+    """Column values as Python objects, None for missing (Arrow or NumPy backed)."""
+    return series.to_numpy(dtype=object, na_value=None)
+
+
+def _strings(values, index) -> pd.Series:
+    return pd.Series(pd.array(values, dtype=pd.ArrowDtype(pa.string())), index=index)
+
+
+def dash(series) -> pd.Series:
+    """Column as text with blanks shown as '-' (like ``value or '-'``)."""
+    return _strings([str(v) if v else '-' for v in _objects(series)], series.index)
+
+
+def flag_array(series) -> np.ndarray:
+    """Boolean column as a NumPy bool array (missing = False)."""
+    return np.array([bool(v) for v in _objects(series)], dtype=bool)
+
+
+def yes_no(series) -> pd.Series:
+    """Flag column as 'Y' / 'N' (missing = 'N')."""
+    return _strings(np.where(flag_array(series), 'Y', 'N'), series.index)
+
+
+def round_or_blank(series, digits: int = 2) -> pd.Series:
+    """Rounded numbers, 0 and missing left blank (like ``round(v, 2) if v else None``)."""
+    rounded = series.astype(float).round(digits)
+    return rounded.where(rounded != 0)
+
+
+def short_branch_names(codes, names):
+    """``get_branch_short_name`` per row, computed once per distinct (code, name) (Arrow string array)."""
+    cache = {}
+    result = []
+    for code, name in zip(_objects(codes), _objects(names)):
+        key = (code, name)
+        if key not in cache:
+            cache[key] = get_branch_short_name(code, name)
+        result.append(cache[key])
+    return pd.array(result, dtype=pd.ArrowDtype(pa.string()))
+
+
+def anomaly_display(df: pd.DataFrame) -> pd.DataFrame:
+    """Display rules of the anomaly lists: short center names, SLA rounded (missing = 0)."""
+    code_column = next((c for c in BRANCH_CODE_COLUMNS if c in df.columns), None)
+    if code_column and 'ชื่อศูนย์' in df.columns:
+        df['ชื่อศูนย์'] = short_branch_names(df[code_column], df['ชื่อศูนย์'])
+    if 'SLA (นาที)' in df.columns:
+        df['SLA (นาที)'] = df['SLA (นาที)'].astype(float).fillna(0).round(2)
+    return df
+
+
+def anomaly_frame(session, stmt) -> pd.DataFrame:
+    """``read_frame`` + ``anomaly_display``."""
+    return anomaly_display(read_frame(session, stmt))
+
+
+# ============== Anomaly lists ==============
+
+def _print_date_between(start_date, end_date):
+    return and_(Card.print_date >= start_date, Card.print_date <= end_date)
+
+
+def _status_label():
+    return case((Card.print_status == 'G', 'บัตรดี'), else_='บัตรเสีย').label('สถานะ')
+
+
+def _operator_label():
+    return func.coalesce(Card.operator, '-').label('ผู้ให้บริการ')
+
+
+def wrong_date_select(start_date, end_date, branch_code: str = None):
+    """Cards printed on another day than the appointment."""
+    stmt = select(
+        Card.appointment_id.label('Appointment ID'), Card.branch_code.label('รหัสศูนย์'),
+        Card.branch_name.label('ชื่อศูนย์'), Card.appt_date.label('วันที่นัด'),
+        Card.print_date.label('วันที่ออกบัตร'), Card.serial_number.label('Serial Number'),
+        _status_label(), _operator_label(),
+    ).where(_print_date_between(start_date, end_date), Card.wrong_date == True)
+    if branch_code:
+        stmt = stmt.where(Card.branch_code == branch_code)
+    return stmt
+
+
+def wrong_branch_select(start_date, end_date, branch_code: str = None):
+    """Cards printed at another center than the appointment's."""
+    stmt = select(
+        Card.appointment_id.label('Appointment ID'), func.coalesce(Card.appt_branch, '-').label('ศูนย์ที่นัด'),
+        Card.branch_code.label('ศูนย์ที่ออกบัตร'), Card.branch_name.label('ชื่อศูนย์'),
+        Card.serial_number.label('Serial Number'), Card.card_id.label('Card ID'), _status_label(),
+        Card.print_date.label('วันที่พิมพ์'), _operator_label(),
+    ).where(_print_date_between(start_date, end_date), Card.wrong_branch == True)
+    if branch_code:
+        stmt = stmt.where(Card.branch_code == branch_code)
+    return stmt
+
+
+def _multi_g_keys(anomaly_type, key_column, start_date, end_date, limit: int = None, filters=()):
+    """Values of ``key_column`` with more than one G card (the ``limit`` largest if given).
+
+    Read from the ``anomalies`` table once it is built, else grouped over ``cards``.
+    """
+    good = and_(_print_date_between(start_date, end_date), Card.print_status == 'G')
+    if is_anomaly_index_ready():
+        return good, multi_key_select(anomaly_type, start_date, end_date, limit=limit)
+    stmt = select(key_column).where(good, *filters).group_by(key_column).having(func.count(Card.id) > 1)
+    if limit:
+        stmt = stmt.order_by(func.count(Card.id).desc()).limit(limit)
+    return good, stmt
+
+
+def multi_g_appt_select(start_date, end_date, limit: int = None):
+    """G cards of appointments with more than one G card (top ``limit`` appointments by count)."""
+    good, appt_ids = _multi_g_keys('multi_g_appt', Card.appointment_id, start_date, end_date, limit)
+    return select(
+        Card.appointment_id.label('Appointment ID'), Card.branch_code.label('รหัสศูนย์'),
+        Card.branch_name.label('ชื่อศูนย์'), Card.card_id.label('Card ID'),
+        Card.serial_number.label('Serial Number'), Card.work_permit_no.label('Work Permit'),
+        Card.sla_minutes.label('SLA (นาที)'), _operator_label(), Card.print_date.label('วันที่'),
+    ).where(good, Card.appointment_id.in_(appt_ids)).order_by(Card.appointment_id, Card.id)
+
+
+def multi_g_card_id_select(start_date, end_date, limit: int = None):
+    """G cards of card IDs with more than one G card (top ``limit`` card IDs by count)."""
+    good, card_ids = _multi_g_keys(
+        'multi_g_card_id', Card.card_id, start_date, end_date, limit,
+        (Card.card_id.isnot(None), Card.card_id != ''),
+    )
+    return select(
+        Card.card_id.label('Card ID'), Card.appointment_id.label('Appointment ID'),
+        Card.branch_code.label('รหัสศูนย์'), Card.branch_name.label('ชื่อศูนย์'),
+        Card.serial_number.label('Serial Number'), Card.work_permit_no.label('Work Permit'),
+        _operator_label(), Card.print_date.label('วันที่'),
+    ).where(good, Card.card_id.in_(card_ids)).order_by(Card.card_id, Card.id)
+
+
+# ============== Complete Diff ==============
+
+def complete_diff_frame(session, start_date=None, end_date=None, search_term: str = None) -> pd.DataFrame:
+    """Complete Diff rows for the listing, newest print date first."""
+    stmt = select(
+        CompleteDiff.appointment_id.label('Appointment ID'), CompleteDiff.g_count.label('จำนวน G'),
+        CompleteDiff.branch_code.label('รหัสศูนย์'), CompleteDiff.branch_name.label('ชื่อศูนย์'),
+        CompleteDiff.region.label('ภูมิภาค'), CompleteDiff.card_id.label('Card ID'),
+        CompleteDiff.serial_number.label('Serial Number'), CompleteDiff.work_permit_no.label('Work Permit'),
+        CompleteDiff.sla_minutes.label('SLA (นาที)'), CompleteDiff.operator.label('ผู้ให้บริการ'),
+        CompleteDiff.print_date.label('วันที่พิมพ์'),
+    )
+    if start_date and end_date:
+        stmt = stmt.where(CompleteDiff.print_date >= start_date, CompleteDiff.print_date <= end_date)
+    if search_term:
+        stmt = stmt.where(identifier_search_filter(CompleteDiff, search_term))
+    df = read_frame(session, stmt.order_by(CompleteDiff.print_date.desc()))
+
+    df['ชื่อศูนย์'] = short_branch_names(df['รหัสศูนย์'], df['ชื่อศูนย์'])
+    df['ภูมิภาค'] = dash(df['ภูมิภาค'])
+    df['ผู้ให้บริการ'] = dash(df['ผู้ให้บริการ'])
+    df['SLA (นาที)'] = round_or_blank(df['SLA (นาที)'])
+    return df
@@ -0,0 +1,110 @@
+"""Indexed partial-identifier search (appointment ID, card ID, serial, work permit).
+
+Search boxes match a fragment anywhere in an identifier (``ILIKE
+'%term%'``), which a btree index cannot serve. The substring index is
+created by ``database.connection`` for the tables in
+``SEARCH_INDEX_COLUMNS``:
+
+- PostgreSQL: ``pg_trgm`` GIN index per column, used by ``ILIKE`` directly.
+- SQLite: FTS5 ``trigram`` table ``<table>_search`` (external content,
+  maintained by insert/update/delete triggers, so imports keep it current).
+
+``identifier_search_filter`` builds the matching filter for either backend.
+Terms shorter than a trigram cannot use the index and fall back to ``ILIKE``.
+
+Most searches are a complete identifier, though, and those have a known
+format. ``identifier_search_plan`` classifies the input and returns the
+filters to try in order - btree equality / prefix lookups first, substring
+search only when nothing matched or the input is an ambiguous fragment.
+"""
+import re
+from functools import lru_cache
+
+from sqlalchemy import or_, text, column
+
+from database.connection import engine, is_sqlite, SEARCH_INDEX_COLUMNS
+
+TRIGRAM_MIN_LENGTH = 3
+
+# Card ID, serial number and work permit are stored as 13 zero-padded digits
+# (ExcelParser._format_card_id / _format_serial_number / _format_work_permit)
+NUMERIC_ID_LENGTH = 13
+NUMERIC_ID_COLUMNS = ('card_id', 'serial_number', 'work_permit_no')
+
+# Appointment IDs: <digits>-<letters><digits>, e.g. 1-CTI001122501589
+_APPOINTMENT_ID_RE = re.compile(r'^\d+-[A-Z]+\d*$')
+
+
+@lru_cache(maxsize=None)
+def _has_fts_table(table_name: str) -> bool:
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": f"{table_name}_search"},
+        ).first() is not None
+
+
+def identifier_search_filter(model, term: str, columns=None):
+    """Filter for rows of ``model`` whose identifier columns contain ``term``.
+
+    Args:
+        model: ORM model with a table in ``SEARCH_INDEX_COLUMNS`` (e.g. Card, CompleteDiff).
+        term: Fragment to find (case-insensitive).
+        columns: Subset of the indexed columns to search (default: all).
+
+    Returns:
+        SQLAlchemy filter expression.
+    """
+    table_name = model.__tablename__
+    columns = tuple(columns or SEARCH_INDEX_COLUMNS[table_name])
+
+    if is_sqlite and len(term) >= TRIGRAM_MIN_LENGTH and _has_fts_table(table_name):
+        fts = f"{table_name}_search"
+        match = '{%s} : "%s"' % (' '.join(columns), term.replace('"', '""'))
+        rowids = text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :match").bindparams(
+            match=match
+        ).columns(column('rowid'))
+        return model.id.in_(rowids)
+
+    pattern = f"%{term}%"
+    return or_(*[getattr(model, c).ilike(pattern) for c in columns])
+
+
+def classify_identifier(term: str) -> str:
+    """'numeric_id' (13 digits), 'appointment_id' (or a leading part of one) or 'fragment'."""
+    term = term.strip()
+    if term.isdigit() and len(term) == NUMERIC_ID_LENGTH:
+        return 'numeric_id'
+    if _APPOINTMENT_ID_RE.match(term.upper()):
+        return 'appointment_id'
+    return 'fragment'
+
+
+def _prefix_filter(col, prefix: str):
+    """Prefix match the column's btree index can serve (GLOB on SQLite, varchar_pattern_ops on PostgreSQL)."""
+    if is_sqlite:
+        return col.op('GLOB')(f"{prefix}*")
+    return col.like(f"{prefix}%")
+
+
+def identifier_search_plan(model, term: str, columns=None) -> list:
+    """Filters to try in order for a search box input; use the first that returns rows.
+
+    - 13 digits: equality on card ID / serial / work permit
+    - appointment ID: equality, then prefix on appointment_id
+    - anything else (or no hit above): substring search (``identifier_search_filter``)
+    """
+    columns = tuple(columns or SEARCH_INDEX_COLUMNS[model.__tablename__])
+    value = term.strip()
+    kind = classify_identifier(value)
+
+    plan = []
+    if kind == 'numeric_id':
+        numeric = [c for c in columns if c in NUMERIC_ID_COLUMNS]
+        if numeric:
+            plan.append(or_(*[getattr(model, c) == value for c in numeric]))
+    elif kind == 'appointment_id' and 'appointment_id' in columns:
+        plan.append(model.appointment_id.in_(sorted({value, value.upper()})))
+        plan.append(_prefix_filter(model.appointment_id, value.upper()))
+    plan.append(identifier_search_filter(model, term, columns))
+    return plan
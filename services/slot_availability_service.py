@@ -0,0 +1,195 @@
+"""Maintenance of the slot_availability table (Queue Slots calendar).
+
+``slot_availability`` holds booked, cut and available slots per
+(branch_code, slot_date). Rows are recomputed per date: an appointment
+upload/delete refreshes the dates its appointments were (and are now)
+booked on, a Bio Unified Report upload/delete refreshes the original
+appointment dates of its cut cards. Slot-cut detail rows are not stored;
+the page loads them on demand (``get_slot_cut_details``).
+
+The first full build runs in a background thread once appointments_current
+is built; until it has finished ``is_slot_availability_ready()`` is False
+and the page aggregates the source tables directly.
+"""
+import threading
+import time
+
+from sqlalchemy import func, or_
+
+from database.connection import get_session
+from database.models import Appointment, AppointmentCurrent, Card, BranchMaster, SlotAvailability
+from services.appointment_current_service import (
+    get_booking_table, booking_count, wait_for_current_appointments_backfill,
+)
+from services.journey_service import ID_CHUNK_SIZE, is_derived_table_ready, set_derived_table_ready
+from utils.logger import log_info, log_error, log_perf
+from utils.timezone import now_th
+
+SLOT_READY_KEY = 'slot_availability_ready'
+
+# slot dates per refresh batch
+DATE_CHUNK_SIZE = 31
+
+BOOKED_STATUSES = ('SUCCESS', 'WAITING')
+
+_backfill_lock = threading.Lock()
+
+
+def slot_cut_filters():
+    """Cards that cut a slot: good card printed on another day or at another branch."""
+    return [
+        or_(Card.wrong_date == True, Card.wrong_branch == True),
+        Card.print_status == 'G',
+        Card.appt_branch.isnot(None),
+        Card.appt_date.isnot(None),
+    ]
+
+
+def get_appointment_slot_dates(session, appointment_ids) -> set:
+    """Dates the given appointments are booked on, in any version.
+
+    Call before ``refresh_current_appointments`` so a delete still sees the
+    dates of the versions being removed (kept in appointments_current).
+    """
+    ids = sorted({i for i in appointment_ids if i})
+    dates = set()
+    for offset in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[offset:offset + ID_CHUNK_SIZE]
+        for model in (Appointment, AppointmentCurrent):
+            dates.update(r[0] for r in session.query(model.appt_date).filter(
+                model.appointment_id.in_(chunk), model.appt_date.isnot(None)
+            ).distinct())
+    return dates
+
+
+def get_report_slot_dates(session, report_id: int) -> set:
+    """Original appointment dates of the cut cards in one Bio Unified Report."""
+    return {r[0] for r in session.query(Card.appt_date).filter(
+        Card.report_id == report_id, *slot_cut_filters()
+    ).distinct()}
+
+
+def _build_slots(session, dates: list) -> list:
+    """Compute slot rows for a batch of dates from appointments and cards."""
+    slots = {}
+
+    appt = get_booking_table()
+    for r in session.query(
+        appt.branch_code, appt.appt_date, booking_count(appt).label('booked')
+    ).filter(
+        appt.appt_date.in_(dates),
+        appt.appt_status.in_(BOOKED_STATUSES),
+        appt.branch_code.isnot(None),
+    ).group_by(appt.branch_code, appt.appt_date):
+        slots[(r.branch_code, r.appt_date)] = {'booked': r.booked, 'cut': 0}
+
+    for r in session.query(
+        Card.appt_branch, Card.appt_date, func.count(func.distinct(Card.appointment_id)).label('cut')
+    ).filter(Card.appt_date.in_(dates), *slot_cut_filters()).group_by(Card.appt_branch, Card.appt_date):
+        slots.setdefault((r.appt_branch, r.appt_date), {'booked': 0})['cut'] = r.cut
+
+    capacity_map = dict(session.query(BranchMaster.branch_code, BranchMaster.max_capacity).filter(
+        BranchMaster.max_capacity.isnot(None)
+    ).all())
+
+    now = now_th()
+    rows = []
+    for (branch_code, slot_date), counts in slots.items():
+        capacity = capacity_map.get(branch_code)
+        rows.append({
+            'branch_code': branch_code,
+            'slot_date': slot_date,
+            'capacity': capacity,
+            'booked': counts['booked'],
+            'cut': counts['cut'],
+            'available': capacity - counts['booked'] + counts['cut'] if capacity is not None else None,
+            'updated_at': now,
+        })
+    return rows
+
+
+def refresh_slot_availability(dates) -> int:
+    """Recompute slot_availability for the given dates (delete + insert per batch).
+
+    Returns:
+        Number of slot rows written.
+    """
+    dates = sorted({d for d in dates if d})
+    if not dates:
+        return 0
+
+    start_time = time.perf_counter()
+    session = get_session()
+    written = 0
+    try:
+        for offset in range(0, len(dates), DATE_CHUNK_SIZE):
+            chunk = dates[offset:offset + DATE_CHUNK_SIZE]
+            rows = _build_slots(session, chunk)
+            session.query(SlotAvailability).filter(
+                SlotAvailability.slot_date.in_(chunk)
+            ).delete(synchronize_session=False)
+            if rows:
+                session.bulk_insert_mappings(SlotAvailability, rows)
+            session.commit()
+            written += len(rows)
+        return written
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        log_perf(f"refresh_slot_availability({len(dates):,} dates)", (time.perf_counter() - start_time) * 1000)
+
+
+# ============== Backfill ==============
+
+def is_slot_availability_ready() -> bool:
+    """True once the full backfill has completed (incremental refreshes keep it current)."""
+    return is_derived_table_ready(SLOT_READY_KEY)
+
+
+def rebuild_all_slot_availability() -> int:
+    """Full rebuild for every booked or cut date (blocking)."""
+    if not _backfill_lock.acquire(blocking=False):
+        log_info("[SLOTS] rebuild skipped: already running")
+        return 0
+    try:
+        session = get_session()
+        try:
+            appt = get_booking_table()
+            dates = {r[0] for r in session.query(appt.appt_date).filter(
+                appt.appt_status.in_(BOOKED_STATUSES)
+            ).distinct()}
+            dates.update(r[0] for r in session.query(Card.appt_date).filter(*slot_cut_filters()).distinct())
+            dates.update(r[0] for r in session.query(SlotAvailability.slot_date).distinct())
+        finally:
+            session.close()
+
+        written = refresh_slot_availability(dates)
+        set_derived_table_ready(SLOT_READY_KEY, True)
+        log_info(f"[SLOTS] full rebuild: {written:,} slots")
+        return written
+    finally:
+        _backfill_lock.release()
+
+
+def start_slot_availability_backfill():
+    """Run the full rebuild in a daemon thread if it has never completed.
+
+    Booked counts are read from appointments_current, so the rebuild waits
+    for that backfill (started first by app.py) instead of picking the
+    latest versions from the whole history with a window function.
+    """
+    if is_slot_availability_ready():
+        return
+
+    def _run():
+        try:
+            if not wait_for_current_appointments_backfill():
+                log_error("[SLOTS] backfill postponed: appointments_current is not built")
+                return
+            rebuild_all_slot_availability()
+        except Exception as e:
+            log_error(f"[SLOTS] backfill failed: {e}")
+
+    threading.Thread(target=_run, name="slot-availability-backfill", daemon=True).start()
@@ -0,0 +1,224 @@
+"""Per-branch workload forecast (check-ins, walk-ins, card prints).
+
+The Forecast page's booking view ends at the last booked date. This module
+projects daily workload up to ``MAX_HORIZON_DAYS`` ahead from the last
+``HISTORY_DAYS`` of history:
+
+- check-ins: queue tickets in ``qlogs`` (``qlog_num`` set)
+- walk-ins: check-ins whose appointment code matches no booking in ``appointments``
+- prints: card prints in ``bio_records``
+
+Each branch gets a seasonal linear model: level + trend + day-of-week +
+month-end + public-holiday effects. All branches are fitted at once
+(one batched weighted least-squares solve over a shared design matrix, with
+each branch weighted from its first active day), and the prediction
+standard deviation includes parameter uncertainty. The fit is cached per
+data version (``utils.query_cache.get_data_version``).
+"""
+import calendar
+import time
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import func, exists
+
+from database.connection import get_session
+from database.models import Appointment, QLog, BioRecord, BranchMaster
+from utils.logger import log_perf
+from utils.query_cache import stale_while_revalidate, get_data_version
+
+HISTORY_DAYS = 365
+MAX_HORIZON_DAYS = 90
+# Branches with fewer active days in the history window are not forecast
+MIN_ACTIVE_DAYS = 28
+# Two-sided 95% prediction interval
+PREDICTION_Z = 1.96
+# Ridge term keeping per-branch normal equations solvable (e.g. no holiday in a branch's history)
+RIDGE = 1e-3
+
+FORECAST_METRICS = ('checkins', 'walk_ins', 'prints')
+
+# Fixed-date Thai public holidays (lunar holidays vary per year and are not included)
+FIXED_HOLIDAYS = {
+    (1, 1), (4, 6), (4, 13), (4, 14), (4, 15), (5, 1), (6, 3), (7, 28),
+    (8, 12), (10, 13), (10, 23), (12, 5), (12, 10), (12, 31),
+}
+
+
+def _design_matrix(dates: list) -> np.ndarray:
+    """Features per date: intercept, trend (years), Tue..Sun, month-end (last 3 days), holiday."""
+    origin = dates[0] if dates else date.today()
+    rows = []
+    for d in dates:
+        weekday = [1.0 if d.weekday() == i else 0.0 for i in range(1, 7)]
+        month_end = 1.0 if d.day > calendar.monthrange(d.year, d.month)[1] - 3 else 0.0
+        holiday = 1.0 if (d.month, d.day) in FIXED_HOLIDAYS else 0.0
+        rows.append([1.0, (d - origin).days / 365.0, *weekday, month_end, holiday])
+    return np.array(rows, dtype=float).reshape(len(dates), 10)
+
+
+def _daily_matrix(rows, branch_index: dict, start_date, num_days: int) -> np.ndarray:
+    """(days x branches) counts from (branch_code, day, count) rows."""
+    matrix = np.zeros((num_days, len(branch_index)), dtype=float)
+    for branch_code, day, count in rows:
+        if branch_code in branch_index and day is not None:
+            matrix[(day - start_date).days, branch_index[branch_code]] = count
+    return matrix
+
+
+def _fit_predict(X, Y, X_future):
+    """Batched weighted least squares over all branch columns of ``Y``.
+
+    Each branch is weighted from its first non-zero day onwards, so branches
+    that opened inside the window are not pulled towards zero.
+
+    Returns:
+        (mean, sd): (horizon x branches) prediction and its standard deviation.
+    """
+    active = np.cumsum(Y, axis=0) > 0
+    W = active.astype(float)
+    k = X.shape[1]
+
+    XtWX = np.einsum('tk,tb,tl->bkl', X, W, X) + RIDGE * np.eye(k)
+    XtWy = np.einsum('tk,tb,tb->bk', X, W, Y)
+    beta = np.linalg.solve(XtWX, XtWy[..., None])[..., 0]
+
+    resid = (Y - X @ beta.T) * W
+    dof = np.maximum(W.sum(axis=0) - k, 1)
+    sigma = np.sqrt((resid ** 2).sum(axis=0) / dof)
+
+    leverage = np.einsum('hk,bkl,hl->hb', X_future, np.linalg.inv(XtWX), X_future)
+    mean = np.clip(X_future @ beta.T, 0, None)
+    sd = sigma * np.sqrt(1 + np.clip(leverage, 0, None))
+    return mean, sd
+
+
+class WorkloadForecast:
+    """Daily forecast per branch for ``dates`` (columns follow ``branch_codes``).
+
+    Attributes:
+        dates: Forecast dates (from the day after ``as_of``).
+        branch_codes: Forecast branches.
+        mean / sd: {metric: (days x branches) array}.
+        capacity_map: {branch_code: max_capacity}.
+    """
+
+    def __init__(self, as_of, dates, branch_codes, mean, sd, capacity_map):
+        self.as_of = as_of
+        self.dates = dates
+        self.branch_codes = branch_codes
+        self.mean = mean
+        self.sd = sd
+        self.capacity_map = capacity_map
+
+    def _columns(self, selected_branches):
+        if not selected_branches:
+            return np.arange(len(self.branch_codes))
+        selected = set(selected_branches)
+        return np.array([i for i, b in enumerate(self.branch_codes) if b in selected], dtype=int)
+
+    def total(self, metric: str, horizon_days: int, selected_branches=None) -> dict:
+        """Daily total over branches with a 95% interval (branch errors assumed independent).
+
+        Returns:
+            {'dates': [...], 'mean': array, 'lower': array, 'upper': array}
+        """
+        cols = self._columns(selected_branches)
+        mean = self.mean[metric][:horizon_days, cols].sum(axis=1)
+        half = PREDICTION_Z * np.sqrt((self.sd[metric][:horizon_days, cols] ** 2).sum(axis=1))
+        return {
+            'dates': self.dates[:horizon_days],
+            'mean': mean,
+            'lower': np.clip(mean - half, 0, None),
+            'upper': mean + half,
+        }
+
+    def branch_summary(self, metric: str, horizon_days: int, selected_branches=None) -> list:
+        """Per-branch average / peak forecast day versus capacity.
+
+        Returns:
+            List of dicts sorted by peak usage (highest first), branches
+            without capacity last.
+        """
+        cols = self._columns(selected_branches)
+        mean = self.mean[metric][:horizon_days, cols]
+        upper = mean + PREDICTION_Z * self.sd[metric][:horizon_days, cols]
+        peak_idx = mean.argmax(axis=0) if len(mean) else np.zeros(len(cols), dtype=int)
+
+        summary = []
+        for j, col in enumerate(cols):
+            branch_code = self.branch_codes[col]
+            capacity = self.capacity_map.get(branch_code)
+            peak = float(mean[peak_idx[j], j]) if len(mean) else 0.0
+            summary.append({
+                'branch_code': branch_code,
+                'avg_daily': round(float(mean[:, j].mean()), 1) if len(mean) else 0.0,
+                'peak_daily': round(peak, 1),
+                'peak_date': self.dates[peak_idx[j]] if len(mean) else None,
+                'peak_upper': round(float(upper[peak_idx[j], j]), 1) if len(mean) else 0.0,
+                'capacity': capacity,
+                'peak_usage_pct': round(peak / capacity * 100, 1) if capacity else None,
+                'days_over_capacity': int((mean[:, j] >= capacity).sum()) if capacity else 0,
+            })
+        summary.sort(key=lambda r: (r['peak_usage_pct'] is None, -(r['peak_usage_pct'] or 0)))
+        return summary
+
+
+def _load_history(session, start_date, end_date) -> dict:
+    """{metric: [(branch_code, day, count), ...]} for the history window."""
+    checkin_filters = [
+        QLog.qlog_date >= start_date, QLog.qlog_date <= end_date,
+        QLog.qlog_num.isnot(None), QLog.branch_code.isnot(None),
+    ]
+    booked = exists().where(Appointment.appointment_id == QLog.appointment_code)
+    return {
+        'checkins': session.query(QLog.branch_code, QLog.qlog_date, func.count(QLog.id)).filter(
+            *checkin_filters
+        ).group_by(QLog.branch_code, QLog.qlog_date).all(),
+        'walk_ins': session.query(QLog.branch_code, QLog.qlog_date, func.count(QLog.id)).filter(
+            *checkin_filters, ~booked
+        ).group_by(QLog.branch_code, QLog.qlog_date).all(),
+        'prints': session.query(BioRecord.branch_code, BioRecord.print_date, func.count(BioRecord.id)).filter(
+            BioRecord.print_date >= start_date, BioRecord.print_date <= end_date,
+            BioRecord.branch_code.isnot(None),
+        ).group_by(BioRecord.branch_code, BioRecord.print_date).all(),
+    }
+
+
+@stale_while_revalidate(ttl=3600, max_entries=4)
+def _build_forecast(as_of, data_version):
+    start_time = time.perf_counter()
+    history_start = as_of - timedelta(days=HISTORY_DAYS - 1)
+    session = get_session()
+    try:
+        history = _load_history(session, history_start, as_of)
+        capacity_map = dict(session.query(BranchMaster.branch_code, BranchMaster.max_capacity).filter(
+            BranchMaster.max_capacity.isnot(None)
+        ).all())
+    finally:
+        session.close()
+
+    branch_codes = sorted({r[0] for rows in history.values() for r in rows})
+    branch_index = {b: i for i, b in enumerate(branch_codes)}
+    history_dates = [history_start + timedelta(days=i) for i in range(HISTORY_DAYS)]
+    future_dates = [as_of + timedelta(days=i) for i in range(1, MAX_HORIZON_DAYS + 1)]
+    X = _design_matrix(history_dates + future_dates)
+    X_hist, X_future = X[:HISTORY_DAYS], X[HISTORY_DAYS:]
+
+    matrices = {m: _daily_matrix(history[m], branch_index, history_start, HISTORY_DAYS) for m in FORECAST_METRICS}
+
+    # Keep branches with enough check-in or print history
+    active_days = np.maximum((matrices['checkins'] > 0).sum(axis=0), (matrices['prints'] > 0).sum(axis=0))
+    keep = np.flatnonzero(active_days >= MIN_ACTIVE_DAYS)
+
+    mean, sd = {}, {}
+    for metric, Y in matrices.items():
+        mean[metric], sd[metric] = _fit_predict(X_hist, Y[:, keep], X_future)
+
+    log_perf(f"build_workload_forecast({len(keep)} branches)", (time.perf_counter() - start_time) * 1000)
+    return WorkloadForecast(as_of, future_dates, [branch_codes[i] for i in keep], mean, sd, capacity_map)
+
+
+def get_workload_forecast() -> WorkloadForecast:
+    """Forecast for the next ``MAX_HORIZON_DAYS`` days from yesterday's history (cached per data version)."""
+    return _build_forecast(date.today() - timedelta(days=1), get_data_version())
@@ -0,0 +1,56 @@
+"""
+On-demand export download for Bio Dashboard pages.
+
+The file is built only when the user asks for it, in a background thread
+(``services.export_service.request_export``), and cached on disk per
+(export type, filters, data version). Reruns of the page just look the job
+up: a built file is offered straight away, a running one shows its status.
+"""
+import streamlit as st
+
+from services.export_service import get_export_job, request_export, XLSX_MIME
+
+# Seconds to wait for the file after the prepare click before handing it to the background
+EXPORT_WAIT_SECONDS = 20
+
+
+def export_download_button(label: str, export_type: str, params: tuple, build, file_name: str,
+                           mime: str = XLSX_MIME, key: str = None, button_type: str = "secondary",
+                           use_container_width: bool = False):
+    """Prepare button that builds the export in the background, then its download button.
+
+    Args:
+        label: Button text (e.g. "📥 ดาวน์โหลด Excel").
+        export_type: Export name, unique per page section.
+        params: Hashable filters the file depends on.
+        build: Callable returning an export file (runs in a background
+            thread: opens its own session, no Streamlit calls).
+        file_name: Download file name.
+        mime: Download MIME type.
+        key: Widget key prefix (defaults to export_type).
+        button_type: Streamlit button type of the prepare button.
+        use_container_width: Stretch the buttons to the column width.
+    """
+    key = key or export_type
+    job = get_export_job(export_type, params)
+    # Read from disk only to render the download (None if the file was evicted meanwhile)
+    data = job.read() if job is not None and job.status == 'ready' else None
+
+    if job is None or job.status == 'failed' or (job.status == 'ready' and data is None):
+        if job is not None and job.status == 'failed':
+            st.error(f"❌ สร้างไฟล์ไม่สำเร็จ: {job.error}")
+        if not st.button(label, key=f"{key}_prepare", type=button_type, use_container_width=use_container_width):
+            return
+        job = request_export(export_type, params, build)
+        with st.spinner("กำลังสร้างไฟล์..."):
+            job.wait(EXPORT_WAIT_SECONDS)
+        data = job.read() if job.status == 'ready' else None
+
+    if data is not None:
+        st.download_button(label, data, file_name, mime, key=f"{key}_download",
+                           use_container_width=use_container_width)
+    elif job.status == 'running':
+        st.info("⏳ กำลังสร้างไฟล์เบื้องหลัง เปิดหน้าอื่นได้ระหว่างรอ แล้วกดตรวจสอบอีกครั้ง")
+        st.button("🔄 ตรวจสอบอีกครั้ง", key=f"{key}_check", use_container_width=use_container_width)
+    else:
+        st.error(f"❌ สร้างไฟล์ไม่สำเร็จ: {job.error}")
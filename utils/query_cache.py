@@ -0,0 +1,389 @@
+"""Query result caching helpers for Bio Dashboard.
+
+Provides:
+- single_flight: concurrent callers asking for the same expensive query
+  (same function + same arguments) share one database round-trip instead
+  of each running it. Coalesced waits are counted per operation and logged.
+- stale_while_revalidate: a process-wide result cache that keeps the last
+  good value. Once it is older than the TTL the value is still served
+  immediately while one background thread recomputes it; if that refresh
+  fails (e.g. statement_timeout) the last good value is kept.
+- get_data_version: counter bumped on every full invalidation, for caches
+  that must be recomputed (not served stale) after an import.
+- shared_resource: one process-wide object per operation (e.g. an
+  in-memory cube for the current data version), returned as is - never
+  copied - to every caller.
+
+Usage:
+    @st.cache_data(ttl=3600)
+    @single_flight("get_overview_stats")
+    def get_overview_stats(start_date, end_date, selected_branches=None):
+        ...
+
+    @stale_while_revalidate(ttl=3600)
+    def get_overview_stats(start_date, end_date, selected_branches=None):
+        ...
+
+    as_of = get_overview_stats.data_as_of(start_date, end_date, selected_branches)
+
+Place ``single_flight`` *under* ``st.cache_data`` so it only runs on a
+cache miss (first load, TTL expiry, or after the cache is cleared).
+``stale_while_revalidate`` replaces ``st.cache_data`` and already
+coalesces its own computations.
+"""
+import copy
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from utils.logger import log_info, log_perf, log_error
+from utils.timezone import now_th
+
+
+class _InFlightCall:
+    """A computation in progress that other callers can wait on."""
+
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+# Process-wide state: Streamlit re-executes page scripts on every rerun,
+# so this must live at module level (keyed by operation name), not inside
+# the decorated function's closure.
+_inflight = {}
+_inflight_lock = threading.Lock()
+_stats = {}
+
+
+def _make_key(func, args, kwargs):
+    """Build a hashable key from call arguments, normalizing positional vs keyword."""
+    try:
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        items = tuple(bound.arguments.items())
+    except TypeError:
+        items = (args, tuple(sorted(kwargs.items())))
+    try:
+        hash(items)
+        return items
+    except TypeError:
+        return repr(items)
+
+
+def _record(op_name: str, coalesced: bool):
+    """Update per-operation counters (caller must hold _inflight_lock)."""
+    stats = _stats.setdefault(op_name, {'calls': 0, 'executed': 0, 'coalesced': 0})
+    stats['calls'] += 1
+    if coalesced:
+        stats['coalesced'] += 1
+    else:
+        stats['executed'] += 1
+
+
+def run_single_flight(op_name: str, key, compute):
+    """Run ``compute()`` once per (op_name, key) among concurrent callers.
+
+    The first caller executes ``compute``; callers arriving while it is
+    still running block until it finishes and receive the same result
+    (or the same exception).
+    """
+    flight_key = (op_name, key)
+    with _inflight_lock:
+        call = _inflight.get(flight_key)
+        is_leader = call is None
+        if is_leader:
+            call = _InFlightCall()
+            _inflight[flight_key] = call
+        else:
+            call.waiters += 1
+        _record(op_name, coalesced=not is_leader)
+
+    if not is_leader:
+        log_info(f"[COALESCE] {op_name}: joined in-flight query ({call.waiters} waiting)")
+        start = time.perf_counter()
+        call.event.wait()
+        log_perf(f"{op_name} (coalesced wait)", (time.perf_counter() - start) * 1000)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = compute()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(flight_key, None)
+        call.event.set()
+
+
+def single_flight(operation_name: str = None):
+    """Decorator: coalesce concurrent calls with identical arguments.
+
+    Args:
+        operation_name: Name used for the in-flight key, counters and logs
+            (defaults to the function name).
+    """
+    def decorator(func):
+        op_name = operation_name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = _make_key(func, args, kwargs)
+            return run_single_flight(op_name, key, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def get_single_flight_stats() -> dict:
+    """Return a snapshot of per-operation counters.
+
+    Returns:
+        {operation_name: {'calls': int, 'executed': int, 'coalesced': int}}
+    """
+    with _inflight_lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
+
+
+# ============== Stale-While-Revalidate ==============
+
+class _CacheEntry:
+    """Last good value of a cached query and when it was computed."""
+
+    __slots__ = ('value', 'computed_at', 'stored_at')
+
+    def __init__(self, value):
+        self.value = value
+        self.computed_at = now_th()
+        self.stored_at = time.monotonic()
+
+
+# op_name -> OrderedDict(key -> _CacheEntry), most recently used last
+_results = {}
+_results_lock = threading.Lock()
+_refreshing = set()
+# Bumped by every full invalidate_query_cache() (after imports / "รีเฟรช")
+_data_version = 0
+
+
+def _get_entry(op_name: str, key):
+    with _results_lock:
+        entries = _results.get(op_name)
+        if entries is None or key not in entries:
+            return None
+        entries.move_to_end(key)
+        return entries[key]
+
+
+def _put_entry(op_name: str, key, value, max_entries: int, data_version: int):
+    """Store a value computed from ``data_version``; dropped if the data was invalidated meanwhile."""
+    with _results_lock:
+        if data_version != _data_version:
+            log_info(f"[SWR] {op_name}: result computed before an invalidation discarded")
+            return
+        entries = _results.setdefault(op_name, OrderedDict())
+        entries[key] = _CacheEntry(value)
+        entries.move_to_end(key)
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
+
+
+def _refresh_in_background(op_name: str, key, recompute):
+    """Start one daemon thread to recompute a stale entry (deduplicated per key)."""
+    refresh_key = (op_name, key)
+    with _results_lock:
+        if refresh_key in _refreshing:
+            return
+        _refreshing.add(refresh_key)
+
+    def _run():
+        start = time.perf_counter()
+        try:
+            recompute()
+            log_perf(f"{op_name} (background refresh)", (time.perf_counter() - start) * 1000)
+        except Exception as e:
+            log_error(f"{op_name} background refresh failed, serving last good value: {e}")
+        finally:
+            with _results_lock:
+                _refreshing.discard(refresh_key)
+
+    threading.Thread(target=_run, name=f"swr-{op_name}", daemon=True).start()
+
+
+def stale_while_revalidate(ttl: int = 3600, operation_name: str = None, max_entries: int = 64):
+    """Decorator: cache results process-wide and refresh stale ones in the background.
+
+    - No cached value: compute in the foreground (single-flight).
+    - Fresh value (age <= ttl): return it.
+    - Stale value: return it immediately and start a background refresh.
+    - Refresh fails (e.g. statement_timeout): log it and keep serving the
+      last good value.
+    - A result whose computation started before ``invalidate_query_cache()``
+      is returned to its caller but not stored, so it cannot replace the
+      invalidated value with a fresh timestamp.
+
+    Returned values are deep copies, like ``st.cache_data``, so callers may
+    mutate them freely.
+
+    The wrapped function gains:
+        .data_as_of(*args, **kwargs) -> datetime | None
+        .is_refreshing(*args, **kwargs) -> bool
+        .refresh(*args, **kwargs) -> recompute now and store
+        .clear() -> drop all cached values for this function
+
+    Args:
+        ttl: Seconds before a value is considered stale.
+        operation_name: Name for the cache namespace and logs (defaults to
+            the function name).
+        max_entries: Least recently used argument combinations beyond this
+            are evicted.
+    """
+    def decorator(func):
+        op_name = operation_name or func.__name__
+
+        def _compute_and_store(key, args, kwargs):
+            # Callers after an invalidation do not join a computation started before it
+            data_version = get_data_version()
+            value = run_single_flight(op_name, (data_version, key), lambda: func(*args, **kwargs))
+            _put_entry(op_name, key, value, max_entries, data_version)
+            return value
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = _make_key(func, args, kwargs)
+            entry = _get_entry(op_name, key)
+
+            if entry is None:
+                return copy.deepcopy(_compute_and_store(key, args, kwargs))
+
+            if time.monotonic() - entry.stored_at > ttl:
+                _refresh_in_background(op_name, key, lambda: _compute_and_store(key, args, kwargs))
+            return copy.deepcopy(entry.value)
+
+        def data_as_of(*args, **kwargs):
+            entry = _get_entry(op_name, _make_key(func, args, kwargs))
+            return entry.computed_at if entry is not None else None
+
+        def is_refreshing(*args, **kwargs):
+            with _results_lock:
+                return (op_name, _make_key(func, args, kwargs)) in _refreshing
+
+        def refresh(*args, **kwargs):
+            key = _make_key(func, args, kwargs)
+            try:
+                return copy.deepcopy(_compute_and_store(key, args, kwargs))
+            except Exception as e:
+                entry = _get_entry(op_name, key)
+                if entry is None:
+                    raise
+                log_error(f"{op_name} refresh failed, serving last good value: {e}")
+                return copy.deepcopy(entry.value)
+
+        wrapper.data_as_of = data_as_of
+        wrapper.is_refreshing = is_refreshing
+        wrapper.refresh = refresh
+        wrapper.clear = lambda: clear_query_cache(op_name)
+        return wrapper
+    return decorator
+
+
+def invalidate_query_cache(operation_name: str = None):
+    """Mark cached values stale without dropping them.
+
+    The next read serves the last good value and refreshes it in the
+    background, so a "refresh" never leaves the user on a cold query.
+    """
+    global _data_version
+    with _results_lock:
+        if operation_name is None:
+            _data_version += 1
+        names = list(_results) if operation_name is None else [operation_name]
+        for name in names:
+            for entry in _results.get(name, {}).values():
+                entry.stored_at = float('-inf')
+
+
+def get_data_version() -> int:
+    """Counter of full cache invalidations.
+
+    Pass it as an argument to a cached function whose result must never be
+    served across an import: a new version is a cache miss, so the value
+    is recomputed once per data version instead of refreshed in the background.
+    """
+    with _results_lock:
+        return _data_version
+
+
+# ============== Shared resources ==============
+
+# op_name -> (key, value) of the last built resource
+_resources = {}
+
+
+def shared_resource(operation_name: str = None):
+    """Decorator: build one shared, read-only object per argument key (no copies).
+
+    For large in-memory structures (metric cubes, booking matrix) that are
+    queried on every rerun: the object is built once (single-flight) and
+    the same instance is returned to every caller until it is asked for
+    with different arguments, typically a new ``get_data_version()``.
+    Only the latest key is kept. Callers must not mutate the result.
+
+    Args:
+        operation_name: Name for the in-flight key and logs (defaults to
+            the function name).
+    """
+    def decorator(func):
+        op_name = operation_name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = _make_key(func, args, kwargs)
+            with _results_lock:
+                cached = _resources.get(op_name)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            value = run_single_flight(op_name, key, lambda: func(*args, **kwargs))
+            with _results_lock:
+                _resources[op_name] = (key, value)
+            return value
+
+        wrapper.clear = lambda: clear_query_cache(op_name)
+        return wrapper
+    return decorator
+
+
+def clear_query_cache(operation_name: str = None):
+    """Drop cached values (and shared resources) for one operation, or for all operations if None."""
+    with _results_lock:
+        if operation_name is None:
+            _results.clear()
+            _resources.clear()
+        else:
+            _results.pop(operation_name, None)
+            _resources.pop(operation_name, None)
+
+
+def format_data_as_of(cached_func, *args, **kwargs) -> str:
+    """Caption text for when a cached result was computed, e.g. "🕒 ข้อมูล ณ 01/03/2026 14:05:12".
+
+    Args:
+        cached_func: A function decorated with ``stale_while_revalidate``.
+        *args, **kwargs: The arguments the page called it with.
+    """
+    as_of = cached_func.data_as_of(*args, **kwargs)
+    if as_of is None:
+        return ""
+    text = f"🕒 ข้อมูล ณ {as_of.strftime('%d/%m/%Y %H:%M:%S')}"
+    if cached_func.is_refreshing(*args, **kwargs):
+        text += " (กำลังอัปเดตข้อมูลล่าสุดเบื้องหลัง)"
+    return text